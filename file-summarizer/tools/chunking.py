@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Dict, List, Sequence, Tuple
+from tools import tokenizer
+
+# Lines that can start or end a block: blank lines, code fences, headings and
+# table rows. Everything else is plain text and never looked at line by line.
+STRUCTURE_LINE = re.compile(
+    r"^(?:(?P<blank>[ \t]*(?:\r?\n|\Z))"
+    r"|(?P<fence> {0,3}(?:`{3,}|~{3,}))"
+    r"|(?P<heading> {0,3}#{1,6}(?:[ \t]|$))"
+    r"|(?P<table>[ \t]*\|))",
+    re.MULTILINE,
+)
+
+# A character range [start, end) of the text
+Span = Tuple[int, int]
+
+
+def _char_offsets(text: str, byte_offsets: Sequence[int]) -> List[int]:
+    """
+    Character offsets in ``text`` of ascending UTF-8 ``byte_offsets``, each
+    moved back to the start of the character it falls in.
+    """
+    if text.isascii():
+        return list(byte_offsets)
+    data = text.encode("utf-8")
+    # Characters started up to and including each byte
+    started = list(accumulate((byte & 0xC0) != 0x80 for byte in data))
+    return [started[b] - 1 if b < len(data) else len(text) for b in byte_offsets]
+
+
+def _token_windows(
+    text: str, token_ends: Sequence[int], size: int, overlap: int
+) -> List[str]:
+    """
+    Cuts ``text`` into windows of ``size`` tokens, each starting ``overlap``
+    tokens before the previous one ends. ``token_ends`` are the byte offsets
+    in ``text`` at which its tokens end. Windows are cut where tokens end,
+    moved back to a character boundary, so without overlap they add up to
+    exactly ``text``.
+    """
+    step = max(1, size - overlap)
+    first = 0
+    byte_ranges = []
+    while True:
+        last = min(len(token_ends), first + size)
+        byte_ranges.append(
+            (token_ends[first - 1] if first else 0, token_ends[last - 1])
+        )
+        if last == len(token_ends):
+            break
+        first += step
+    cuts = _char_offsets(text, [b for byte_range in byte_ranges for b in byte_range])
+    windows = [text[cuts[i] : cuts[i + 1]] for i in range(0, len(cuts), 2)]
+    return [window for window in windows if window]
+
+
+class StructuredChunker:
+    """
+    Splits markdown (or plain) text into chunks of at most max_tokens tokens
+    along its structure. The text is parsed into sections, each starting at
+    a heading, and sections into blocks: paragraphs, fenced code and tables.
+    Whole sections are packed into chunks; only a section that doesn't fit
+    on its own is split into its blocks, a block that doesn't fit at line
+    breaks, and a line that doesn't fit into token windows.
+
+    Token counts come from the tokens of the whole text, a token that
+    straddles a block boundary counting on both sides. A chunk encoded on
+    its own can still come out a token or two longer, so the chunks are
+    encoded once more at the end and any that don't fit are cut again.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        tokens: Sequence[int],
+        max_tokens: int,
+        window_overlap_tokens: int = 0,
+    ):
+        self.text = text
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.window_overlap_tokens = window_overlap_tokens
+        self.ascii = text.isascii()
+        self.token_ends = tokenizer.token_end_offsets(tokens)
+        self.sections: List[List[Span]] = []
+        # UTF-8 byte offset at each block boundary, the first token of the
+        # text from it and the number of tokens of the text up to it
+        self.boundary_bytes: Dict[int, int] = {}
+        self.first_tokens: Dict[int, int] = {}
+        self.end_tokens: Dict[int, int] = {}
+        self._parse()
+
+    def _boundaries(self) -> Dict[int, bool]:
+        """Character offsets where a block starts, mapped to whether a section starts there."""
+        text = self.text
+        boundaries = {0: True}
+        fence = None
+        # Start of the line after the last blank or table row seen, where a
+        # new block starts unless another blank or table row follows
+        after_blank = None
+        after_table = None
+        for m in STRUCTURE_LINE.finditer(text):
+            start = m.start()
+            if start == len(text):
+                break
+            line_end = text.find("\n", start)
+            line_end = len(text) if line_end == -1 else line_end + 1
+
+            if fence is not None:
+                line = text[start:line_end].strip()
+                if (
+                    m.group("fence")
+                    and line.startswith(fence)
+                    and not line.strip(fence[0])
+                ):
+                    fence = None
+                    if line_end < len(text):
+                        boundaries.setdefault(line_end, False)
+                continue
+
+            if after_blank is not None and after_blank < start:
+                boundaries.setdefault(after_blank, False)
+            if after_table is not None and after_table < start:
+                boundaries.setdefault(after_table, False)
+            kind = m.lastgroup
+
+            if kind == "blank":
+                after_blank = line_end
+                after_table = None
+                continue
+            if kind == "table":
+                if after_table != start:
+                    boundaries.setdefault(start, False)
+                after_table = line_end
+                after_blank = None
+                continue
+
+            after_blank = None
+            after_table = None
+            if kind == "heading":
+                boundaries[start] = True
+            else:
+                boundaries.setdefault(start, False)
+                fence = m.group("fence").strip()
+
+        for position in (after_blank, after_table):
+            if position is not None and position < len(text):
+                boundaries.setdefault(position, False)
+        return boundaries
+
+    def _parse(self):
+        boundaries = self._boundaries()
+        positions = sorted(boundaries)
+        self._index_tokens(positions + [len(self.text)])
+
+        section: List[Span] = []
+        for start, end in zip(positions, positions[1:] + [len(self.text)]):
+            if boundaries[start] and section:
+                self.sections.append(section)
+                section = []
+            section.append((start, end))
+        if section and self.text:
+            self.sections.append(section)
+
+    def _index_tokens(self, positions: List[int]):
+        """Records the tokens at each of the ascending ``positions``."""
+        previous = positions[0]
+        byte = self.boundary_bytes.get(previous, previous)
+        for position in positions:
+            if self.ascii:
+                byte = position
+            else:
+                byte += tokenizer.utf8_length(self.text[previous:position])
+                previous = position
+            self.boundary_bytes[position] = byte
+            # A token straddling the boundary is in both
+            self.first_tokens[position] = bisect_right(self.token_ends, byte)
+            self.end_tokens[position] = (
+                min(bisect_left(self.token_ends, byte) + 1, len(self.tokens))
+                if byte
+                else 0
+            )
+
+    def _token_count(self, span: Span) -> int:
+        return max(0, self.end_tokens[span[1]] - self.first_tokens[span[0]])
+
+    def _split_block(self, span: Span) -> List[Span]:
+        """
+        Cuts an oversized block into pieces of whole lines that fit
+        max_tokens, each as long as possible. A line that doesn't fit on its
+        own is returned as a piece of its own.
+        """
+        pieces = []
+        start = span[0]
+        while self._token_count((start, span[1])) > self.max_tokens:
+            first = self.first_tokens[start]
+            window = self.tokens[first : first + self.max_tokens]
+            # Characters covered by the longest piece that could fit
+            if self.ascii:
+                length = (
+                    self.token_ends[first + len(window) - 1]
+                    - self.boundary_bytes[start]
+                )
+            else:
+                length = len(tokenizer.decode_bytes(window).decode("utf-8", "ignore"))
+            end = self.text.rfind("\n", start, start + length) + 1
+            while end > start:
+                self._index_tokens([start, end])
+                if self._token_count((start, end)) <= self.max_tokens:
+                    break
+                # A token straddling the cut tipped it over
+                end = self.text.rfind("\n", start, end - 1) + 1
+            if end <= start:
+                # The line alone doesn't fit
+                end = self.text.find("\n", start, span[1]) + 1 or span[1]
+                self._index_tokens([start, end])
+            pieces.append((start, end))
+            start = end
+        if start < span[1]:
+            pieces.append((start, span[1]))
+        return pieces
+
+    def _span_windows(self, span: Span) -> List[str]:
+        """Cuts a line that doesn't fit into overlapping token windows."""
+        start_byte = self.boundary_bytes[span[0]]
+        end_byte = self.boundary_bytes[span[1]]
+        token_ends = [
+            min(token_end, end_byte) - start_byte
+            for token_end in self.token_ends[
+                self.first_tokens[span[0]] : self.end_tokens[span[1]]
+            ]
+        ]
+        return _token_windows(
+            self.text[span[0] : span[1]],
+            token_ends,
+            self.max_tokens,
+            self.window_overlap_tokens,
+        )
+
+    def _fit(self, chunks: List[str]) -> List[str]:
+        """Cuts again the chunks that are longer than max_tokens on their own."""
+        fitted = []
+        for chunk, count in zip(chunks, tokenizer.token_counts(chunks)):
+            if count <= self.max_tokens:
+                fitted.append(chunk)
+                continue
+            tokens = tokenizer.encode(chunk)
+            pieces = _token_windows(
+                chunk, tokenizer.token_end_offsets(tokens), self.max_tokens, 0
+            )
+            # A single character can't be cut any further
+            fitted.extend(self._fit(pieces) if len(pieces) > 1 else pieces)
+        return fitted
+
+    def chunks(self) -> List[str]:
+        chunks: List[str] = []
+        # Character range and token count of the chunk being packed
+        current = None
+        current_tokens = 0
+
+        def flush():
+            nonlocal current, current_tokens
+            if current is not None:
+                chunks.append(self.text[current[0] : current[1]])
+            current = None
+            current_tokens = 0
+
+        def add(span: Span):
+            nonlocal current, current_tokens
+            count = self._token_count(span)
+            if current is not None and current_tokens + count <= self.max_tokens:
+                current = (current[0], span[1])
+                current_tokens += count
+                return
+            flush()
+            if count <= self.max_tokens:
+                current = span
+                current_tokens = count
+            else:
+                chunks.extend(self._span_windows(span))
+
+        for section in self.sections:
+            section_span = (section[0][0], section[-1][1])
+            if self._token_count(section_span) <= self.max_tokens:
+                add(section_span)
+                continue
+            for block in section:
+                if self._token_count(block) <= self.max_tokens:
+                    add(block)
+                    continue
+                for piece in self._split_block(block):
+                    add(piece)
+        flush()
+        return self._fit(chunks)
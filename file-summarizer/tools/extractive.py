@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import re
+from typing import List, Tuple
+import numpy as np
+
+# Code fences are never compressed
+FENCED_CODE = re.compile(r"^ {0,3}(`{3,}|~{3,}).*?(?:^ {0,3}\1[ \t]*$|\Z)", re.M | re.S)
+# Units of extraction: lines, and sentences within long lines
+UNIT = re.compile(r"[^\n]*?(?:[.!?](?=\s)[ \t]*|\n|\Z)")
+# Indented code, or lines that read like it
+CODE_LINE = re.compile(
+    r"^(?: {4}|\t)\S|[;{}]\s*$|^\s*(?:def|class|function|return|import|from)\b"
+)
+WORD = re.compile(r"[^\W\d]\w*|\d+")
+DIGITS = re.compile(r"\d+")
+# Numbers and identifiers: camelCase, snake_case, dotted.names, paths, hex
+SPECIFIC = re.compile(
+    r"\d|\b[a-z]+[A-Z]\w*|\b\w+_\w+|\b\w+\.\w+\.?\w*|/\w+/|\b0x[0-9a-fA-F]+"
+)
+SPECIFIC_BOOST = 1.5
+# Written wherever units were left out
+GAP_MARKER = "[... {count} omitted ...]\n"
+
+
+def _units(text: str) -> List[Tuple[str, bool]]:
+    """Splits ``text`` into consecutive units, flagging those that must be kept."""
+    units = []
+    position = 0
+    for fence in FENCED_CODE.finditer(text):
+        units.extend(_text_units(text[position : fence.start()]))
+        units.append((fence.group(0), True))
+        position = fence.end()
+    units.extend(_text_units(text[position:]))
+    return units
+
+
+def _text_units(text: str) -> List[Tuple[str, bool]]:
+    units = []
+    for m in UNIT.finditer(text):
+        unit = m.group(0)
+        if unit:
+            units.append((unit, bool(CODE_LINE.search(unit))))
+    return units
+
+
+def compress(text: str, ratio: float) -> str:
+    """
+    Keeps the most informative sentences and lines of ``text``, about
+    ``ratio`` of its characters, in their original order, with a gap marker
+    wherever something was left out.
+
+    Units are scored by TF-IDF over the units of the text, and units with
+    numbers or identifiers are boosted. Digits are masked when comparing
+    units, so log lines that differ only in their numbers are repeats of one
+    line: the k-th repeat scores 1/(k+1) of the first, and repeats are the
+    first thing dropped. Code is always kept, and every kept unit is copied
+    verbatim.
+    """
+    units = _units(text)
+    candidates = [
+        i for i, (unit, keep) in enumerate(units) if not keep and unit.strip()
+    ]
+    if len(candidates) < 2:
+        return text
+
+    # Term occurrences as (unit, term) index pairs
+    vocabulary = {}
+    unit_ids = []
+    term_ids = []
+    # Index of each unit's first occurrence, and how many came before it
+    first_occurrence = np.arange(len(candidates))
+    repeats = np.zeros(len(candidates))
+    templates = {}
+    for n, i in enumerate(candidates):
+        masked = DIGITS.sub("0", units[i][0].lower())
+        template = " ".join(masked.split())
+        if template in templates:
+            first, count = templates[template]
+            templates[template] = (first, count + 1)
+            first_occurrence[n] = first
+            repeats[n] = count
+            continue
+        templates[template] = (n, 1)
+        for word in WORD.findall(masked):
+            unit_ids.append(n)
+            term_ids.append(vocabulary.setdefault(word, len(vocabulary)))
+
+    scores = np.zeros(len(candidates))
+    if term_ids:
+        pairs, counts = np.unique(
+            np.array(unit_ids, dtype=np.int64) * len(vocabulary)
+            + np.array(term_ids, dtype=np.int64),
+            return_counts=True,
+        )
+        pair_units = pairs // len(vocabulary)
+        pair_terms = pairs % len(vocabulary)
+        document_frequency = np.bincount(pair_terms, minlength=len(vocabulary))
+        idf = np.log((1 + len(candidates)) / (1 + document_frequency)) + 1
+        weights = (1 + np.log(counts)) * idf[pair_terms]
+        scores = np.bincount(pair_units, weights=weights, minlength=len(candidates))
+        terms_per_unit = np.bincount(pair_units, minlength=len(candidates))
+        scores /= np.sqrt(np.maximum(terms_per_unit, 1))
+    scores *= np.array(
+        [SPECIFIC_BOOST if SPECIFIC.search(units[i][0]) else 1.0 for i in candidates]
+    )
+    scores = scores[first_occurrence] / (1 + repeats)
+
+    lengths = np.array([len(units[i][0]) for i in candidates])
+    budget = ratio * lengths.sum()
+    order = np.argsort(-scores, kind="stable")
+    kept_count = int(np.searchsorted(np.cumsum(lengths[order]), budget)) + 1
+    kept = {candidates[n] for n in order[:kept_count]}
+
+    parts = []
+    omitted = 0
+    for i, (unit, keep) in enumerate(units):
+        if keep or i in kept or not unit.strip():
+            if omitted:
+                parts.append(GAP_MARKER.format(count=omitted))
+                omitted = 0
+            parts.append(unit)
+        else:
+            omitted += 1
+    if omitted:
+        parts.append(GAP_MARKER.format(count=omitted))
+    compressed = "".join(parts)
+    return compressed if len(compressed) < len(text) else text
@@ -1,5 +1,6 @@
 import os
 import gptscript
+from gptscript.fileinfo import FileInfo
 from pathlib import Path
 from tools.helper import setup_logger
 
@@ -93,3 +94,9 @@ async def read_file_in_workspace(filepath: str) -> bytes:
     wksp_file_path = _prepend_base_path(filepath, FILES_DIR)
     file_content: bytes = await gptscript_client.read_file_in_workspace(wksp_file_path)
     return file_content
+
+
+async def stat_file_in_workspace(filepath: str) -> FileInfo:
+    gptscript_client = gptscript.GPTScript()
+    wksp_file_path = _prepend_base_path(filepath, FILES_DIR)
+    return await gptscript_client.stat_file_in_workspace(wksp_file_path)
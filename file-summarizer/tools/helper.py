@@ -2,7 +2,7 @@
 import os
 import logging
 import sys
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 
 def setup_logger(name):
@@ -36,7 +36,7 @@ def setup_logger(name):
 logger = setup_logger(__name__)
 
 
-def get_openai_client() -> OpenAI:
+def _client_options() -> dict:
     # Check for OPENAI_API_KEY
     if "OPENAI_API_KEY" not in os.environ:
         sys.exit(
@@ -44,11 +44,30 @@ def get_openai_client() -> OpenAI:
             "Please set it before running the script, e.g.:\n\n"
             "  export OPENAI_API_KEY='sk-xxxxxxx'\n"
         )
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    logger.debug(f"Using base_url: {base_url}")
+    return {"base_url": base_url, "api_key": os.environ["OPENAI_API_KEY"]}
+
+
+def get_openai_client() -> OpenAI:
+    options = _client_options()
+    try:
+        client = OpenAI(**options)
+        return client
+    except Exception as e:
+        raise Exception(f"ERROR: Failed to initialize OpenAI client: {e}")
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """An AsyncOpenAI client that leaves retries to the caller.
+
+    The summarizer retries rate-limited and failed calls itself, so it can
+    lower its concurrency when it hits 429s instead of the client quietly
+    retrying them.
+    """
+    options = _client_options()
     try:
-        base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-        logger.debug(f"Using base_url: {base_url}")
-        api_key = os.environ["OPENAI_API_KEY"]
-        client = OpenAI(base_url=base_url, api_key=api_key)
+        client = AsyncOpenAI(**options, max_retries=0)
         return client
     except Exception as e:
         raise Exception(f"ERROR: Failed to initialize OpenAI client: {e}")
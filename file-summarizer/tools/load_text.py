@@ -3,8 +3,9 @@ from tools.helper import setup_logger
 import gptscript
 import os
 import json
+import codecs
 from gptscript.gptscript import Options
-from tools.gptscript_workspace import read_file_in_workspace
+from tools.gptscript_workspace import read_file_in_workspace, stat_file_in_workspace
 
 logger = setup_logger(__name__)
 
@@ -34,6 +35,30 @@ SUPPORTED_KNOWLEDGE_DOC_FILE_TYPES = (
 
 MAX_FILE_SIZE = 100_000_000
 
+# Leading bytes inspected to tell binary files from text
+SNIFF_BYTES = 8192
+BINARY_SIGNATURES = (
+    b"%PDF",  # PDF
+    b"PK\x03\x04",  # zip: docx, pptx, odt, xlsx, jar
+    b"\xd0\xcf\x11\xe0",  # OLE: doc, ppt, xls
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF8",
+    b"\x1f\x8b",  # gzip
+)
+
+
+def looks_binary(head: bytes) -> bool:
+    """Whether the leading bytes of a file belong to a binary (non-UTF-8 text) file."""
+    if head.startswith(BINARY_SIGNATURES) or b"\x00" in head:
+        return True
+    try:
+        # The sniffed bytes may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
 
 async def load_from_knowledge_tool(input_file: str) -> str:
     """Load text from a workspace file using the knowledge-load tool.
@@ -75,30 +100,57 @@ async def load_text_from_workspace_file(file_path: str, max_file_size: int = MAX
         str: The content of the file.
     """
 
-    # first read from gptscript workspace
+    # check the size before reading anything
     try:
-        file_content: bytes = await read_file_in_workspace(file_path)
+        file_size = (await stat_file_in_workspace(file_path)).size
     except Exception as e:
-        logger.error(
-            f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
-        )
-        raise ValueError(
-            f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
-        )
-    if len(file_content) > max_file_size:
+        # the file may still be readable, in which case its size is checked after reading
+        logger.warning(f"Failed to stat GPTScript workspace file {file_path}, Error: {e}")
+        file_size = None
+    if file_size is None and file_path.endswith(SUPPORTED_KNOWLEDGE_DOC_FILE_TYPES):
+        # the knowledge-load tool reads these itself, so read the file here just to size it
+        try:
+            file_size = len(await read_file_in_workspace(file_path))
+        except Exception as e:
+            logger.error(
+                f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
+            )
+            raise ValueError(
+                f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
+            )
+    if file_size is not None and file_size > max_file_size:
         raise Exception(
             f"File size exceeds {max_file_size} bytes"
         )
 
-    # if the file is not a supported knowledge doc file type, try to decode it as a plain text file using utf-8 encoding
+    # the knowledge-load tool reads supported knowledge doc file types itself
     if not file_path.endswith(SUPPORTED_KNOWLEDGE_DOC_FILE_TYPES):
         try:
-            file_content = file_content.decode("utf-8")
-            return file_content
-        except UnicodeDecodeError:
+            file_content: bytes = await read_file_in_workspace(file_path)
+        except Exception as e:
             logger.error(
-                f"Failed to decode file content from GPTScript workspace file {file_path}, Error: {e}"
+                f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
+            )
+            raise ValueError(
+                f"Failed to load file from GPTScript workspace file {file_path}, Error: {e}"
             )
+        if len(file_content) > max_file_size:
+            raise Exception(
+                f"File size exceeds {max_file_size} bytes"
+            )
+
+        # try to decode it as a plain text file using utf-8 encoding, unless its first bytes show it isn't one
+        if looks_binary(file_content[:SNIFF_BYTES]):
+            logger.info(f"GPTScript workspace file {file_path} is not a plain text file")
+        else:
+            try:
+                return str(file_content, "utf-8")
+            except UnicodeDecodeError as e:
+                logger.error(
+                    f"Failed to decode file content from GPTScript workspace file {file_path}, Error: {e}"
+                )
+        # the knowledge-load tool reads the file itself
+        del file_content
 
     # if the file is a supported knowledge doc file type, or the file is not a plain text file, try to load it using the knowledge-load tool
     try:
@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
+import asyncio
 from tools.load_text import load_text_from_workspace_file
-from tools.helper import setup_logger, get_openai_client
-
-import tiktoken
+from tools.helper import setup_logger, get_async_openai_client
+from tools import tokenizer
 
 logger = setup_logger(__name__)
 
-TIKTOKEN_MODEL = "gpt-4o"
-enc = tiktoken.encoding_for_model(TIKTOKEN_MODEL)
+TIKTOKEN_MODEL = tokenizer.TIKTOKEN_MODEL
+enc = tokenizer.enc
 TOKEN_THRESHOLD = 10000
 
 MAX_FILE_SIZE = 100_000_000
@@ -25,31 +25,46 @@ async def read_file(input_file: str, max_file_size: int = MAX_FILE_SIZE):
     from tools.summarizer import (
         DocumentSummarizer,
         MODEL,
+        MAP_MODEL,
+        MAP_MAX_OUTPUT_TOKENS,
         MAX_CHUNK_TOKENS,
         MAX_WORKERS,
     )
+    from tools.summary_cache import SummaryCache
 
     logger.info(f"Input file: {input_file}")
     if not input_file:
         raise ValueError("Error: INPUT_FILE environment variable is not set")
 
     file_content: str = await load_text_from_workspace_file(input_file, max_file_size)
-    tokens = enc.encode(file_content)
+
+    # no token is shorter than a byte, so a short enough file can skip tokenization
+    if tokenizer.utf8_length(file_content) <= TOKEN_THRESHOLD:
+        return file_content
+    # the tokens are reused for chunking if the file has to be summarized
+    tokens = tokenizer.encode(file_content)
 
     # if the file has too many tokens, summarize it and return the summary
     if len(tokens) > TOKEN_THRESHOLD:
         response_str = f"The original file {input_file} contains too many tokens ({len(tokens)}), summarizing it...\n"
+        cache = await asyncio.to_thread(SummaryCache.open_default)
         summarizer = DocumentSummarizer(
-            get_openai_client(),
+            get_async_openai_client(),
             model=MODEL,
+            map_model=MAP_MODEL,
+            map_max_output_tokens=MAP_MAX_OUTPUT_TOKENS,
             max_chunk_tokens=MAX_CHUNK_TOKENS,
             max_workers=MAX_WORKERS,
+            cache=cache,
         )
         try:
-            final_summary: str = summarizer.summarize(file_content)
+            final_summary: str = await summarizer.summarize(file_content, tokens)
         except Exception as e:
             logger.error(f"Summarization failed: {e}")
             raise Exception(f"ERROR: Summarization failed: {e}")
+        finally:
+            if cache is not None:
+                await asyncio.to_thread(cache.close)
 
         response_str += f"Here is the summary of the file {input_file}'s content:\n\n{final_summary}"
         return response_str
@@ -1,27 +1,114 @@
 #!/usr/bin/env python3
-import tiktoken
-from typing import List
-import concurrent.futures
+import asyncio
+import random
+import time
+from typing import List, Optional, Sequence, Tuple
+import openai
 import os
 from tools.helper import setup_logger
+from tools import extractive, tokenizer
+from tools.chunking import StructuredChunker
+from tools.summary_cache import SummaryCache, cache_key
 
 logger = setup_logger(__name__)
 
 MAX_CONTEXT_TOKENS = 128000
-MAX_OUTPUT_TOKENS = 16384
+MAX_OUTPUT_TOKENS = int(os.getenv("SUMMARIZER_REDUCE_MAX_OUTPUT_TOKENS", "16384"))
+# Output budget of the chunk summaries, which are the next level's input
+MAP_MAX_OUTPUT_TOKENS = int(
+    os.getenv("SUMMARIZER_MAP_MAX_OUTPUT_TOKENS", str(MAX_OUTPUT_TOKENS))
+)
 OVERHEAD_TOKENS = 2000
-MAX_CHUNK_TOKENS = MAX_CONTEXT_TOKENS - MAX_OUTPUT_TOKENS - OVERHEAD_TOKENS
+MAX_CHUNK_TOKENS = (
+    MAX_CONTEXT_TOKENS - max(MAX_OUTPUT_TOKENS, MAP_MAX_OUTPUT_TOKENS) - OVERHEAD_TOKENS
+)
 CHUNK_OVERLAP_TOKENS = 0
-MAX_WORKERS = 4
+MAX_WORKERS = int(os.getenv("SUMMARIZER_MAX_CONCURRENCY", "8"))
+# Retries per LLM call on rate limits, timeouts and server errors
+MAX_RETRIES = 6
+MAX_BACKOFF_SECONDS = 60.0
+# Share of each document chunk kept by extractive pre-compression before it
+# is sent to the LLM; 0 (the default) sends chunks whole
+EXTRACTIVE_RATIO = float(os.getenv("SUMMARIZER_EXTRACTIVE_RATIO", "0"))
 
 MODEL = os.getenv("OBOT_DEFAULT_LLM_MODEL", "gpt-4o")
-TIKTOKEN_MODEL = "gpt-4o"
+# Summarizes the chunks and the groups of summaries in between, which is most
+# of the calls; MODEL only writes the final consolidated summary. Set
+# SUMMARIZER_MAP_MODEL (e.g. to a mini model) to make those calls cheaper
+MAP_MODEL = os.getenv("SUMMARIZER_MAP_MODEL") or MODEL
+TIKTOKEN_MODEL = tokenizer.TIKTOKEN_MODEL
+SUMMARY_SEPARATOR = "\n\n"
+
+
+class AdaptiveConcurrency:
+    """
+    Caps the number of in-flight LLM calls. The cap is halved on every rate
+    limit response and grows back by one after as many successful calls as
+    the current cap, up to max_limit.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, rate_limited: bool = False):
+        async with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Honor the server's retry-after header, otherwise back off exponentially."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return min(MAX_BACKOFF_SECONDS, float(response.headers["retry-after"]))
+        except (KeyError, ValueError):
+            pass
+    return min(MAX_BACKOFF_SECONDS, 2**attempt) * (0.5 + random.random() / 2)
+
+
+class StageStats:
+    """Calls, tokens and time spent in one summarization stage."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cached = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Summed over calls, which overlap
+        self.call_seconds = 0.0
+        # Time the stage was running
+        self.wall_seconds = 0.0
+
+    def describe(self) -> str:
+        return (
+            f"{self.calls} call(s), {self.cached} cached, "
+            f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, "
+            f"{self.wall_seconds:.1f}s wall, {self.call_seconds:.1f}s in calls"
+        )
 
 
 class DocumentSummarizer:
     """
     Summarizes very large documents with hierarchical chunking using gpt-4o.
-    Supports parallel calls to speed up summarization.
+    Summarizes chunks concurrently, adapting the concurrency to rate limits.
     Optionally uses a 'topic' for specialized focus and structure.
     """
 
@@ -36,34 +123,51 @@ class DocumentSummarizer:
         chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
         max_workers: int = MAX_WORKERS,
         verbose: bool = True,
+        cache: Optional[SummaryCache] = None,
+        extractive_ratio: float = EXTRACTIVE_RATIO,
+        map_model: Optional[str] = None,
+        map_max_output_tokens: Optional[int] = None,
     ):
         """
-        :param client: An OpenAI() client instance (from openai import OpenAI).
-        :param model: Model name (e.g., 'gpt-4o')
+        :param client: An AsyncOpenAI() client instance (from openai import AsyncOpenAI).
+        :param model: Model name for the final reduction (e.g., 'gpt-4o')
         :param max_context_tokens: Maximum context length for GPT-4o (default: 128000).
-        :param max_output_tokens: Maximum tokens GPT-4o can generate (default: 16384).
+        :param max_output_tokens: Maximum tokens of the final summary (default: SUMMARIZER_REDUCE_MAX_OUTPUT_TOKENS or 16384).
         :param overhead_tokens: Token buffer for system/developer instructions, etc. (default: 2000).
-        :param max_chunk_tokens: Maximum tokens per chunk (default: max_context_tokens - max_output_tokens - overhead_tokens).
-        :param max_workers: Number of parallel threads for summarization calls (default: 4).
+        :param max_chunk_tokens: Maximum tokens per chunk (default: max_context_tokens - the larger output budget - overhead_tokens).
+        :param max_workers: Maximum number of concurrent summarization calls (default: SUMMARIZER_MAX_CONCURRENCY or 8).
         :param verbose: Whether to print additional logs and progress information.
+        :param cache: Optional SummaryCache for reusing summaries across runs.
+        :param extractive_ratio: Share of each document chunk kept by extractive pre-compression, 0 to disable (default: SUMMARIZER_EXTRACTIVE_RATIO or 0).
+        :param map_model: Model name for summarizing chunks and groups of summaries (default: model).
+        :param map_max_output_tokens: Maximum tokens per chunk summary (default: max_output_tokens).
         """
         self.client = client
         self.model = model
+        self.map_model = map_model or model
         self.max_context_tokens = max_context_tokens
         self.max_output_tokens = max_output_tokens
+        self.map_max_output_tokens = map_max_output_tokens or max_output_tokens
+        self.stats = {"map": StageStats(), "reduce": StageStats()}
         self.overhead_tokens = overhead_tokens
         self.max_workers = max_workers
+        self.concurrency = AdaptiveConcurrency(max_workers)
         self.verbose = verbose
         self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.cache = cache
+        self.extractive_ratio = extractive_ratio
 
         # always use gpt-4o for tokenization
-        self.enc = tiktoken.encoding_for_model(TIKTOKEN_MODEL)
+        self.enc = tokenizer.enc
+        self.separator_token_count = len(tokenizer.encode(SUMMARY_SEPARATOR))
 
         self.max_chunk_size = (
             max_chunk_tokens
             if max_chunk_tokens is not None
             else (
-                self.max_context_tokens - self.max_output_tokens - self.overhead_tokens
+                self.max_context_tokens
+                - max(self.max_output_tokens, self.map_max_output_tokens)
+                - self.overhead_tokens
             )
         )
 
@@ -72,61 +176,129 @@ class DocumentSummarizer:
                 "Calculated or provided max_chunk_size is non-positive. "
                 "Adjust max_chunk_tokens or reduce overhead_tokens/max_output_tokens."
             )
+        if not 0 <= self.extractive_ratio <= 1:
+            raise ValueError("extractive_ratio must be between 0 and 1.")
 
         if self.verbose:
             logger.debug(f"Using model: {self.model}")
+            logger.debug(f"Using map model: {self.map_model}")
             logger.debug(f"max_context_tokens: {self.max_context_tokens}")
             logger.debug(f"max_output_tokens: {self.max_output_tokens}")
+            logger.debug(f"map_max_output_tokens: {self.map_max_output_tokens}")
             logger.debug(f"overhead_tokens: {self.overhead_tokens}")
             logger.debug(f"max_chunk_size: {self.max_chunk_size}")
             logger.debug(f"max_workers: {self.max_workers}")
+            logger.debug(f"extractive_ratio: {self.extractive_ratio}")
 
-    def chunk_text(self, text: str) -> List[str]:
+    def chunk_text(
+        self, text: str, tokens: Optional[Sequence[int]] = None
+    ) -> List[str]:
         """
-        Splits text into token-based chunks, ensuring each chunk fits within
+        Splits text into chunks along its markdown structure (headings, code
+        fences, tables, paragraphs), ensuring each chunk fits within
         (max_context_tokens - overhead_tokens - max_output_tokens).
+        Pass ``tokens`` when the text has already been encoded.
         """
-        tokens = self.enc.encode(text)
-        chunks = []
+        if tokens is None:
+            tokens = tokenizer.encode(text)
 
         if self.verbose:
             logger.debug(f"Total tokens in document: {len(tokens)}")
             logger.debug("Splitting into chunks...")
 
-        for i in range(0, len(tokens), self.max_chunk_size - self.chunk_overlap_tokens):
-            chunk_slice = tokens[i : i + self.max_chunk_size]
-            chunk_text = self.enc.decode(chunk_slice)
-            chunks.append(chunk_text)
+        chunks = StructuredChunker(
+            text, tokens, self.max_chunk_size, self.chunk_overlap_tokens
+        ).chunks()
 
         if self.verbose:
             logger.debug(f"Created {len(chunks)} chunk(s).")
 
         return chunks
 
-    def chat_completion(
+    async def chat_completion(
         self,
         system_prompt: str,
         user_prompt: str,
         max_tokens: int = MAX_OUTPUT_TOKENS,
         temperature: float = 0.1,
+        stage: str = "reduce",
     ) -> str:
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature,
+        """
+        One chat completion for ``stage`` ("map" or "reduce"), with that
+        stage's model, waiting for a concurrency slot first. Rate limits,
+        timeouts and server errors are retried with backoff; rate limits also
+        lower the concurrency for every other call. Completions are served
+        from and stored in the summary cache, if there is one.
+        """
+        model = self.map_model if stage == "map" else self.model
+        stats = self.stats[stage]
+        stats.calls += 1
+        key = None
+        if self.cache is not None:
+            key = cache_key(model, system_prompt, user_prompt, max_tokens, temperature)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                stats.cached += 1
+                return cached
+        summary = await self._create_completion(
+            model, system_prompt, user_prompt, max_tokens, temperature, stats
         )
-        return response.choices[0].message.content.strip()
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, summary)
+        return summary
 
-    def summarize_chunk(self, chunk: str) -> str:
+    async def _create_completion(
+        self,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        temperature: float,
+        stats: StageStats,
+    ) -> str:
+        for attempt in range(MAX_RETRIES + 1):
+            await self.concurrency.acquire()
+            rate_limited = False
+            started = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                if response.usage is not None:
+                    stats.prompt_tokens += response.usage.prompt_tokens
+                    stats.completion_tokens += response.usage.completion_tokens
+                return response.choices[0].message.content.strip()
+            except (
+                openai.RateLimitError,
+                openai.APIConnectionError,
+                openai.InternalServerError,
+            ) as e:
+                rate_limited = isinstance(e, openai.RateLimitError)
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = _retry_delay(e, attempt)
+                if self.verbose:
+                    logger.debug(
+                        f"{type(e).__name__}, retrying in {delay:.1f}s "
+                        f"(concurrency limit {self.concurrency.limit})"
+                    )
+            finally:
+                stats.call_seconds += time.monotonic() - started
+                await self.concurrency.release(rate_limited)
+            await asyncio.sleep(delay)
+
+    async def summarize_chunk(self, chunk: str) -> str:
         """
         Summarizes a single chunk using an intensive, detail-preserving prompt.
         """
         system_prompt = f"""You are an expert in information preservation and technical documentation.
-Your task is to create a dense, detailed retention of the input content with less than {self.max_output_tokens // 2} words.
+Your task is to create a dense, detailed retention of the input content with less than {self.map_max_output_tokens // 2} words.
 
 Critical rules:
 
@@ -162,36 +334,38 @@ Critical rules:
 {chunk}
 """
 
-        return self.chat_completion(
+        return await self.chat_completion(
             system_prompt,
             user_prompt,
-            max_tokens=self.max_output_tokens,
+            max_tokens=self.map_max_output_tokens,
             temperature=0.1,
+            stage="map",
         )
 
-    def summarize_chunks_in_parallel(self, chunks: List[str]) -> List[str]:
+    async def summarize_chunks_in_parallel(self, chunks: List[str]) -> List[str]:
         """
-        Summarize multiple chunks in parallel using ThreadPoolExecutor.
+        Summarize multiple chunks concurrently. Summaries are returned in the
+        same order as the chunks.
         """
         if self.verbose:
             logger.debug("Starting multi-pass summarization...")
-        summaries = []
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_workers
-        ) as executor:
-            # Dispatch summarization tasks
-            future_to_chunk = {
-                executor.submit(self.summarize_chunk, chunk): chunk for chunk in chunks
-            }
-            for future in concurrent.futures.as_completed(future_to_chunk):
-                summaries.append(future.result())
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(self.summarize_chunk(chunk)) for chunk in chunks]
+        try:
+            summaries = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self.stats["map"].wall_seconds += time.monotonic() - started
 
         if self.verbose:
             logger.debug(f"Summarized {len(chunks)} chunk(s) in parallel.")
 
         return summaries
 
-    def final_reduction(self, text: str) -> str:
+    async def final_reduction(self, text: str) -> str:
         """
         Produces a final, consolidated version of the retained information.
         Maintains maximum detail in a cohesive format.
@@ -219,37 +393,141 @@ Requirements:
 
 {text}"""
 
-        return self.chat_completion(
-            system_prompt,
-            user_prompt,
-            max_tokens=self.max_output_tokens,
-            temperature=0.1,
-        )
+        started = time.monotonic()
+        try:
+            return await self.chat_completion(
+                system_prompt,
+                user_prompt,
+                max_tokens=self.max_output_tokens,
+                temperature=0.1,
+                stage="reduce",
+            )
+        finally:
+            self.stats["reduce"].wall_seconds += time.monotonic() - started
 
-    def iterative_summarize(self, text_to_summarize: str) -> str:
+    def compress_chunks(self, chunks: List[str]) -> List[str]:
         """
-        Recursively summarizes the text and merges the summaries until it is reduced to a single (summary) chunk.
+        Shrinks each document chunk to its most informative sentences and
+        lines, about extractive_ratio of it, keeping code verbatim.
         """
+        compressed = [
+            extractive.compress(chunk, self.extractive_ratio) for chunk in chunks
+        ]
+        if self.verbose:
+            before = sum(len(chunk) for chunk in chunks)
+            after = sum(len(chunk) for chunk in compressed)
+            logger.debug(
+                f"Extractive pre-compression kept {after} of {before} characters "
+                f"({after / max(before, 1):.0%})."
+            )
+        return compressed
 
-        chunks = self.chunk_text(text_to_summarize)
-        # if there is only one chunk, we are done
-        if len(chunks) <= 1:
+    def pack_summaries(self, token_counts: List[int]) -> List[List[int]]:
+        """
+        Greedily packs consecutive summaries, given their token counts, into
+        groups that fit max_chunk_size. Returns the summary indices per group.
+        """
+        groups = []
+        size = 0
+        for i, count in enumerate(token_counts):
+            if (
+                groups
+                and size + self.separator_token_count + count <= self.max_chunk_size
+            ):
+                groups[-1].append(i)
+                size += self.separator_token_count + count
+            else:
+                groups.append([i])
+                size = count
+        return groups
+
+    async def iterative_summarize(
+        self, text_to_summarize: str, tokens: Optional[Sequence[int]] = None
+    ) -> str:
+        """
+        Reduces the text as a map-reduce tree until it fits in a single chunk:
+        the chunks are summarized in parallel, then at every level consecutive
+        summaries are packed into groups that fit max_chunk_size and each
+        group is summarized in parallel, so no summary is ever split across
+        two groups.
+        Pass ``tokens`` when the text has already been encoded.
+        """
+        if tokens is None:
+            tokens = tokenizer.encode(text_to_summarize)
+        # if it fits in one chunk, we are done
+        if len(tokens) <= self.max_chunk_size:
             return text_to_summarize
 
-        # Otherwise, split the text into chunks and summarize them in parallel
-        next_level_summaries = self.summarize_chunks_in_parallel(chunks)
+        chunks = self.chunk_text(text_to_summarize, tokens)
         if self.verbose:
-            logger.debug(
-                f"Combining {len(next_level_summaries)} summaries into a new text..."
+            logger.debug(f"Level 1: summarizing {len(chunks)} chunk(s)...")
+        if 0 < self.extractive_ratio < 1:
+            chunks = self.compress_chunks(chunks)
+        summaries = await self.summarize_chunks_in_parallel(chunks)
+        # (summary, token count); counts are carried over for summaries that
+        # move up a level unchanged
+        nodes: List[Tuple[str, int]] = [
+            (summary, len(tokenizer.encode(summary))) for summary in summaries
+        ]
+
+        level = 1
+        while True:
+            groups = self.pack_summaries([count for _, count in nodes])
+            if len(groups) == 1:
+                if self.verbose:
+                    logger.debug(
+                        f"Reduced to {len(nodes)} summaries that fit in one chunk after {level} level(s)."
+                    )
+                return SUMMARY_SEPARATOR.join(summary for summary, _ in nodes)
+
+            level += 1
+            # A group of one is passed up as is, unless no group could be
+            # packed at all, in which case every summary is shortened
+            progress = any(len(group) > 1 for group in groups)
+            to_reduce = [
+                i for i, group in enumerate(groups) if len(group) > 1 or not progress
+            ]
+            if self.verbose:
+                logger.debug(
+                    f"Level {level}: reducing {len(nodes)} summaries in "
+                    f"{len(to_reduce)} group(s), {len(groups) - len(to_reduce)} passed up unchanged..."
+                )
+            reduced = await self.summarize_chunks_in_parallel(
+                [
+                    SUMMARY_SEPARATOR.join(nodes[i][0] for i in groups[g])
+                    for g in to_reduce
+                ]
             )
-        return self.iterative_summarize("\n\n".join(next_level_summaries))
-
-    def summarize(self, document_text: str) -> str:
+            reduced_by_group = dict(zip(to_reduce, reduced))
+            nodes = [
+                (
+                    (reduced_by_group[g], len(tokenizer.encode(reduced_by_group[g])))
+                    if g in reduced_by_group
+                    else nodes[group[0]]
+                )
+                for g, group in enumerate(groups)
+            ]
+
+    async def summarize(
+        self, document_text: str, tokens: Optional[Sequence[int]] = None
+    ) -> str:
         """
         Main entry point for summarization:
         1) Recursively merge until single summary/chunk with less than MAX_CHUNK_TOKENS remains
         2) Perform final reduction for a cohesive, detail-rich result
+        Pass ``tokens`` when the document has already been encoded.
         """
-        reduced_summary = self.iterative_summarize(document_text)
-        final_summary = self.final_reduction(reduced_summary)
+        reduced_summary = await self.iterative_summarize(document_text, tokens)
+        final_summary = await self.final_reduction(reduced_summary)
+        if self.verbose:
+            logger.debug(
+                f"Map stage ({self.map_model}): {self.stats['map'].describe()}"
+            )
+            logger.debug(
+                f"Reduce stage ({self.model}): {self.stats['reduce'].describe()}"
+            )
+        if self.verbose and self.cache is not None:
+            logger.debug(
+                f"Summary cache: {self.cache.hits} hit(s), {self.cache.misses} miss(es)"
+            )
         return final_summary
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from tools.helper import setup_logger
+
+logger = setup_logger(__name__)
+
+# Set SUMMARY_CACHE_PATH to an empty string to disable the cache
+SUMMARY_CACHE_PATH = os.getenv(
+    "SUMMARY_CACHE_PATH",
+    os.path.join(
+        os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "file-summarizer",
+        "summaries.db",
+    ),
+)
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "20000"))
+# Seconds to wait for another process's lock on the file; a lookup that
+# times out is a miss, and a store that times out is dropped
+SUMMARY_CACHE_TIMEOUT = float(os.getenv("SUMMARY_CACHE_TIMEOUT", "1"))
+
+# Bump when the way completions are requested changes in a way the key below
+# doesn't capture
+PROMPT_VERSION = 1
+
+
+def cache_key(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    temperature: float,
+) -> str:
+    """
+    Key for one completion. The prompts are hashed in full, so a changed
+    chunk, instruction or word limit never hits an old entry.
+    """
+    payload = json.dumps(
+        [PROMPT_VERSION, model, max_tokens, temperature, system_prompt, user_prompt]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    Summaries already produced for a chunk, kept in SQLite across runs so
+    re-summarizing the same or a partially changed file only pays for the
+    chunks that changed. Cache errors are logged and never fail a summary.
+
+    Methods block on SQLite, so async callers run them in a worker thread;
+    the connection is shared between threads under a lock.
+    """
+
+    def __init__(self, path: str, max_entries: int = SUMMARY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Other summarizer processes may share the file
+        self.conn = sqlite3.connect(
+            path, timeout=SUMMARY_CACHE_TIMEOUT, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.commit()
+        # Entries left over from runs that ended without closing the cache
+        self._evict()
+
+    @classmethod
+    def open_default(cls) -> Optional["SummaryCache"]:
+        """The cache at SUMMARY_CACHE_PATH, or None if disabled or unusable."""
+        if not SUMMARY_CACHE_PATH:
+            return None
+        try:
+            return cls(SUMMARY_CACHE_PATH)
+        except Exception as e:
+            logger.warning(
+                f"Summary cache disabled, failed to open {SUMMARY_CACHE_PATH}: {e}"
+            )
+            return None
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT summary FROM summaries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE summaries SET last_used = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self.conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache read failed: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, summary: str):
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO summaries (key, summary, last_used) "
+                    "VALUES (?, ?, ?)",
+                    (key, summary, time.time()),
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache write failed: {e}")
+
+    def _evict(self):
+        """Delete the least recently used entries beyond max_entries."""
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "DELETE FROM summaries WHERE key IN ("
+                    "SELECT key FROM summaries ORDER BY last_used DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Summary cache eviction failed: {e}")
+
+    def close(self):
+        """Evict the least recently used entries beyond max_entries and close."""
+        try:
+            self._evict()
+        finally:
+            with self.lock:
+                self.conn.close()
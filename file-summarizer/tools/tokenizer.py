@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+from array import array
+from itertools import accumulate
+from typing import Iterator, List, Sequence
+import tiktoken
+
+# always use gpt-4o for tokenization
+TIKTOKEN_MODEL = "gpt-4o"
+enc = tiktoken.encoding_for_model(TIKTOKEN_MODEL)
+
+# Large texts are encoded in segments of about this many characters, cut at
+# line breaks, a batch of segments at a time on tiktoken's threads
+SEGMENT_CHARS = 1_000_000
+SEGMENTS_PER_BATCH = 8
+# Short texts, such as chunks, counted per batch
+COUNT_BATCH_SIZE = 64
+
+
+def utf8_length(text: str) -> int:
+    """
+    Byte length of ``text`` in UTF-8, an upper bound on its token count since
+    every token covers at least one byte.
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-8"))
+
+
+def _segments(text: str) -> Iterator[str]:
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + SEGMENT_CHARS)
+        if end < len(text):
+            cut = text.rfind("\n", start, end)
+            if cut > start:
+                end = cut + 1
+        yield text[start:end]
+        start = end
+
+
+def encode(text: str) -> array:
+    """
+    Tokens of ``text`` as a compact array of 32-bit ids, rather than a list
+    of Python ints several times its size. Special-token text is encoded as
+    ordinary text.
+    """
+    tokens = array("I")
+    batch = []
+    for segment in _segments(text):
+        batch.append(segment)
+        if len(batch) == SEGMENTS_PER_BATCH:
+            for segment_tokens in enc.encode_ordinary_batch(batch):
+                tokens.extend(segment_tokens)
+            batch = []
+    if batch:
+        for segment_tokens in enc.encode_ordinary_batch(batch):
+            tokens.extend(segment_tokens)
+    return tokens
+
+
+def token_counts(texts: Sequence[str]) -> List[int]:
+    """Token count of each of ``texts``, encoded a batch at a time."""
+    counts = []
+    for i in range(0, len(texts), COUNT_BATCH_SIZE):
+        batch = list(texts[i : i + COUNT_BATCH_SIZE])
+        counts.extend(len(tokens) for tokens in enc.encode_ordinary_batch(batch))
+    return counts
+
+
+def decode(tokens: Sequence[int]) -> str:
+    if isinstance(tokens, array):
+        tokens = tokens.tolist()
+    return enc.decode(tokens)
+
+
+def decode_bytes(tokens: Sequence[int]) -> bytes:
+    if isinstance(tokens, array):
+        tokens = tokens.tolist()
+    return enc.decode_bytes(tokens)
+
+
+_token_byte_lengths = None
+
+
+def token_end_offsets(tokens: Sequence[int]) -> array:
+    """Byte offset in the UTF-8 text at which each token ends."""
+    global _token_byte_lengths
+    if _token_byte_lengths is None:
+        lengths = array("I")
+        for token in range(enc.n_vocab):
+            try:
+                lengths.append(len(enc.decode_single_token_bytes(token)))
+            except KeyError:
+                lengths.append(0)
+        _token_byte_lengths = lengths
+    return array("Q", accumulate(map(_token_byte_lengths.__getitem__, tokens)))
@@ -0,0 +1,153 @@
+"""
+Background compaction of superseded file versions.
+
+Re-uploading a file leaves the previous ``files`` row behind with
+``is_latest_version=False`` and its full extracted text, so busy knowledge
+sets accumulate large rows that every metadata scan has to read. The
+retention policy trims them:
+
+- VERSION_RETENTION_COUNT: keep this many versions of each file (including
+  the latest).
+- VERSION_RETENTION_DAYS: keep superseded versions this many days.
+- VERSION_DROP_TEXT: drop the extracted text of superseded versions that
+  are kept (their chunks are already gone).
+
+With both limits set, a superseded version is kept while either still holds
+it. The latest version of a file is never touched.
+
+Knowledge sets are compacted one at a time, in batches of at most
+COMPACTION_BATCH_SIZE files per transaction with COMPACTION_BATCH_DELAY_SECONDS
+between batches, so compaction never holds long locks or saturates the
+database. The server runs it every COMPACTION_INTERVAL_SECONDS; it can also
+be run once by hand:
+
+    python -m app.compaction
+"""
+
+import argparse
+import asyncio
+import json
+from dataclasses import asdict, dataclass
+
+import app.metrics as metrics
+import app.vector_db as db
+from app.config import (
+    VERSION_RETENTION_COUNT,
+    VERSION_RETENTION_DAYS,
+    VERSION_DROP_TEXT,
+    COMPACTION_INTERVAL_SECONDS,
+    COMPACTION_BATCH_SIZE,
+    COMPACTION_BATCH_DELAY_SECONDS,
+)
+
+# Knowledge sets fetched per page while walking all of them
+SET_PAGE_SIZE = 1000
+
+
+@dataclass
+class CompactionReport:
+    knowledge_sets: int = 0
+    versions_deleted: int = 0
+    texts_dropped: int = 0
+    reclaimed_bytes: int = 0
+
+
+def policy_configured() -> bool:
+    return bool(VERSION_RETENTION_COUNT or VERSION_RETENTION_DAYS or VERSION_DROP_TEXT)
+
+
+async def _in_batches(step, action: str, report: CompactionReport) -> int:
+    """Run ``step`` until it does less than a full batch; returns files handled."""
+    handled = 0
+    while True:
+        count, reclaimed = await step()
+        handled += count
+        report.reclaimed_bytes += reclaimed
+        metrics.COMPACTED_FILES.inc(count, action=action)
+        metrics.COMPACTION_RECLAIMED_BYTES.inc(reclaimed)
+        if count < COMPACTION_BATCH_SIZE:
+            return handled
+        await asyncio.sleep(COMPACTION_BATCH_DELAY_SECONDS)
+
+
+async def compact_knowledge_set(
+    user_id: str, knowledge_set_id: str, report: CompactionReport
+):
+    """Apply the retention policy to one knowledge set."""
+    report.knowledge_sets += 1
+    report.versions_deleted += await _in_batches(
+        lambda: db.delete_expired_versions(
+            user_id,
+            knowledge_set_id,
+            VERSION_RETENTION_COUNT,
+            VERSION_RETENTION_DAYS,
+            COMPACTION_BATCH_SIZE,
+        ),
+        "deleted",
+        report,
+    )
+    if VERSION_DROP_TEXT:
+        report.texts_dropped += await _in_batches(
+            lambda: db.drop_superseded_text(
+                user_id, knowledge_set_id, COMPACTION_BATCH_SIZE
+            ),
+            "text_dropped",
+            report,
+        )
+
+
+async def compact() -> CompactionReport:
+    """One compaction pass over every knowledge set."""
+    report = CompactionReport()
+    if not policy_configured():
+        return report
+
+    after = None
+    while True:
+        page = await db.list_all_knowledge_sets(after, SET_PAGE_SIZE)
+        for row in page:
+            try:
+                await compact_knowledge_set(row.user_id, row.knowledge_set_id, report)
+            except db.TenantMoving:
+                # Compacted on its new shard next time
+                continue
+        if len(page) < SET_PAGE_SIZE:
+            return report
+        after = (page[-1].user_id, page[-1].knowledge_set_id)
+
+
+async def run_periodically():
+    """Server background task: compact every COMPACTION_INTERVAL_SECONDS."""
+    if COMPACTION_INTERVAL_SECONDS <= 0 or not policy_configured():
+        return
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
+        try:
+            report = await compact()
+        except Exception as e:
+            print(f"Warning: version compaction failed: {e}")
+            continue
+        if report.versions_deleted or report.texts_dropped:
+            print(
+                f"✓ Compaction: deleted {report.versions_deleted} versions, dropped "
+                f"text of {report.texts_dropped}, reclaimed {report.reclaimed_bytes} bytes"
+            )
+
+
+def main():
+    argparse.ArgumentParser(
+        description="Apply the version retention policy to every knowledge set once"
+    ).parse_args()
+
+    async def run():
+        try:
+            await db.init_db()
+            return await compact()
+        finally:
+            await db.dispose()
+
+    print(json.dumps(asdict(asyncio.run(run())), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ All environment variables and their defaults are defined here.
 """
 
 import os
+import tempfile
+from typing import Dict, Literal
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings
 
@@ -27,14 +29,51 @@ class Config(BaseSettings):
         description="PostgreSQL database connection URL",
         alias="DATABASE_URL",
     )
+    database_shards: str = Field(
+        default="",
+        description="Comma-separated name=url shard databases; the first also holds the tenant placement directory (empty = DATABASE_URL only)",
+        alias="DATABASE_SHARDS",
+    )
+    shard_virtual_nodes: int = Field(
+        default=64,
+        description="Points per shard on the consistent hash ring",
+        alias="SHARD_VIRTUAL_NODES",
+    )
+    shard_placement_refresh_seconds: float = Field(
+        default=5.0,
+        description="Seconds between reloads of the tenant placement directory",
+        alias="SHARD_PLACEMENT_REFRESH_SECONDS",
+    )
+
+    # Storage Layout Configuration
+    chunks_partitioning: Literal["none", "hash", "list"] = Field(
+        default="none",
+        description="Partitioning of the chunks table: none, hash (by user) or list (by knowledge set)",
+        alias="CHUNKS_PARTITIONING",
+    )
+    chunks_hash_partitions: int = Field(
+        default=16,
+        description="Number of hash partitions (hash mode, and the list-mode default partition)",
+        alias="CHUNKS_HASH_PARTITIONS",
+    )
+    vacuum_delay_seconds: int = Field(
+        default=60,
+        description="Delay before vacuuming a partition after row-level deletes (0 = disabled)",
+        alias="VACUUM_DELAY_SECONDS",
+    )
 
     # OpenAI Configuration
     openai_api_key: str = Field(
         ..., description="OpenAI API key (required)", alias="OPENAI_API_KEY"
     )
+    openai_base_url: str = Field(
+        default="https://api.openai.com/v1",
+        description="Base URL of the OpenAI-compatible embeddings API",
+        alias="OPENAI_BASE_URL",
+    )
     embedding_model: str = Field(
         default="text-embedding-3-small",
-        description="OpenAI embedding model to use",
+        description="Embedding model for new knowledge sets and re-embedding",
         alias="EMBEDDING_MODEL",
     )
     embedding_dimension: int = Field(
@@ -42,6 +81,200 @@ class Config(BaseSettings):
         description="Embedding vector dimension",
         alias="EMBEDDING_DIMENSION",
     )
+    embedding_request_dimensions: bool = Field(
+        default=False,
+        description="Send EMBEDDING_DIMENSION as the 'dimensions' request parameter",
+        alias="EMBEDDING_REQUEST_DIMENSIONS",
+    )
+    reembed_batch_chunks: int = Field(
+        default=2000,
+        description="Chunks read and re-embedded per batch by the re-embed job",
+        alias="REEMBED_BATCH_CHUNKS",
+    )
+
+    # Chunking Configuration
+    chunk_strategy: Literal["token", "sentence", "semantic", "recursive", "basic"] = (
+        Field(
+            default="sentence",
+            description="Chunking strategy used at ingest",
+            alias="CHUNK_STRATEGY",
+        )
+    )
+    chunk_size_tokens: int = Field(
+        default=256,
+        description="Target chunk size in tokens (token strategy)",
+        alias="CHUNK_SIZE_TOKENS",
+    )
+    chunk_overlap_tokens: int = Field(
+        default=50,
+        description="Overlap between consecutive chunks in tokens (token strategy)",
+        alias="CHUNK_OVERLAP_TOKENS",
+    )
+
+    # Embedding Request Limits
+    embedding_max_input_tokens: int = Field(
+        default=8191,
+        description="Maximum tokens in a single embedding input",
+        alias="EMBEDDING_MAX_INPUT_TOKENS",
+    )
+    embedding_batch_max_tokens: int = Field(
+        default=300_000,
+        description="Maximum total tokens in one embedding request",
+        alias="EMBEDDING_BATCH_MAX_TOKENS",
+    )
+    embedding_batch_max_inputs: int = Field(
+        default=2048,
+        description="Maximum number of inputs in one embedding request",
+        alias="EMBEDDING_BATCH_MAX_INPUTS",
+    )
+
+    # Embedding Rate Limits
+    embedding_rpm_limit: int = Field(
+        default=0,
+        description="Embedding requests per minute (0 = unlimited)",
+        alias="EMBEDDING_RPM_LIMIT",
+    )
+    embedding_tpm_limit: int = Field(
+        default=0,
+        description="Embedding tokens per minute (0 = unlimited)",
+        alias="EMBEDDING_TPM_LIMIT",
+    )
+    embedding_initial_concurrency: int = Field(
+        default=8,
+        description="Starting number of concurrent embedding requests",
+        alias="EMBEDDING_INITIAL_CONCURRENCY",
+    )
+    embedding_max_concurrency: int = Field(
+        default=64,
+        description="Upper bound for adaptive embedding request concurrency",
+        alias="EMBEDDING_MAX_CONCURRENCY",
+    )
+
+    # Query Cache Configuration
+    query_cache_backend: Literal["none", "memory", "postgres"] = Field(
+        default="memory",
+        description="Where query results are cached: none, memory (per process) or postgres (shared)",
+        alias="QUERY_CACHE_BACKEND",
+    )
+    query_cache_max_entries: int = Field(
+        default=10_000,
+        description="Maximum entries in the in-memory query cache",
+        alias="QUERY_CACHE_MAX_ENTRIES",
+    )
+    query_cache_ttl_seconds: int = Field(
+        default=3600,
+        description="Seconds a cached query result stays valid",
+        alias="QUERY_CACHE_TTL_SECONDS",
+    )
+
+    # Extraction Cache Configuration
+    extraction_cache_scope: Literal["none", "user", "global"] = Field(
+        default="user",
+        description="Who can reuse an earlier upload's extracted text and embeddings: none, the same user, or every user on the same shard",
+        alias="EXTRACTION_CACHE_SCOPE",
+    )
+
+    # Near-Duplicate Detection Configuration
+    near_duplicate_policy: Literal["none", "skip", "version", "diff"] = Field(
+        default="none",
+        description="What to do with an upload that nearly duplicates a file in the set: none (detection off), skip, version or diff",
+        alias="NEAR_DUPLICATE_POLICY",
+    )
+    near_duplicate_threshold: float = Field(
+        default=0.85,
+        description="Estimated shingle Jaccard similarity at which a file counts as a near-duplicate",
+        alias="NEAR_DUPLICATE_THRESHOLD",
+    )
+    near_duplicate_shingle_words: int = Field(
+        default=5,
+        description="Words per shingle in near-duplicate signatures",
+        alias="NEAR_DUPLICATE_SHINGLE_WORDS",
+    )
+    near_duplicate_permutations: int = Field(
+        default=128,
+        description="MinHash values per near-duplicate signature",
+        alias="NEAR_DUPLICATE_PERMUTATIONS",
+    )
+    near_duplicate_bands: int = Field(
+        default=16,
+        description="LSH bands the signature is split into for candidate lookup",
+        alias="NEAR_DUPLICATE_BANDS",
+    )
+
+    # Version Retention Configuration
+    version_retention_count: int = Field(
+        default=0,
+        description="Versions of each file to keep, including the latest (0 = no count limit)",
+        alias="VERSION_RETENTION_COUNT",
+    )
+    version_retention_days: int = Field(
+        default=0,
+        description="Days to keep superseded versions (0 = no age limit)",
+        alias="VERSION_RETENTION_DAYS",
+    )
+    version_drop_text: bool = Field(
+        default=False,
+        description="Drop the extracted text of superseded versions that are kept",
+        alias="VERSION_DROP_TEXT",
+    )
+    compaction_interval_seconds: int = Field(
+        default=3600,
+        description="Seconds between background compaction runs (0 = disabled)",
+        alias="COMPACTION_INTERVAL_SECONDS",
+    )
+    compaction_batch_size: int = Field(
+        default=500,
+        description="Files deleted or rewritten per compaction transaction",
+        alias="COMPACTION_BATCH_SIZE",
+    )
+    compaction_batch_delay_seconds: float = Field(
+        default=1.0,
+        description="Pause between compaction batches",
+        alias="COMPACTION_BATCH_DELAY_SECONDS",
+    )
+
+    # PDF Extraction Configuration
+    pdf_extraction_workers: int = Field(
+        default_factory=lambda: min(8, os.cpu_count() or 1),
+        description="Worker processes for page-parallel PDF extraction (0 or 1 disables it)",
+        alias="PDF_EXTRACTION_WORKERS",
+    )
+    pdf_parallel_min_pages: int = Field(
+        default=64,
+        description="PDFs with fewer pages are extracted in a single pass",
+        alias="PDF_PARALLEL_MIN_PAGES",
+    )
+    pdf_pages_per_shard: int = Field(
+        default=16,
+        description="Pages converted per worker task",
+        alias="PDF_PAGES_PER_SHARD",
+    )
+
+    # Upload Configuration
+    upload_dir: str = Field(
+        default_factory=lambda: os.path.join(
+            tempfile.gettempdir(), "knowledge-mcp-uploads"
+        ),
+        description="Directory for staging chunked uploads",
+        alias="UPLOAD_DIR",
+    )
+    max_upload_size: int = Field(
+        default=500_000_000,
+        description="Maximum size in bytes of a chunked upload",
+        alias="MAX_UPLOAD_SIZE",
+    )
+    upload_session_ttl_seconds: int = Field(
+        default=3600,
+        description="Seconds an uncommitted upload session may sit idle before it expires",
+        alias="UPLOAD_SESSION_TTL_SECONDS",
+    )
+
+    # Observability Configuration
+    otel_tracing_enabled: bool = Field(
+        default=False,
+        description="Emit OpenTelemetry spans for pipeline stages (requires opentelemetry-api)",
+        alias="OTEL_TRACING_ENABLED",
+    )
 
     # Optional Configuration
     skip_openai_validation: bool = Field(
@@ -50,6 +283,18 @@ class Config(BaseSettings):
         alias="SKIP_OPENAI_VALIDATION",
     )
 
+    # Startup Configuration
+    warmup_on_startup: bool = Field(
+        default=True,
+        description="Warm up the DB pool, converters and chunkers before reporting ready",
+        alias="WARMUP_ON_STARTUP",
+    )
+    warmup_pool_connections: int = Field(
+        default=5,
+        description="Number of DB pool connections to open during warm-up",
+        alias="WARMUP_POOL_CONNECTIONS",
+    )
+
     @field_validator("openai_api_key")
     @classmethod
     def validate_openai_api_key(cls, v):
@@ -66,6 +311,121 @@ class Config(BaseSettings):
             raise ValueError("PORT must be between 1 and 65535")
         return v
 
+    @field_validator("database_shards")
+    @classmethod
+    def validate_database_shards(cls, v):
+        """Validate shards are name=url entries with unique names."""
+        entries = [e.strip() for e in v.split(",") if e.strip()]
+        for entry in entries:
+            name, sep, url = entry.partition("=")
+            if not sep or not name.strip() or not url.strip():
+                raise ValueError(f"DATABASE_SHARDS entry '{entry}' is not name=url")
+        if len(parse_database_shards(v)) != len(entries):
+            raise ValueError("DATABASE_SHARDS names must be unique")
+        return v
+
+    @field_validator("shard_virtual_nodes", "shard_placement_refresh_seconds")
+    @classmethod
+    def validate_shard_routing(cls, v, info):
+        """Validate ring and refresh settings are positive."""
+        if v <= 0:
+            raise ValueError(f"{info.field_name.upper()} must be positive")
+        return v
+
+    @field_validator("chunks_hash_partitions")
+    @classmethod
+    def validate_chunks_hash_partitions(cls, v):
+        """Validate the hash partition count is positive."""
+        if v <= 0:
+            raise ValueError("CHUNKS_HASH_PARTITIONS must be positive")
+        return v
+
+    @field_validator("compaction_batch_size")
+    @classmethod
+    def validate_compaction_batch_size(cls, v):
+        """Validate the compaction batch size is positive."""
+        if v <= 0:
+            raise ValueError("COMPACTION_BATCH_SIZE must be positive")
+        return v
+
+    @field_validator("near_duplicate_threshold")
+    @classmethod
+    def validate_near_duplicate_threshold(cls, v):
+        """Validate the similarity threshold is a fraction."""
+        if not 0 < v <= 1:
+            raise ValueError("NEAR_DUPLICATE_THRESHOLD must be in (0, 1]")
+        return v
+
+    @field_validator("near_duplicate_shingle_words", "near_duplicate_permutations")
+    @classmethod
+    def validate_near_duplicate_sizes(cls, v, info):
+        """Validate shingle and signature sizes are positive."""
+        if v <= 0:
+            raise ValueError(f"{info.field_name.upper()} must be positive")
+        return v
+
+    @field_validator("near_duplicate_bands")
+    @classmethod
+    def validate_near_duplicate_bands(cls, v, info):
+        """Validate the bands split the signature evenly."""
+        permutations = info.data.get("near_duplicate_permutations", 0)
+        if v <= 0 or permutations % v:
+            raise ValueError(
+                "NEAR_DUPLICATE_BANDS must be positive and divide NEAR_DUPLICATE_PERMUTATIONS"
+            )
+        return v
+
+    @field_validator("pdf_pages_per_shard")
+    @classmethod
+    def validate_pdf_pages_per_shard(cls, v):
+        """Validate the shard size is positive."""
+        if v <= 0:
+            raise ValueError("PDF_PAGES_PER_SHARD must be positive")
+        return v
+
+    @field_validator(
+        "chunk_size_tokens",
+        "embedding_max_input_tokens",
+        "embedding_batch_max_tokens",
+        "embedding_batch_max_inputs",
+    )
+    @classmethod
+    def validate_token_limits(cls, v, info):
+        """Validate chunk and request token limits are positive."""
+        if v <= 0:
+            raise ValueError(f"{info.field_name.upper()} must be positive")
+        return v
+
+    @field_validator("chunk_overlap_tokens")
+    @classmethod
+    def validate_chunk_overlap_tokens(cls, v, info):
+        """Validate the overlap leaves each chunk some new tokens."""
+        size = info.data.get("chunk_size_tokens", 0)
+        if not 0 <= v < size:
+            raise ValueError(
+                "CHUNK_OVERLAP_TOKENS must be at least 0 and less than CHUNK_SIZE_TOKENS"
+            )
+        return v
+
+    @field_validator("embedding_initial_concurrency")
+    @classmethod
+    def validate_embedding_initial_concurrency(cls, v):
+        """Validate at least one embedding request is allowed."""
+        if v < 1:
+            raise ValueError("EMBEDDING_INITIAL_CONCURRENCY must be at least 1")
+        return v
+
+    @field_validator("embedding_max_concurrency")
+    @classmethod
+    def validate_embedding_max_concurrency(cls, v, info):
+        """Validate the concurrency bound is not below the starting concurrency."""
+        initial = info.data.get("embedding_initial_concurrency", 1)
+        if v < initial:
+            raise ValueError(
+                "EMBEDDING_MAX_CONCURRENCY must be at least EMBEDDING_INITIAL_CONCURRENCY"
+            )
+        return v
+
     @field_validator("embedding_dimension")
     @classmethod
     def validate_embedding_dimension(cls, v):
@@ -82,11 +442,19 @@ class Config(BaseSettings):
     }
 
 
+def parse_database_shards(spec: str) -> Dict[str, str]:
+    """Shard name -> URL from a DATABASE_SHARDS value, in the order given."""
+    shards = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        name, _, url = entry.partition("=")
+        shards[name.strip()] = url.strip()
+    return shards
+
+
 # Global configuration instance
 # This will be initialized when the module is imported
 try:
     config = Config()
-    print("✓ Configuration loaded successfully")
 except Exception as e:
     raise ValueError(f"Configuration validation failed: {e}")
 
@@ -95,7 +463,52 @@ except Exception as e:
 PORT = config.port
 MCP_PATH = config.mcp_path
 DATABASE_URL = config.database_url
+DATABASE_SHARDS = parse_database_shards(config.database_shards) or {
+    "default": DATABASE_URL
+}
+SHARD_VIRTUAL_NODES = config.shard_virtual_nodes
+SHARD_PLACEMENT_REFRESH_SECONDS = config.shard_placement_refresh_seconds
+CHUNKS_PARTITIONING = config.chunks_partitioning
+CHUNKS_HASH_PARTITIONS = config.chunks_hash_partitions
+VACUUM_DELAY_SECONDS = config.vacuum_delay_seconds
 OPENAI_API_KEY = config.openai_api_key
+OPENAI_BASE_URL = config.openai_base_url.rstrip("/")
 EMBEDDING_MODEL = config.embedding_model
 EMBEDDING_DIMENSION = config.embedding_dimension
 SKIP_OPENAI_VALIDATION = config.skip_openai_validation
+CHUNK_STRATEGY = config.chunk_strategy
+CHUNK_SIZE_TOKENS = config.chunk_size_tokens
+CHUNK_OVERLAP_TOKENS = config.chunk_overlap_tokens
+EMBEDDING_REQUEST_DIMENSIONS = config.embedding_request_dimensions
+REEMBED_BATCH_CHUNKS = config.reembed_batch_chunks
+EMBEDDING_MAX_INPUT_TOKENS = config.embedding_max_input_tokens
+EMBEDDING_BATCH_MAX_TOKENS = config.embedding_batch_max_tokens
+EMBEDDING_BATCH_MAX_INPUTS = config.embedding_batch_max_inputs
+EMBEDDING_RPM_LIMIT = config.embedding_rpm_limit
+EMBEDDING_TPM_LIMIT = config.embedding_tpm_limit
+EMBEDDING_INITIAL_CONCURRENCY = config.embedding_initial_concurrency
+EMBEDDING_MAX_CONCURRENCY = config.embedding_max_concurrency
+OTEL_TRACING_ENABLED = config.otel_tracing_enabled
+WARMUP_ON_STARTUP = config.warmup_on_startup
+WARMUP_POOL_CONNECTIONS = config.warmup_pool_connections
+QUERY_CACHE_BACKEND = config.query_cache_backend
+QUERY_CACHE_MAX_ENTRIES = config.query_cache_max_entries
+QUERY_CACHE_TTL_SECONDS = config.query_cache_ttl_seconds
+EXTRACTION_CACHE_SCOPE = config.extraction_cache_scope
+NEAR_DUPLICATE_POLICY = config.near_duplicate_policy
+NEAR_DUPLICATE_THRESHOLD = config.near_duplicate_threshold
+NEAR_DUPLICATE_SHINGLE_WORDS = config.near_duplicate_shingle_words
+NEAR_DUPLICATE_PERMUTATIONS = config.near_duplicate_permutations
+NEAR_DUPLICATE_BANDS = config.near_duplicate_bands
+VERSION_RETENTION_COUNT = config.version_retention_count
+VERSION_RETENTION_DAYS = config.version_retention_days
+VERSION_DROP_TEXT = config.version_drop_text
+COMPACTION_INTERVAL_SECONDS = config.compaction_interval_seconds
+COMPACTION_BATCH_SIZE = config.compaction_batch_size
+COMPACTION_BATCH_DELAY_SECONDS = config.compaction_batch_delay_seconds
+PDF_EXTRACTION_WORKERS = config.pdf_extraction_workers
+PDF_PARALLEL_MIN_PAGES = config.pdf_parallel_min_pages
+PDF_PAGES_PER_SHARD = config.pdf_pages_per_shard
+UPLOAD_DIR = config.upload_dir
+MAX_UPLOAD_SIZE = config.max_upload_size
+UPLOAD_SESSION_TTL_SECONDS = config.upload_session_ttl_seconds
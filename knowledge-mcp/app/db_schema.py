@@ -38,6 +38,23 @@ class FileInfo(BaseModel):
     created_at: datetime
 
 
+# Paginated listings
+class KnowledgeSetPage(BaseModel):
+    knowledge_sets: List[KnowledgeSetInfo]
+    next_cursor: Optional[str] = None  # Pass back to fetch the next page
+
+
+class FileListItem(BaseModel):
+    file_id: str
+    metadata: Dict[str, Any]  # All metadata fields, or only the requested ones
+    created_at: datetime
+
+
+class FileListPage(BaseModel):
+    files: List[FileListItem]
+    next_cursor: Optional[str] = None  # Pass back to fetch the next page
+
+
 # Chunk-level metadata including text
 class ChunkMetadata(BaseModel):
     text: str  # content of the chunk
@@ -76,3 +93,17 @@ class FileUploadResponse(BaseModel):
     message: str
     is_duplicate: bool = False  # Whether this was a duplicate file
     existing_file_id: Optional[str] = None  # If duplicate, the ID of existing file
+
+
+# Chunked upload schemas
+class UploadSessionInfo(BaseModel):
+    upload_id: str
+    knowledge_set_id: str
+    filename: str
+    max_upload_size: int
+
+
+class UploadPartResponse(BaseModel):
+    upload_id: str
+    part_number: int
+    bytes_received: int
@@ -0,0 +1,258 @@
+"""
+Process-wide scheduler for embedding API requests.
+
+Every embedding request acquires a slot before it is sent. A slot is granted
+when:
+  - the request and token buckets (RPM / TPM), if configured, have capacity,
+  - fewer than ``limit`` requests are in flight, and
+  - no global back-off (from a 429 / Retry-After) is in effect.
+
+Waiters are served in priority order, so interactive query embeddings jump
+ahead of bulk ingestion. The concurrency limit adapts AIMD-style: it grows
+additively on success and is cut multiplicatively on 429s or when the
+``x-ratelimit-remaining-*`` headers show the quota is nearly exhausted.
+"""
+
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import List, Mapping, Optional, Tuple
+
+import app.metrics as metrics
+from app.config import (
+    EMBEDDING_RPM_LIMIT,
+    EMBEDDING_TPM_LIMIT,
+    EMBEDDING_INITIAL_CONCURRENCY,
+    EMBEDDING_MAX_CONCURRENCY,
+)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Fraction of the quota left at which we start backing off proactively
+LOW_REMAINING_FRACTION = 0.1
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations like '1s', '6m0s' or '20ms' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Server-requested delay from Retry-After / retry-after-ms, if any."""
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            # HTTP-date form is not used by OpenAI; ignore it
+            return None
+    return None
+
+
+class TokenBucket:
+    """Continuously refilling bucket; ``per_minute <= 0`` means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (0 if it is available now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # A single request larger than the bucket can only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+    def clamp(self, remaining: float, now: float):
+        """Never believe we have more capacity than the server says we do."""
+        if not self.unlimited:
+            self._refill(now)
+            self.tokens = min(self.tokens, remaining)
+
+
+class EmbeddingScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        initial_concurrency: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.limit = float(
+            min(max(initial_concurrency, min_concurrency), self.max_concurrency)
+        )
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # -- dispatching -------------------------------------------------------
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= int(self.limit):
+                return  # a release will dispatch again
+            delay = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(
+                    delay, self._dispatch
+                )
+                return
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _schedule_dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def acquire(self, priority: int, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+        started = time.monotonic()
+        self._schedule_dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before cancellation; give the slot back
+                self.release()
+            raise
+        finally:
+            metrics.EMBEDDING_QUEUE_WAIT.observe(
+                time.monotonic() - started,
+                priority="interactive" if priority == PRIORITY_INTERACTIVE else "bulk",
+            )
+
+    def release(self):
+        self.in_flight -= 1
+        self._schedule_dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_BULK, tokens: int = 1):
+        await self.acquire(priority, tokens)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    # -- feedback ------------------------------------------------------------
+    def on_success(self, headers: Mapping[str, str]):
+        """Additive increase, tempered by the remaining quota in the headers."""
+        if self._observe_remaining(headers):
+            return
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self, headers: Mapping[str, str], fallback_delay: float):
+        """Multiplicative decrease and a global pause so callers don't stampede."""
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        delay = retry_after_seconds(headers)
+        if delay is None:
+            delay = (
+                max(
+                    parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                    parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0,
+                )
+                or fallback_delay
+            )
+        self.pause(delay)
+        return delay
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _observe_remaining(self, headers: Mapping[str, str]) -> bool:
+        """Sync buckets with the server's view; returns True if we backed off."""
+        now = time.monotonic()
+        backed_off = False
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining_value = float(remaining)
+            except ValueError:
+                continue
+            bucket.clamp(remaining_value, now)
+            try:
+                limit_value = float(limit) if limit is not None else None
+            except ValueError:
+                limit_value = None
+            if limit_value and remaining_value < limit_value * LOW_REMAINING_FRACTION:
+                backed_off = True
+        if backed_off:
+            self.limit = max(self.min_concurrency, self.limit * 0.9)
+        return backed_off
+
+    def queue_depth(self) -> int:
+        return sum(1 for *_, f in self._waiters if not f.done())
+
+
+scheduler = EmbeddingScheduler(
+    requests_per_minute=EMBEDDING_RPM_LIMIT,
+    tokens_per_minute=EMBEDDING_TPM_LIMIT,
+    initial_concurrency=EMBEDDING_INITIAL_CONCURRENCY,
+    max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+)
+
+metrics.EMBEDDING_CONCURRENCY_LIMIT.set_function(lambda: scheduler.limit)
+metrics.EMBEDDING_IN_FLIGHT.set_function(lambda: scheduler.in_flight)
+metrics.EMBEDDING_QUEUE_DEPTH.set_function(scheduler.queue_depth)
@@ -1,18 +1,28 @@
 import asyncio
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 import httpx
-import time
 import random
 
+import app.metrics as metrics
+from app.embedding_scheduler import scheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE
+from app.text_processing import count_tokens
+
 # Import configuration from centralized config
 from app.config import (
     OPENAI_API_KEY,
+    OPENAI_BASE_URL,
     EMBEDDING_MODEL,
     EMBEDDING_DIMENSION,
-    SKIP_OPENAI_VALIDATION,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_BATCH_MAX_INPUTS,
+    EMBEDDING_REQUEST_DIMENSIONS,
 )
 
 
+class EmbeddingProviderAuthError(ValueError):
+    """The embedding provider rejected the configured credentials."""
+
+
 async def validate_openai_api_key() -> bool:
     """
     Validate the OpenAI API key by making a lightweight API call.
@@ -22,7 +32,7 @@ async def validate_openai_api_key() -> bool:
         async with httpx.AsyncClient() as client:
             # Use a minimal request to test the API key
             response = await client.post(
-                "https://api.openai.com/v1/embeddings",
+                f"{OPENAI_BASE_URL}/embeddings",
                 headers={
                     "Authorization": f"Bearer {OPENAI_API_KEY}",
                     "Content-Type": "application/json",
@@ -34,9 +44,11 @@ async def validate_openai_api_key() -> bool:
             if response.status_code == 200:
                 return True
             elif response.status_code == 401:
-                raise ValueError("Invalid OpenAI API key - authentication failed")
+                raise EmbeddingProviderAuthError(
+                    "Invalid OpenAI API key - authentication failed"
+                )
             elif response.status_code == 403:
-                raise ValueError(
+                raise EmbeddingProviderAuthError(
                     "OpenAI API key does not have permission for embeddings"
                 )
             elif response.status_code == 429:
@@ -60,105 +72,180 @@ async def validate_openai_api_key() -> bool:
         )
 
 
-# Validate the API key on module import
-def _validate_api_key_sync():
-    """Synchronous wrapper for API key validation during module import."""
-    try:
-        # Run the async validation
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(validate_openai_api_key())
-        loop.close()
-        print("✓ OpenAI API key validated successfully")
-    except Exception as e:
-        raise ValueError(f"OpenAI API key validation failed: {e}")
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for TPM accounting (~4 characters per token)."""
+    return len(text) // 4 + 1
 
 
-# Only validate if we're not in a test environment
-if not SKIP_OPENAI_VALIDATION:
-    _validate_api_key_sync()
-
+def pack_batches(
+    token_counts: Sequence[int],
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS,
+) -> List[Tuple[int, int]]:
+    """
+    Split consecutive inputs into ``[start, end)`` request batches, filling
+    each one until the next input would exceed the token or input cap.
+    """
+    batches = []
+    start, total = 0, 0
+    for i, tokens in enumerate(token_counts):
+        if i > start and (total + tokens > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, total = i, 0
+        total += tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _request_body(inputs, model: Optional[str]) -> dict:
+    body = {"input": inputs, "model": model or EMBEDDING_MODEL}
+    if EMBEDDING_REQUEST_DIMENSIONS:
+        # Lets a model with larger native vectors fill the existing column
+        body["dimensions"] = EMBEDDING_DIMENSION
+    return body
+
+
+async def _request_embeddings(
+    inputs: List[str],
+    tokens: int,
+    max_retries: int = 3,
+    priority: int = PRIORITY_BULK,
+    model: Optional[str] = None,
+) -> List[List[float]]:
+    """
+    Embed ``inputs`` in one OpenAI request with retry logic. ``model``
+    defaults to EMBEDDING_MODEL.
 
-async def generate_embedding_openai(text: str, max_retries: int = 3) -> List[float]:
-    """Generate embeddings using OpenAI API with retry logic."""
+    Requests go through the process-wide scheduler, which enforces RPM/TPM
+    limits and adaptive concurrency. A 429 pauses all callers for the
+    server-provided Retry-After instead of each backing off on its own.
+    """
     for attempt in range(max_retries):
+        delay = None
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {OPENAI_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json={"input": text, "model": EMBEDDING_MODEL},
-                    timeout=30.0,
-                )
-
+            async with scheduler.slot(priority, tokens):
+                async with httpx.AsyncClient() as client:
+                    response = await client.post(
+                        f"{OPENAI_BASE_URL}/embeddings",
+                        headers={
+                            "Authorization": f"Bearer {OPENAI_API_KEY}",
+                            "Content-Type": "application/json",
+                        },
+                        json=_request_body(inputs, model),
+                        timeout=30.0 + len(inputs) * 0.05,
+                    )
+
+                metrics.EMBEDDING_REQUESTS.inc(status=str(response.status_code))
                 if response.status_code == 200:
+                    scheduler.on_success(response.headers)
                     data = response.json()
-                    return data["data"][0]["embedding"]
+                    metrics.EMBEDDING_TOKENS.inc(
+                        data.get("usage", {}).get("total_tokens", 0)
+                    )
+                    metrics.EMBEDDING_BATCH_INPUTS.observe(len(inputs))
+                    # Results carry their input index; don't rely on ordering
+                    items = sorted(data["data"], key=lambda item: item["index"])
+                    return [item["embedding"] for item in items]
 
                 # Check if it's a retryable error
                 if response.status_code in [429, 500, 502, 503, 504]:
+                    backoff = (2**attempt) + random.uniform(0, 1)
+                    if response.status_code == 429:
+                        # Everyone waits, honoring Retry-After when provided
+                        backoff = scheduler.on_rate_limited(response.headers, backoff)
                     if attempt < max_retries - 1:
-                        # Exponential backoff with jitter
-                        delay = (2**attempt) + random.uniform(0, 1)
+                        metrics.EMBEDDING_RETRIES.inc(reason=str(response.status_code))
+                        delay = backoff
                         print(
                             f"OpenAI API error {response.status_code}, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})"
                         )
-                        await asyncio.sleep(delay)
-                        continue
 
-                # Non-retryable error or max retries reached
-                raise ValueError(
-                    f"OpenAI API error: {response.status_code} - {response.text}"
-                )
+                if delay is None:
+                    # Non-retryable error or max retries reached
+                    raise ValueError(
+                        f"OpenAI API error: {response.status_code} - {response.text}"
+                    )
 
         except httpx.TimeoutException:
+            metrics.EMBEDDING_REQUESTS.inc(status="timeout")
             if attempt < max_retries - 1:
+                metrics.EMBEDDING_RETRIES.inc(reason="timeout")
                 delay = (2**attempt) + random.uniform(0, 1)
                 print(
                     f"OpenAI API timeout, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})"
                 )
-                await asyncio.sleep(delay)
-                continue
             else:
                 raise ValueError("OpenAI API timeout after all retries")
 
         except httpx.ConnectError:
+            metrics.EMBEDDING_REQUESTS.inc(status="connect_error")
             if attempt < max_retries - 1:
+                metrics.EMBEDDING_RETRIES.inc(reason="connect_error")
                 delay = (2**attempt) + random.uniform(0, 1)
                 print(
                     f"OpenAI API connection error, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})"
                 )
-                await asyncio.sleep(delay)
-                continue
             else:
                 raise ValueError("OpenAI API connection error after all retries")
 
+        # Sleep outside the scheduler slot so it can be used by others
+        await asyncio.sleep(delay)
+
     # This shouldn't be reached, but just in case
     raise ValueError("OpenAI API failed after all retries")
 
 
-async def generate_embedding(text: str) -> List[float]:
+async def generate_embedding_openai(
+    text: str,
+    max_retries: int = 3,
+    priority: int = PRIORITY_BULK,
+    model: Optional[str] = None,
+) -> List[float]:
+    """Generate the embedding of a single text using the OpenAI API."""
+    embeddings = await _request_embeddings(
+        [text],
+        estimate_tokens(text),
+        max_retries=max_retries,
+        priority=priority,
+        model=model,
+    )
+    return embeddings[0]
+
+
+async def generate_embedding(
+    text: str, priority: int = PRIORITY_BULK, model: Optional[str] = None
+) -> List[float]:
     """
     Generate embeddings for text using OpenAI API.
     Requires OPENAI_API_KEY environment variable to be set.
+    Use PRIORITY_INTERACTIVE for user-facing queries.
     """
-    return await generate_embedding_openai(text)
+    return await generate_embedding_openai(text, priority=priority, model=model)
 
 
 async def generate_embeddings_batch(
-    texts: List[str], batch_size: int = 10
+    texts: List[str],
+    token_counts: Optional[Sequence[int]] = None,
+    model: Optional[str] = None,
 ) -> List[List[float]]:
-    """Generate embeddings for multiple texts in batches."""
-    embeddings = []
-
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
-        batch_embeddings = await asyncio.gather(
-            *[generate_embedding(text) for text in batch]
-        )
-        embeddings.extend(batch_embeddings)
+    """
+    Generate embeddings for multiple texts, in input order.
 
-    return embeddings
+    Texts are packed into multi-input requests that fill EMBEDDING_BATCH_MAX_TOKENS
+    using ``token_counts`` (counted here if not given). All requests are issued
+    concurrently; the scheduler decides how many are actually in flight.
+    """
+    if token_counts is None:
+        token_counts = [count_tokens(text) for text in texts]
+
+    batches = pack_batches(token_counts)
+    results = await asyncio.gather(
+        *[
+            _request_embeddings(
+                texts[start:end], sum(token_counts[start:end]), model=model
+            )
+            for start, end in batches
+        ]
+    )
+    return [embedding for batch in results for embedding in batch]
@@ -4,16 +4,37 @@ import app.vector_db as db
 import app.db_schema as schemas
 import app.text_processing as text_proc
 import app.embeddings as embeddings
+import app.uploads as uploads
+import app.readiness as readiness
+import app.metrics as metrics
+import app.query_cache as query_cache
+import app.compaction as compaction
+import app.near_duplicates as near_dup
 
 from fastmcp import FastMCP
 from pydantic import Field
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Callable, Dict, List, Literal, Optional
 from fastmcp.exceptions import ToolError
 from uuid import uuid4
 import hashlib
 import base64
 from fastmcp.server.dependencies import get_http_headers
-from app.config import PORT, MCP_PATH
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from app.config import (
+    PORT,
+    MCP_PATH,
+    MAX_UPLOAD_SIZE,
+    EXTRACTION_CACHE_SCOPE,
+    EMBEDDING_MODEL,
+    NEAR_DUPLICATE_POLICY,
+    NEAR_DUPLICATE_THRESHOLD,
+)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Candidates compared on the full signature per near-duplicate lookup
+NEAR_DUPLICATE_MAX_CANDIDATES = 20
 
 mcp = FastMCP(
     name="KnowledgeMCPServer",
@@ -33,6 +54,35 @@ def _get_user_id() -> str:
 
 # Use the embedding service
 generate_embedding = embeddings.generate_embedding
+generate_embeddings_batch = embeddings.generate_embeddings_batch
+
+
+## health and readiness probes
+@mcp.custom_route("/health", methods=["GET"])
+async def health(request: Request) -> JSONResponse:
+    """Liveness: the process is up. Also reports component status for debugging."""
+    return JSONResponse({"status": "ok", **readiness.report()})
+
+
+@mcp.custom_route("/ready", methods=["GET"])
+async def ready(request: Request) -> JSONResponse:
+    """Readiness: startup finished and the database still answers."""
+    body = readiness.report()
+    if body["ready"]:
+        try:
+            await asyncio.wait_for(db.ping(), timeout=2.0)
+        except Exception as e:
+            body["ready"] = False
+            body["components"]["database"] = {"ok": False, "detail": str(e)}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def prometheus_metrics(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 ## manage knowledge set tools
@@ -52,11 +102,46 @@ async def create_knowledge_set() -> schemas.KnowledgeSetInfo:
 @mcp.tool(
     name="list_knowledge_sets",
 )
-async def list_knowledge_sets() -> list:
-    """List all knowledge sets for the user"""
+async def list_knowledge_sets(
+    limit: Annotated[
+        int,
+        Field(
+            description="Maximum number of knowledge sets to return",
+            ge=1,
+            le=MAX_PAGE_SIZE,
+        ),
+    ] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[
+        Optional[str],
+        Field(description="next_cursor from the previous page, if any"),
+    ] = None,
+    order: Annotated[
+        Literal["asc", "desc"], Field(description="Sort order by creation time")
+    ] = "asc",
+) -> schemas.KnowledgeSetPage:
+    """List the user's knowledge sets, one page at a time"""
     user_id = _get_user_id()
-    ks = await db.list_knowledge_sets(user_id)
-    return [schemas.KnowledgeSetInfo(**k.__dict__) for k in ks]
+    knowledge_sets = []
+    next_cursor = None
+    try:
+        # Fetch one extra row to know whether there is another page
+        async for row in db.stream_knowledge_sets(
+            user_id, limit + 1, cursor, descending=order == "desc"
+        ):
+            if len(knowledge_sets) == limit:
+                last = knowledge_sets[-1]
+                next_cursor = db.encode_cursor(last.created_at, last.knowledge_set_id)
+                continue
+            knowledge_sets.append(
+                schemas.KnowledgeSetInfo(
+                    knowledge_set_id=row.knowledge_set_id, created_at=row.created_at
+                )
+            )
+    except ValueError as e:
+        raise ToolError(str(e))
+    return schemas.KnowledgeSetPage(
+        knowledge_sets=knowledge_sets, next_cursor=next_cursor
+    )
 
 
 @mcp.tool(
@@ -74,92 +159,112 @@ async def delete_knowledge_set(
 
 
 ## client tools
-@mcp.tool(name="ingest_file")
-async def ingest_file(
-    knowledge_set_id: Annotated[
-        str, Field(description="The knowledge set ID to ingest the file into")
-    ],
-    filename: Annotated[str, Field(description="The name of the file")],
-    content: Annotated[
-        str, Field(description="The base64-encoded content of the file")
-    ],
+def _extraction_cache_scope(user_id: str) -> Optional[str]:
+    """Which uploads may share extractions with this user's, per EXTRACTION_CACHE_SCOPE."""
+    if EXTRACTION_CACHE_SCOPE == "global":
+        return "global"
+    if EXTRACTION_CACHE_SCOPE == "user":
+        return f"user:{user_id}"
+    return None
+
+
+async def _find_near_duplicate(
+    user_id: str, knowledge_set_id: str, signature
+) -> Optional[tuple]:
+    """
+    The latest-version file most similar to ``signature`` at or above
+    NEAR_DUPLICATE_THRESHOLD, as (candidate, similarity).
+    """
+    candidates = await db.find_near_duplicate_candidates(
+        user_id,
+        knowledge_set_id,
+        near_dup.scheme(),
+        near_dup.band_buckets(signature),
+        NEAR_DUPLICATE_MAX_CANDIDATES,
+    )
+    best = None
+    for candidate in candidates:
+        similarity = near_dup.similarity(
+            signature, near_dup.from_bytes(candidate.signature)
+        )
+        if similarity >= NEAR_DUPLICATE_THRESHOLD and (
+            best is None or similarity > best[1]
+        ):
+            best = (candidate, similarity)
+    return best
+
+
+async def _cancel_all(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _ingest_content(
+    user_id: str,
+    knowledge_set_id: str,
+    filename: str,
+    file_extension: str,
+    content_hash: str,
+    original_size: int,
+    extract: Callable[[], AsyncIterator[str]],
 ) -> schemas.FileUploadResponse:
     """
-    Upload and process a file: extract text, chunk it, generate embeddings, and store in the database.
+    Run the ingestion pipeline for content that has already been hashed:
+    dedupe, version, extract text (``extract`` yields it in segments), chunk,
+    embed and store.
+    Content already ingested within the extraction cache scope is copied
+    from the earlier file instead of being extracted and embedded again.
     """
-    user_id = _get_user_id()
-
-    try:
-        file_extension = filename.split(".")[-1]
-
-        # Decode base64 content to bytes
-        try:
-            content_bytes = base64.b64decode(content)
-        except Exception as e:
-            raise ToolError(f"Failed to decode base64 content to bytes: {e}")
-
-        # Generate content hash for duplicate detection
-        content_hash = hashlib.sha256(content_bytes).hexdigest()
+    # Check for exact duplicate (same content hash)
+    existing_file_by_hash = await db.find_file_by_content_hash(
+        user_id, knowledge_set_id, content_hash
+    )
 
-        # Check for exact duplicate (same content hash)
-        existing_file_by_hash = await db.find_file_by_content_hash(
-            user_id, knowledge_set_id, content_hash
+    metrics.record_cache("content_hash", existing_file_by_hash is not None)
+    if existing_file_by_hash:
+        # Exact duplicate found - return existing file info
+        metrics.FILES_INGESTED.inc(result="duplicate")
+        existing_file_id, existing_metadata = existing_file_by_hash
+        existing_chunks = await db.count_chunks_for_file(
+            user_id, knowledge_set_id, existing_file_id
         )
 
-        if existing_file_by_hash:
-            # Exact duplicate found - return existing file info
-            existing_file_id, existing_metadata = existing_file_by_hash
-            existing_chunks = await db.count_chunks_for_file(
-                user_id, knowledge_set_id, existing_file_id
-            )
-
-            return schemas.FileUploadResponse(
-                file_id=existing_file_id,
-                filename=filename,
-                chunks_created=existing_chunks,
-                message=f"File '{filename}' is identical to existing file. Using existing version.",
-                is_duplicate=True,
-                existing_file_id=existing_file_id,
-            )
-
-        # Check for latest version of this filename
-        latest_version_info = await db.get_latest_version_info(
-            user_id, knowledge_set_id, filename
+        return schemas.FileUploadResponse(
+            file_id=existing_file_id,
+            filename=filename,
+            chunks_created=existing_chunks,
+            message=f"File '{filename}' is identical to existing file. Using existing version.",
+            is_duplicate=True,
+            existing_file_id=existing_file_id,
         )
 
-        if latest_version_info:
-            # This is a new version of an existing file
-            previous_file_id, previous_metadata, previous_version = latest_version_info
-            new_version = previous_version + 1
+    # Check for latest version of this filename
+    latest_version_info = await db.get_latest_version_info(
+        user_id, knowledge_set_id, filename
+    )
 
-            # Mark previous version as old and delete its chunks
-            await db.mark_previous_version_as_old(
-                user_id, knowledge_set_id, previous_file_id
-            )
+    if latest_version_info:
+        # This is a new version of an existing file
+        previous_file_id, previous_metadata, previous_version = latest_version_info
+        new_version = previous_version + 1
 
-            version_message = f"New version {new_version} of '{filename}' created. Previous version {previous_version} chunks removed."
-        else:
-            # This is a completely new file
-            new_version = 1
-            previous_file_id = None
-            version_message = (
-                f"New file '{filename}' (version 1) processed successfully."
-            )
+        # The previous version is marked as old and its chunks deleted in the
+        # transaction that stores the new version's chunks
 
-        # Generate unique file ID for new version
-        file_id = str(uuid4())
+        version_message = f"New version {new_version} of '{filename}' created. Previous version {previous_version} chunks removed."
+    else:
+        # This is a completely new file
+        new_version = 1
+        previous_file_id = None
+        version_message = f"New file '{filename}' (version 1) processed successfully."
 
-        # Extract text from file content
-        md_converter_result = text_proc.extract_text_from_content(
-            content_bytes, file_extension
-        )
-        extracted_title, extracted_text = (
-            md_converter_result.title,
-            md_converter_result.markdown,
-        )
+    # Generate unique file ID for new version
+    file_id = str(uuid4())
 
+    def build_file_metadata(extracted_text: str) -> schemas.FileMetadata:
         # Create file metadata with version information
-        file_metadata = schemas.FileMetadata(
+        return schemas.FileMetadata(
             filename=filename,
             text=extracted_text,
             content_hash=content_hash,
@@ -168,31 +273,219 @@ async def ingest_file(
             is_latest_version=True,
             created_at=datetime.now(),
             extra={
-                "original_size": len(content_bytes),
+                "original_size": original_size,
                 "processed_size": len(extracted_text),
             },
         )
 
-        # Store file metadata
-        await db.create_file(
-            user_id, knowledge_set_id, file_id, file_metadata.model_dump(mode="json")
+    # Vectors must come from the model the set's live chunks use
+    embedding_model = (
+        await db.get_embedding_model(user_id, knowledge_set_id) or EMBEDDING_MODEL
+    )
+
+    # Near-duplicates of files already in the set, per NEAR_DUPLICATE_POLICY.
+    # Same-name uploads were already linked as versions above.
+    check_near_duplicates = NEAR_DUPLICATE_POLICY != "none" and previous_file_id is None
+    signature = None
+    near_duplicate = None
+    reusable_vectors: Dict[str, List[float]] = {}
+
+    async def resolve_near_duplicate(extracted_text: str):
+        """Sign the text; unless skipping, link a match as the previous version."""
+        nonlocal check_near_duplicates, signature, near_duplicate, reusable_vectors
+        nonlocal new_version, previous_file_id, version_message
+        check_near_duplicates = False
+        with metrics.stage("near_duplicate"):
+            signature = await asyncio.to_thread(near_dup.signature, extracted_text)
+            if signature is not None:
+                near_duplicate = await _find_near_duplicate(
+                    user_id, knowledge_set_id, signature
+                )
+        if near_duplicate is None:
+            return
+        match, similarity = near_duplicate
+        metrics.NEAR_DUPLICATES.inc(action=NEAR_DUPLICATE_POLICY)
+        if NEAR_DUPLICATE_POLICY == "skip":
+            return
+        if NEAR_DUPLICATE_POLICY == "diff":
+            reusable_vectors = await db.get_chunk_vectors(
+                user_id, knowledge_set_id, match.file_id, embedding_model
+            )
+        # Superseded once the new file's chunks are stored
+        previous_file_id = match.file_id
+        new_version = int(match.version or 1) + 1
+        version_message = (
+            f"'{filename}' is {similarity:.0%} similar to '{match.filename}' and was "
+            f"stored as its version {new_version}. Previous version chunks removed."
         )
 
-        # Chunk the text
-        text_chunks = text_proc.chunk_text(extracted_text)
+    async def near_duplicate_skipped() -> schemas.FileUploadResponse:
+        match, similarity = near_duplicate
+        metrics.FILES_INGESTED.inc(result="near_duplicate")
+        return schemas.FileUploadResponse(
+            file_id=match.file_id,
+            filename=filename,
+            chunks_created=await db.count_chunks_for_file(
+                user_id, knowledge_set_id, match.file_id
+            ),
+            message=f"File '{filename}' is {similarity:.0%} similar to existing file '{match.filename}'. Using existing file.",
+            is_duplicate=True,
+            existing_file_id=match.file_id,
+        )
 
-        # Generate embeddings and create chunk objects
-        chunks_to_upsert = []
-        try:
-            for i, (chunk_text, offset) in enumerate(text_chunks):
-                # Generate embedding for this chunk
-                embedding = await generate_embedding(chunk_text)
+    async def store_signature():
+        if signature is not None:
+            await db.store_file_signature(
+                user_id,
+                knowledge_set_id,
+                file_id,
+                near_dup.scheme(),
+                near_dup.to_bytes(signature),
+                near_dup.band_buckets(signature),
+            )
+
+    # Reuse an earlier extraction of the same bytes if the scope allows it
+    cache_scope = _extraction_cache_scope(user_id)
+    pipeline = text_proc.pipeline_key(file_extension, embedding_model)
+    if cache_scope is not None:
+        cached = await db.find_cached_extraction(
+            user_id, cache_scope, content_hash, pipeline
+        )
+        copied = False
+        if cached is not None:
+            cached_text = cached.file_metadata.get("text") or ""
+            if check_near_duplicates:
+                await resolve_near_duplicate(cached_text)
+                if near_duplicate is not None and NEAR_DUPLICATE_POLICY == "skip":
+                    return await near_duplicate_skipped()
+            file_metadata = build_file_metadata(cached_text)
+            with metrics.stage("copy", chunks=cached.chunk_count):
+                copied = await db.create_file_from_cache(
+                    user_id,
+                    knowledge_set_id,
+                    file_id,
+                    file_metadata.model_dump(mode="json"),
+                    cached,
+                    embedding_model,
+                    supersedes=previous_file_id,
+                )
+        metrics.record_cache("extraction", copied)
+        if copied:
+            await store_signature()
+            metrics.FILES_INGESTED.inc(result="version" if previous_file_id else "new")
+            metrics.CHUNKS_INGESTED.inc(cached.chunk_count)
+            return schemas.FileUploadResponse(
+                file_id=file_id,
+                filename=filename,
+                chunks_created=cached.chunk_count,
+                message=version_message,
+                is_duplicate=False,
+                existing_file_id=previous_file_id,
+            )
+
+    # Extract, chunk and start embedding segment by segment. Large PDFs arrive
+    # as several segments, so early pages are embedded while later ones are
+    # still being converted; chunks never span a segment boundary. Embedding
+    # waits for the whole text when it may turn out to be a near-duplicate.
+    defer_embedding = check_near_duplicates or bool(reusable_vectors)
+    segments = []
+    text_chunks = []
+    embed_tasks = []
+    offset = 0
+    try:
+        segment_iter = extract().__aiter__()
+        while True:
+            # Only the extractor's own work counts as extraction
+            with metrics.stage("extract"):
+                try:
+                    segment = await segment_iter.__anext__()
+                except StopAsyncIteration:
+                    break
+            with metrics.stage("chunk"):
+                segment_chunks = [
+                    chunk._replace(offset=offset + chunk.offset)
+                    for chunk in text_proc.chunk_text_with_tokens(segment)
+                ]
+            if segment_chunks and not defer_embedding:
+                # The scheduler bounds what's in flight across all segments
+                embed_tasks.append(
+                    asyncio.create_task(
+                        generate_embeddings_batch(
+                            [chunk.text for chunk in segment_chunks],
+                            [chunk.tokens for chunk in segment_chunks],
+                            model=embedding_model,
+                        )
+                    )
+                )
+            text_chunks.extend(segment_chunks)
+            segments.append(segment)
+            offset += len(segment)
+        extracted_text = "".join(segments)
+
+        if check_near_duplicates:
+            await resolve_near_duplicate(extracted_text)
+            if near_duplicate is not None and NEAR_DUPLICATE_POLICY == "skip":
+                return await near_duplicate_skipped()
+        if defer_embedding:
+            # Only what the near-duplicate's chunks don't already cover
+            pending = [c for c in text_chunks if c.text not in reusable_vectors]
+            if pending:
+                embed_tasks.append(
+                    asyncio.create_task(
+                        generate_embeddings_batch(
+                            [chunk.text for chunk in pending],
+                            [chunk.tokens for chunk in pending],
+                            model=embedding_model,
+                        )
+                    )
+                )
+        file_metadata = build_file_metadata(extracted_text)
+
+        # Store file metadata. Without chunks to store later, this is the
+        # write that supersedes the previous version.
+        await db.create_file(
+            user_id,
+            knowledge_set_id,
+            file_id,
+            file_metadata.model_dump(mode="json"),
+            supersedes=None if text_chunks else previous_file_id,
+        )
+    except BaseException:
+        await _cancel_all(embed_tasks)
+        raise
 
+    # Collect embeddings and create chunk objects
+    chunks_to_upsert = []
+    try:
+        with metrics.stage("embed", chunks=len(text_chunks)):
+            embedded = iter(
+                [
+                    embedding
+                    for batch in await asyncio.gather(*embed_tasks)
+                    for embedding in batch
+                ]
+            )
+            chunk_embeddings = [
+                (
+                    reusable_vectors[chunk.text]
+                    if chunk.text in reusable_vectors
+                    else next(embedded)
+                )
+                for chunk in text_chunks
+            ]
+            reused = sum(chunk.text in reusable_vectors for chunk in text_chunks)
+            if reused:
+                metrics.NEAR_DUPLICATE_REUSED_CHUNKS.inc(reused)
+            for i, (chunk, embedding) in enumerate(zip(text_chunks, chunk_embeddings)):
                 # Create chunk metadata
                 chunk_metadata = schemas.ChunkMetadata(
-                    text=chunk_text,
-                    offset=offset,
-                    extra={"chunk_index": i, "chunk_length": len(chunk_text)},
+                    text=chunk.text,
+                    offset=chunk.offset,
+                    extra={
+                        "chunk_index": i,
+                        "chunk_length": len(chunk.text),
+                        "token_count": chunk.tokens,
+                    },
                 )
 
                 # Create chunk upsert object
@@ -202,65 +495,273 @@ async def ingest_file(
                     metadata=chunk_metadata,
                 )
                 chunks_to_upsert.append(chunk_upsert)
-        except Exception as e:
-            error_str = str(e)
-            if "OpenAI API error" in error_str:
-                if "502" in error_str or "503" in error_str or "504" in error_str:
-                    raise ToolError(
-                        f"OpenAI API is temporarily unavailable (server error). Please try again in a few minutes. Details: {error_str}"
-                    )
-                elif "429" in error_str:
-                    raise ToolError(
-                        f"OpenAI API rate limit exceeded. Please try again later. Details: {error_str}"
-                    )
-                elif "timeout" in error_str.lower():
-                    raise ToolError(
-                        f"OpenAI API request timed out. Please try again. Details: {error_str}"
-                    )
-                else:
-                    raise ToolError(f"OpenAI API error: {error_str}")
+    except Exception as e:
+        await _cancel_all(embed_tasks)
+        error_str = str(e)
+        if "OpenAI API error" in error_str:
+            if "502" in error_str or "503" in error_str or "504" in error_str:
+                raise ToolError(
+                    f"OpenAI API is temporarily unavailable (server error). Please try again in a few minutes. Details: {error_str}"
+                )
+            elif "429" in error_str:
+                raise ToolError(
+                    f"OpenAI API rate limit exceeded. Please try again later. Details: {error_str}"
+                )
+            elif "timeout" in error_str.lower():
+                raise ToolError(
+                    f"OpenAI API request timed out. Please try again. Details: {error_str}"
+                )
             else:
-                raise ToolError(f"Failed to create embeddings: {error_str}")
+                raise ToolError(f"OpenAI API error: {error_str}")
+        else:
+            raise ToolError(f"Failed to create embeddings: {error_str}")
+
+    # Store all chunks
+    if chunks_to_upsert:
+        with metrics.stage("upsert", chunks=len(chunks_to_upsert)):
+            try:
+                await db.upsert_chunks(
+                    user_id,
+                    knowledge_set_id,
+                    file_id,
+                    chunks_to_upsert,
+                    embedding_model,
+                    supersedes=previous_file_id,
+                )
+            except db.EmbeddingModelChanged as e:
+                # A re-embed switched the set while this file was in flight
+                embedding_model = e.model
+                vectors = await generate_embeddings_batch(
+                    [chunk.text for chunk in text_chunks],
+                    [chunk.tokens for chunk in text_chunks],
+                    model=embedding_model,
+                )
+                for chunk_upsert, vector in zip(chunks_to_upsert, vectors):
+                    chunk_upsert.embedding = vector
+                await db.upsert_chunks(
+                    user_id,
+                    knowledge_set_id,
+                    file_id,
+                    chunks_to_upsert,
+                    embedding_model,
+                    supersedes=previous_file_id,
+                )
 
-        # Store all chunks
-        if chunks_to_upsert:
-            await db.upsert_chunks(user_id, knowledge_set_id, file_id, chunks_to_upsert)
+    await store_signature()
+    if cache_scope is not None:
+        await db.record_extraction(
+            cache_scope,
+            content_hash,
+            pipeline,
+            user_id,
+            knowledge_set_id,
+            file_id,
+            len(chunks_to_upsert),
+        )
 
-        return schemas.FileUploadResponse(
-            file_id=file_id,
-            filename=filename,
-            chunks_created=len(chunks_to_upsert),
-            message=version_message,
-            is_duplicate=False,
-            existing_file_id=previous_file_id,
+    metrics.FILES_INGESTED.inc(result="version" if previous_file_id else "new")
+    metrics.CHUNKS_INGESTED.inc(len(chunks_to_upsert))
+
+    return schemas.FileUploadResponse(
+        file_id=file_id,
+        filename=filename,
+        chunks_created=len(chunks_to_upsert),
+        message=version_message,
+        is_duplicate=False,
+        existing_file_id=previous_file_id,
+    )
+
+
+@mcp.tool(name="ingest_file")
+async def ingest_file(
+    knowledge_set_id: Annotated[
+        str, Field(description="The knowledge set ID to ingest the file into")
+    ],
+    filename: Annotated[str, Field(description="The name of the file")],
+    content: Annotated[
+        str, Field(description="The base64-encoded content of the file")
+    ],
+) -> schemas.FileUploadResponse:
+    """
+    Upload and process a file: extract text, chunk it, generate embeddings, and store in the database.
+    For large files use begin_upload / upload_part / commit_upload instead.
+    """
+    user_id = _get_user_id()
+
+    try:
+        file_extension = filename.split(".")[-1]
+
+        # Decode base64 content to bytes
+        try:
+            content_bytes = base64.b64decode(content)
+        except Exception as e:
+            raise ToolError(f"Failed to decode base64 content to bytes: {e}")
+
+        # Generate content hash for duplicate detection
+        content_hash = hashlib.sha256(content_bytes).hexdigest()
+
+        return await _ingest_content(
+            user_id,
+            knowledge_set_id,
+            filename,
+            file_extension,
+            content_hash,
+            len(content_bytes),
+            lambda: text_proc.extract_segments_from_content(
+                content_bytes, file_extension
+            ),
         )
 
     except Exception as e:
         raise ToolError(f"Failed to process file: {e}")
 
 
+@mcp.tool(name="begin_upload")
+async def begin_upload(
+    knowledge_set_id: Annotated[
+        str, Field(description="The knowledge set ID to ingest the file into")
+    ],
+    filename: Annotated[str, Field(description="The name of the file")],
+) -> schemas.UploadSessionInfo:
+    """
+    Start a chunked upload for a large file. Send the content with upload_part
+    and finish with commit_upload.
+    """
+    user_id = _get_user_id()
+    session = uploads.begin_upload(user_id, knowledge_set_id, filename)
+    return schemas.UploadSessionInfo(
+        upload_id=session.upload_id,
+        knowledge_set_id=knowledge_set_id,
+        filename=filename,
+        max_upload_size=MAX_UPLOAD_SIZE,
+    )
+
+
+@mcp.tool(name="upload_part")
+async def upload_part(
+    upload_id: Annotated[str, Field(description="The upload ID from begin_upload")],
+    part_number: Annotated[
+        int, Field(description="Sequence number of this part, starting at 1", ge=1)
+    ],
+    content: Annotated[
+        str, Field(description="The base64-encoded content of this part")
+    ],
+) -> schemas.UploadPartResponse:
+    """Append the next part of a chunked upload. Parts must be sent in order."""
+    user_id = _get_user_id()
+    try:
+        data = base64.b64decode(content)
+    except Exception as e:
+        raise ToolError(f"Failed to decode base64 content to bytes: {e}")
+
+    try:
+        session = await uploads.append_part(user_id, upload_id, part_number, data)
+    except ValueError as e:
+        raise ToolError(str(e))
+
+    return schemas.UploadPartResponse(
+        upload_id=upload_id,
+        part_number=part_number,
+        bytes_received=session.bytes_received,
+    )
+
+
+@mcp.tool(name="commit_upload")
+async def commit_upload(
+    upload_id: Annotated[str, Field(description="The upload ID from begin_upload")],
+) -> schemas.FileUploadResponse:
+    """
+    Finish a chunked upload and process the file: extract text, chunk it, generate
+    embeddings, and store in the database.
+    """
+    user_id = _get_user_id()
+    try:
+        session = uploads.finish_upload(user_id, upload_id)
+    except ValueError as e:
+        raise ToolError(str(e))
+
+    try:
+        file_extension = session.filename.split(".")[-1]
+        return await _ingest_content(
+            user_id,
+            session.knowledge_set_id,
+            session.filename,
+            file_extension,
+            await uploads.content_hash(session),
+            session.bytes_received,
+            lambda: text_proc.extract_segments_from_file(session.path, file_extension),
+        )
+    except Exception as e:
+        raise ToolError(f"Failed to process file: {e}")
+    finally:
+        uploads.discard(session)
+
+
+@mcp.tool(name="abort_upload")
+async def abort_upload(
+    upload_id: Annotated[str, Field(description="The upload ID from begin_upload")],
+) -> dict:
+    """Cancel a chunked upload and discard the parts received so far."""
+    user_id = _get_user_id()
+    aborted = uploads.abort_upload(user_id, upload_id)
+    return {"aborted": aborted}
+
+
 @mcp.tool(name="list_files")
 async def list_files(
     knowledge_set_id: Annotated[
         str, Field(description="The knowledge set ID to list files from")
     ],
-) -> list[schemas.FileInfo]:
-    """List all files for the specified knowledge set."""
+    limit: Annotated[
+        int,
+        Field(description="Maximum number of files to return", ge=1, le=MAX_PAGE_SIZE),
+    ] = DEFAULT_PAGE_SIZE,
+    cursor: Annotated[
+        Optional[str],
+        Field(description="next_cursor from the previous page, if any"),
+    ] = None,
+    sort_by: Annotated[
+        Literal["created_at", "filename"], Field(description="Field to sort by")
+    ] = "created_at",
+    order: Annotated[Literal["asc", "desc"], Field(description="Sort order")] = "asc",
+    fields: Annotated[
+        Optional[list[str]],
+        Field(
+            description="Metadata fields to return (e.g. filename, version). "
+            "Omit for all fields; leaving out 'text' keeps responses small."
+        ),
+    ] = None,
+) -> schemas.FileListPage:
+    """List files in the specified knowledge set, one page at a time."""
     user_id = _get_user_id()
+    files = []
+    next_cursor = None
+    last_sort_value = None
     try:
-        files = await db.list_files(user_id, knowledge_set_id)
-        if not files:
-            return []
-        return [
-            schemas.FileInfo(
-                file_id=f.file_id,
-                metadata=schemas.FileMetadata(**f.file_metadata),
-                created_at=f.created_at,
+        # Fetch one extra row to know whether there is another page
+        async for row in db.stream_files(
+            user_id,
+            knowledge_set_id,
+            limit + 1,
+            cursor,
+            sort_by=sort_by,
+            descending=order == "desc",
+            fields=fields,
+        ):
+            if len(files) == limit:
+                next_cursor = db.encode_cursor(last_sort_value, files[-1].file_id)
+                continue
+            files.append(
+                schemas.FileListItem(
+                    file_id=row.file_id,
+                    metadata=row.file_metadata,
+                    created_at=row.created_at,
+                )
             )
-            for f in files
-        ]
+            last_sort_value = row.sort_value
     except ValueError as e:
         raise ToolError(str(e))
+    return schemas.FileListPage(files=files, next_cursor=next_cursor)
 
 
 @mcp.tool(name="remove_file")
@@ -297,17 +798,28 @@ async def text_query(
     """Given a query text, return the top 5 most relevant chunks from the knowledge base"""
     user_id = _get_user_id()
 
-    # Generate embedding for the query text
-    query_embedding = await generate_embedding(query_text)
+    # Embed the query with the model the set's chunks were embedded with
+    embedding_model = (
+        await db.get_embedding_model(user_id, knowledge_set_id) or EMBEDDING_MODEL
+    )
+    with metrics.stage("query_embed"):
+        query_embedding = await generate_embedding(
+            query_text,
+            priority=embeddings.PRIORITY_INTERACTIVE,
+            model=embedding_model,
+        )
 
-    # Query the database
-    rows = await db.query_chunks(user_id, knowledge_set_id, query_embedding, top_k)
+    # Query the database (or the result cache)
+    with metrics.stage("query", top_k=top_k):
+        rows = await query_cache.query(
+            user_id, knowledge_set_id, query_embedding, top_k, embedding_model
+        )
     return [
         schemas.QueryResult(
-            file_id=r.file_id,
-            chunk_id=r.chunk_id,
-            score=r.score,
-            metadata=schemas.ChunkMetadata(**r.chunk_metadata),
+            file_id=r["file_id"],
+            chunk_id=r["chunk_id"],
+            score=r["score"],
+            metadata=schemas.ChunkMetadata(**r["chunk_metadata"]),
         )
         for r in rows
     ]
@@ -315,7 +827,11 @@ async def text_query(
 
 async def streamable_http_server():
     """Main entry point for the MCP server."""
-    await db.init_db()
+    print("✓ Configuration loaded successfully")
+    # DB init, API key validation and warm-up run in the background; /ready
+    # flips once they finish so the listener comes up immediately
+    startup_task = asyncio.create_task(readiness.startup())
+    compaction_task = asyncio.create_task(compaction.run_periodically())
     await mcp.run_async(
         transport="streamable-http",  # fixed to streamable-http
         host="0.0.0.0",
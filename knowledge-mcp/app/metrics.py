@@ -0,0 +1,300 @@
+"""
+In-process metrics for knowledge-mcp, exposed in Prometheus text format.
+
+A deliberately small implementation (counters, gauges, histograms) so the
+server doesn't need prometheus_client. ``stage()`` times a pipeline stage,
+records errors and, when OTEL_TRACING_ENABLED is set and the OpenTelemetry
+API is installed, wraps the stage in a span.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.config import OTEL_TRACING_ENABLED
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the (unlabelled) value at scrape time."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                yield f"{self.name} {_format_value(self._function())}"
+            except Exception:
+                pass
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (per-bucket counts incl. +Inf, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(k, (list(c), s)) for k, (c, s) in self._values.items()]
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render() -> str:
+    """Render all registered metrics in Prometheus text exposition format."""
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# Metric definitions
+STAGE_DURATION = Histogram(
+    "knowledge_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+)
+STAGE_ERRORS = Counter(
+    "knowledge_stage_errors_total",
+    "Pipeline stage failures",
+    ["stage"],
+)
+EMBEDDING_REQUESTS = Counter(
+    "knowledge_embedding_requests_total",
+    "Embedding API requests by outcome",
+    ["status"],
+)
+EMBEDDING_TOKENS = Counter(
+    "knowledge_embedding_tokens_total",
+    "Tokens consumed by embedding requests",
+)
+EMBEDDING_RETRIES = Counter(
+    "knowledge_embedding_retries_total",
+    "Embedding API retries by reason",
+    ["reason"],
+)
+EMBEDDING_BATCH_INPUTS = Histogram(
+    "knowledge_embedding_batch_inputs",
+    "Inputs packed into each successful embedding request",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+)
+EMBEDDING_QUEUE_WAIT = Histogram(
+    "knowledge_embedding_queue_wait_seconds",
+    "Time embedding requests wait for a scheduler slot",
+    ["priority"],
+)
+EMBEDDING_CONCURRENCY_LIMIT = Gauge(
+    "knowledge_embedding_concurrency_limit",
+    "Current adaptive concurrency limit for embedding requests",
+)
+EMBEDDING_IN_FLIGHT = Gauge(
+    "knowledge_embedding_in_flight",
+    "Embedding requests currently in flight",
+)
+EMBEDDING_QUEUE_DEPTH = Gauge(
+    "knowledge_embedding_queue_depth",
+    "Embedding requests waiting for a scheduler slot",
+)
+CACHE_REQUESTS = Counter(
+    "knowledge_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+DB_POOL_WAIT = Histogram(
+    "knowledge_db_pool_wait_seconds",
+    "Time spent waiting to check out a database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "knowledge_db_pool_checked_out",
+    "Database connections currently checked out of the pool",
+)
+FILES_INGESTED = Counter(
+    "knowledge_files_ingested_total",
+    "Files ingested by outcome",
+    ["result"],
+)
+CHUNKS_INGESTED = Counter(
+    "knowledge_chunks_ingested_total",
+    "Chunks embedded and stored",
+)
+NEAR_DUPLICATES = Counter(
+    "knowledge_near_duplicates_total",
+    "Uploads matched to a near-duplicate file, by policy action (skip, version, diff)",
+    ["action"],
+)
+NEAR_DUPLICATE_REUSED_CHUNKS = Counter(
+    "knowledge_near_duplicate_reused_chunks_total",
+    "Chunk vectors reused from a near-duplicate instead of embedded",
+)
+REEMBEDDED_CHUNKS = Counter(
+    "knowledge_reembedded_chunks_total",
+    "Chunks embedded again by the re-embed job",
+)
+COMPACTED_FILES = Counter(
+    "knowledge_compaction_files_total",
+    "Superseded file versions compacted, by action (deleted, text_dropped)",
+    ["action"],
+)
+COMPACTION_RECLAIMED_BYTES = Counter(
+    "knowledge_compaction_reclaimed_bytes_total",
+    "Bytes of file metadata reclaimed by compaction",
+)
+
+
+# Tracing
+_tracer = None
+if OTEL_TRACING_ENABLED:
+    try:
+        from opentelemetry import trace
+
+        _tracer = trace.get_tracer("knowledge-mcp")
+    except ImportError:
+        print("Warning: OTEL_TRACING_ENABLED is set but opentelemetry is not installed")
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a pipeline stage, count failures and emit a span when tracing is on."""
+    span_cm = (
+        _tracer.start_as_current_span(f"knowledge.{name}", attributes=attributes)
+        if _tracer is not None
+        else None
+    )
+    span = span_cm.__enter__() if span_cm is not None else None
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        STAGE_ERRORS.inc(stage=name)
+        if span_cm is not None:
+            span_cm.__exit__(type(e), e, e.__traceback__)
+            span_cm = None
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=name)
+        if span_cm is not None:
+            span_cm.__exit__(None, None, None)
@@ -0,0 +1,123 @@
+"""
+Near-duplicate detection for uploads.
+
+The content hash only catches byte-identical uploads. A re-exported PDF or
+the same document with a new footer extracts to almost the same text but
+hashes differently, so it would be embedded again and then crowd query
+results with duplicate chunks.
+
+Every ingested file gets a MinHash signature of its extracted text: the
+text is lowercased and split into words, runs of NEAR_DUPLICATE_SHINGLE_WORDS
+words are hashed, and each of NEAR_DUPLICATE_PERMUTATIONS hash permutations
+keeps its minimum. The fraction of equal positions in two signatures
+estimates the Jaccard similarity of the two shingle sets.
+
+For lookup the signature is cut into NEAR_DUPLICATE_BANDS bands and each
+band is hashed to a bucket (locality-sensitive hashing). Files sharing at
+least one bucket with an upload are the candidates; with the default 16
+bands of 8 values, a file at 0.9 similarity is a candidate with probability
+above 0.999 and one at 0.5 with about 0.06. Candidates are then compared on
+the full signature against NEAR_DUPLICATE_THRESHOLD.
+"""
+
+import hashlib
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from app.config import (
+    NEAR_DUPLICATE_SHINGLE_WORDS,
+    NEAR_DUPLICATE_PERMUTATIONS,
+    NEAR_DUPLICATE_BANDS,
+)
+
+_WORD = re.compile(r"\w+")
+_MASK = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+# Shingles hashed against every permutation at once
+_BLOCK = 4096
+
+# Permutations are multiply-shift hashes (a * x + b mod 2**64) >> 32 with
+# odd a. Signatures are stored, so they must never change: a fixed seed on
+# the legacy generator, whose stream numpy keeps stable.
+_rng = np.random.RandomState(20240611)
+_A = _rng.randint(
+    0, 1 << 63, size=NEAR_DUPLICATE_PERMUTATIONS, dtype=np.uint64
+) * np.uint64(2) + np.uint64(1)
+_B = _rng.randint(0, 1 << 63, size=NEAR_DUPLICATE_PERMUTATIONS, dtype=np.uint64)
+
+
+def scheme() -> str:
+    """
+    Signatures are only comparable when computed with the same parameters,
+    and their stored buckets only when cut into the same bands.
+    """
+    return (
+        f"minhash:{NEAR_DUPLICATE_PERMUTATIONS}:{NEAR_DUPLICATE_SHINGLE_WORDS}"
+        f":{NEAR_DUPLICATE_BANDS}"
+    )
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """
+    32-bit hashes of every run of shingle-size words. Repeats are left in:
+    they can't change a minimum, and deduplicating costs more than hashing.
+    """
+    words = np.fromiter(
+        (zlib.crc32(word.encode("utf-8")) for word in _WORD.findall(text.lower())),
+        dtype=np.uint64,
+    )
+    if words.size == 0:
+        return words
+    size = min(NEAR_DUPLICATE_SHINGLE_WORDS, words.size)
+    count = words.size - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(size):
+        hashes = (hashes * np.uint64(1000003) + words[i : i + count]) & _MASK
+    return hashes
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of ``text``, or None if it has no words."""
+    shingles = _shingle_hashes(text)
+    if shingles.size == 0:
+        return None
+    minimum = np.full(NEAR_DUPLICATE_PERMUTATIONS, _MASK, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for start in range(0, shingles.size, _BLOCK):
+            block = shingles[start : start + _BLOCK, None]
+            permuted = (block * _A + _B) >> _SHIFT
+            np.minimum(minimum, permuted.min(axis=0), out=minimum)
+    return minimum.astype("<u4")
+
+
+def band_buckets(sig: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket per LSH band."""
+    rows = sig.size // NEAR_DUPLICATE_BANDS
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                sig[band * rows : (band + 1) * rows].tobytes(), digest_size=8
+            ).digest(),
+            "big",
+            signed=True,
+        )
+        for band in range(NEAR_DUPLICATE_BANDS)
+    ]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    if a.size != b.size:
+        return 0.0
+    return float(np.count_nonzero(a == b)) / a.size
+
+
+def to_bytes(sig: np.ndarray) -> bytes:
+    return sig.astype("<u4").tobytes()
+
+
+def from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4")
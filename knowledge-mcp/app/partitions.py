@@ -0,0 +1,250 @@
+"""
+Optional partitioning of the ``chunks`` table.
+
+CHUNKS_PARTITIONING selects the layout:
+
+- ``none`` (default): a single plain table.
+- ``hash``: ``PARTITION BY HASH (user_id)`` into CHUNKS_HASH_PARTITIONS
+  partitions. Deletes stay row-level but only touch one tenant's partition.
+- ``list``: ``PARTITION BY LIST (knowledge_set_id)``. Every knowledge set
+  created from then on gets its own partition, so deleting it is a
+  TRUNCATE of that partition instead of a row-by-row DELETE; the empty
+  partition is detached and dropped in the background. Sets created before (and any
+  stray rows) land in a DEFAULT partition that is hash-partitioned by user_id.
+
+Row-level deletes schedule a debounced background VACUUM of the affected
+partition so dead tuples and ANN index bloat are reclaimed promptly.
+"""
+
+import asyncio
+import hashlib
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.config import (
+    CHUNKS_PARTITIONING,
+    CHUNKS_HASH_PARTITIONS,
+    VACUUM_DELAY_SECONDS,
+)
+
+PARENT_TABLE = "chunks"
+DEFAULT_PARTITION = "chunks_default"
+
+# Set by init_db once the actual table layout has been checked
+_active_mode: str = "none"
+
+
+def table_args() -> Dict[str, str]:
+    """Table kwargs for the ChunkEntry model under the configured layout."""
+    if CHUNKS_PARTITIONING == "hash":
+        return {"postgresql_partition_by": "HASH (user_id)"}
+    if CHUNKS_PARTITIONING == "list":
+        return {"postgresql_partition_by": "LIST (knowledge_set_id)"}
+    return {}
+
+
+def active_mode() -> str:
+    return _active_mode
+
+
+def knowledge_set_partition_name(knowledge_set_id: str) -> str:
+    digest = hashlib.md5(knowledge_set_id.encode("utf-8")).hexdigest()[:16]
+    return f"chunks_ks_{digest}"
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+async def _create_hash_partitions(conn: AsyncConnection, parent: str, prefix: str):
+    for remainder in range(CHUNKS_HASH_PARTITIONS):
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {prefix}_h{remainder} PARTITION OF {parent} "
+                f"FOR VALUES WITH (MODULUS {CHUNKS_HASH_PARTITIONS}, REMAINDER {remainder})"
+            )
+        )
+
+
+async def ensure_layout(conn: AsyncConnection):
+    """Create the partitions for the configured layout and record what's active."""
+    global _active_mode
+
+    result = await conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": PARENT_TABLE},
+    )
+    row = result.first()
+    partitioned = row is not None and row.relkind == "p"
+
+    if CHUNKS_PARTITIONING == "none":
+        _active_mode = "none"
+        return
+    if not partitioned:
+        print(
+            f"Warning: CHUNKS_PARTITIONING={CHUNKS_PARTITIONING} but the existing "
+            "'chunks' table is not partitioned; falling back to row-level deletes. "
+            "Recreate the table (or migrate it into a partitioned one) to enable it."
+        )
+        _active_mode = "none"
+        return
+
+    if CHUNKS_PARTITIONING == "hash":
+        await _create_hash_partitions(conn, PARENT_TABLE, PARENT_TABLE)
+    else:
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} "
+                "DEFAULT PARTITION BY HASH (user_id)"
+            )
+        )
+        await _create_hash_partitions(conn, DEFAULT_PARTITION, DEFAULT_PARTITION)
+    _active_mode = CHUNKS_PARTITIONING
+
+
+async def create_knowledge_set_partition(conn: AsyncConnection, knowledge_set_id: str):
+    """Give a new knowledge set its own list partition (list mode only)."""
+    if _active_mode != "list":
+        return
+    name = knowledge_set_partition_name(knowledge_set_id)
+    await conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES IN ({_quote_literal(knowledge_set_id)})"
+        )
+    )
+
+
+async def _has_partition(conn: AsyncConnection, name: str) -> bool:
+    result = await conn.execute(
+        text(
+            "SELECT 1 FROM pg_inherits "
+            "WHERE inhrelid = to_regclass(:name) AND inhparent = to_regclass(:parent)"
+        ),
+        {"name": name, "parent": PARENT_TABLE},
+    )
+    return result.first() is not None
+
+
+async def truncate_knowledge_set_partition(
+    conn: AsyncConnection, knowledge_set_id: str
+) -> bool:
+    """
+    Empty the knowledge set's partition if it has one, locking only that
+    partition. Returns False if the set's chunks live in a shared partition
+    instead. Once the caller has committed, schedule_partition_drop detaches
+    and drops the empty partition.
+    """
+    if _active_mode != "list":
+        return False
+    name = knowledge_set_partition_name(knowledge_set_id)
+    if not await _has_partition(conn, name):
+        return False
+    await conn.execute(text(f"TRUNCATE {name}"))
+    return True
+
+
+async def chunk_relation(
+    conn: AsyncConnection, user_id: str, knowledge_set_id: str
+) -> Optional[str]:
+    """Leaf table that holds a knowledge set's chunks (all of them share one)."""
+    result = await conn.execute(
+        text(
+            "SELECT tableoid::regclass::text AS relation FROM chunks "
+            "WHERE user_id = :user_id AND knowledge_set_id = :knowledge_set_id LIMIT 1"
+        ),
+        {"user_id": user_id, "knowledge_set_id": knowledge_set_id},
+    )
+    row = result.first()
+    return row.relation if row else None
+
+
+# background vacuum scheduling
+# (engine, relation): partition names repeat across shards
+_pending_vacuum: Set[Tuple[AsyncEngine, str]] = set()
+_vacuum_task: Optional[asyncio.Task] = None
+
+
+async def _vacuum_pending():
+    global _vacuum_task
+    try:
+        # Debounce: let a burst of deletes against the same partition settle
+        await asyncio.sleep(VACUUM_DELAY_SECONDS)
+        while _pending_vacuum:
+            engine, relation = _pending_vacuum.pop()
+            try:
+                async with engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    await conn.execute(text(f"VACUUM (ANALYZE) {relation}"))
+            except Exception as e:
+                print(f"Warning: background VACUUM of {relation} failed: {e}")
+    finally:
+        _vacuum_task = None
+
+
+def schedule_vacuum(engine: AsyncEngine, relation: Optional[str]):
+    """Queue ``relation`` for a background VACUUM after row-level deletes."""
+    global _vacuum_task
+    if not relation or VACUUM_DELAY_SECONDS <= 0:
+        return
+    _pending_vacuum.add((engine, relation))
+    if _vacuum_task is None:
+        _vacuum_task = asyncio.create_task(_vacuum_pending())
+
+
+# background partition drops
+# DETACH PARTITION locks the whole chunks table (CONCURRENTLY is ruled out by
+# the DEFAULT partition), so each attempt gives up quickly rather than
+# queueing every tenant's queries behind it, and is retried later
+DETACH_LOCK_TIMEOUT_MS = 200
+DETACH_ATTEMPTS = 10
+DETACH_RETRY_SECONDS = 5.0
+
+_drop_tasks: Set[asyncio.Task] = set()
+
+
+async def _drop_partition(engine: AsyncEngine, knowledge_set_id: str):
+    name = knowledge_set_partition_name(knowledge_set_id)
+    for attempt in range(1, DETACH_ATTEMPTS + 1):
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    text(f"SET LOCAL lock_timeout = {DETACH_LOCK_TIMEOUT_MS}")
+                )
+                # A set created again under the same ID reuses the partition
+                recreated = await conn.execute(
+                    text("SELECT 1 FROM knowledge_sets WHERE knowledge_set_id = :id"),
+                    {"id": knowledge_set_id},
+                )
+                if recreated.first() is not None:
+                    return
+                if await _has_partition(conn, name):
+                    await conn.execute(
+                        text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+                    )
+                await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            return
+        except Exception as e:
+            if attempt == DETACH_ATTEMPTS:
+                print(
+                    f"Warning: dropping partition {name} failed, it is left empty: {e}"
+                )
+                return
+            await asyncio.sleep(DETACH_RETRY_SECONDS * attempt)
+
+
+def schedule_partition_drop(engine: AsyncEngine, knowledge_set_id: Optional[str]):
+    """Detach and drop a deleted knowledge set's emptied partition in the background."""
+    if not knowledge_set_id:
+        return
+    task = asyncio.create_task(_drop_partition(engine, knowledge_set_id))
+    _drop_tasks.add(task)
+    task.add_done_callback(_drop_tasks.discard)
+
+
+async def wait_for_partition_drops():
+    """Let scheduled partition drops finish (CLIs call this before exiting)."""
+    if _drop_tasks:
+        await asyncio.gather(*_drop_tasks)
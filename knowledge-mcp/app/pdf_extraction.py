@@ -0,0 +1,124 @@
+"""
+Page-parallel PDF extraction.
+
+MarkItDown converts a PDF with a single ``pdfminer`` pass over every page on
+one core. For large PDFs the page range is split into shards of
+PDF_PAGES_PER_SHARD pages that a process pool converts concurrently, using
+the same ``pdfminer`` call restricted to the shard's pages. pdfminer ends
+every page with a form feed, so the shards concatenated in page order are
+exactly the single-pass text.
+
+``extract_pdf_segments`` yields the markdown in order as shards finish,
+already normalized the way MarkItDown normalizes converter output. Segment
+boundaries are placed where that normalization can't reach across them, so
+the joined segments equal ``MarkItDown().convert(...).markdown`` character
+for character and offsets into a segment only need the segment's start
+added.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, BinaryIO, Optional
+
+from app.config import (
+    PDF_EXTRACTION_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_SHARD,
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def should_parallelize(pages: int) -> bool:
+    return PDF_EXTRACTION_WORKERS > 1 and pages >= PDF_PARALLEL_MIN_PAGES
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Process-wide worker pool, started on first use."""
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the server has an event loop and threads running
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def count_pages(stream: BinaryIO) -> int:
+    """Number of pages pdfminer will visit, or 0 if the PDF can't be parsed."""
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+
+    try:
+        document = PDFDocument(PDFParser(stream))
+        return sum(1 for _ in PDFPage.create_pages(document))
+    except Exception:
+        return 0
+
+
+def _extract_shard(path: str, first_page: int, last_page: int) -> str:
+    """Worker: raw pdfminer text of pages [first_page, last_page)."""
+    import pdfminer.high_level
+
+    return pdfminer.high_level.extract_text(
+        path, page_numbers=range(first_page, last_page), maxpages=last_page
+    )
+
+
+def normalize(text: str) -> str:
+    """MarkItDown's post-conversion cleanup: strip line ends, collapse blank runs."""
+    text = "\n".join(line.rstrip() for line in re.split(r"\r?\n", text))
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
+def _safe_cut(text: str) -> int:
+    """
+    Start of the last line with visible content. Normalizing the text before
+    and after it separately gives the same result as normalizing it whole,
+    whatever is appended later: no line and no blank-line run spans the cut.
+    """
+    end = len(text)
+    while end > 0:
+        start = text.rfind("\n", 0, end) + 1
+        if text[start:end].rstrip():
+            return start
+        end = start - 1
+    return 0
+
+
+async def extract_pdf_segments(path: str, pages: int) -> AsyncIterator[str]:
+    """
+    Convert the PDF at ``path`` in page shards on the worker pool, yielding
+    normalized markdown in page order as soon as each prefix is complete.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    shards = math.ceil(pages / PDF_PAGES_PER_SHARD)
+    futures = [
+        loop.run_in_executor(
+            pool,
+            _extract_shard,
+            path,
+            i * PDF_PAGES_PER_SHARD,
+            min(pages, (i + 1) * PDF_PAGES_PER_SHARD),
+        )
+        for i in range(shards)
+    ]
+    try:
+        pending = ""
+        for future in futures:
+            pending += await future
+            cut = _safe_cut(pending)
+            if cut:
+                yield normalize(pending[:cut])
+                pending = pending[cut:]
+        if pending:
+            yield normalize(pending)
+    finally:
+        for future in futures:
+            future.cancel()
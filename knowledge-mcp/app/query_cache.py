@@ -0,0 +1,140 @@
+"""
+Query result cache.
+
+Results are keyed by (user, knowledge set, set generation, query-embedding
+hash, top_k, mode). Every write to a knowledge set (create_file,
+upsert_chunks, delete_file, switching its embedding model) moves its
+generation to a fresh value from a global sequence and deleting the set
+removes it, so entries for an older generation simply stop matching; nothing
+has to be purged for correctness.
+
+QUERY_CACHE_BACKEND selects where entries live:
+
+- ``memory``: a per-process LRU bounded by QUERY_CACHE_MAX_ENTRIES.
+- ``postgres``: the shared ``query_cache`` table, so every replica benefits
+  from a question any of them has answered.
+- ``none``: always run the search.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import app.metrics as metrics
+import app.vector_db as db
+from app.config import (
+    QUERY_CACHE_BACKEND,
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_TTL_SECONDS,
+)
+
+# Purge expired rows from the shared table every this many stores
+PURGE_EVERY_STORES = 1000
+
+_memory: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_stores_since_purge = 0
+
+
+def cache_key(
+    user_id: str,
+    knowledge_set_id: str,
+    generation: int,
+    embedding: List[float],
+    top_k: int,
+    mode: str,
+) -> str:
+    vector_hash = hashlib.sha256(
+        np.asarray(embedding, dtype=np.float32).tobytes()
+    ).hexdigest()
+    scope = f"{user_id}\x00{knowledge_set_id}\x00{generation}\x00{top_k}\x00{mode}"
+    return hashlib.sha256(f"{scope}\x00{vector_hash}".encode("utf-8")).hexdigest()
+
+
+def _memory_get(key: str) -> Optional[List[Dict[str, Any]]]:
+    entry = _memory.get(key)
+    if entry is None:
+        return None
+    expires_at, results = entry
+    if time.monotonic() > expires_at:
+        _memory.pop(key, None)
+        return None
+    _memory.move_to_end(key)
+    return results
+
+
+def _memory_put(key: str, results: List[Dict[str, Any]]):
+    _memory[key] = (time.monotonic() + QUERY_CACHE_TTL_SECONDS, results)
+    _memory.move_to_end(key)
+    while len(_memory) > QUERY_CACHE_MAX_ENTRIES:
+        _memory.popitem(last=False)
+
+
+def _as_dicts(rows) -> List[Dict[str, Any]]:
+    return [
+        {
+            "file_id": r.file_id,
+            "chunk_id": r.chunk_id,
+            "score": float(r.score),
+            "chunk_metadata": r.chunk_metadata,
+        }
+        for r in rows
+    ]
+
+
+async def query(
+    user_id: str,
+    knowledge_set_id: str,
+    embedding: List[float],
+    top_k: int,
+    embedding_model: str,
+    mode: str = "vector",
+) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks for ``embedding``, made with ``embedding_model``, served from
+    the cache when the knowledge set hasn't changed since the same query was
+    last answered.
+    """
+    global _stores_since_purge
+
+    if QUERY_CACHE_BACKEND == "none":
+        return _as_dicts(
+            await db.query_chunks(
+                user_id, knowledge_set_id, embedding, top_k, embedding_model
+            )
+        )
+
+    generation = await db.get_generation(user_id, knowledge_set_id)
+    if generation is None:
+        # Unknown set: nothing to cache against
+        return _as_dicts(
+            await db.query_chunks(
+                user_id, knowledge_set_id, embedding, top_k, embedding_model
+            )
+        )
+
+    key = cache_key(user_id, knowledge_set_id, generation, embedding, top_k, mode)
+    if QUERY_CACHE_BACKEND == "postgres":
+        cached = await db.get_cached_query(user_id, key, QUERY_CACHE_TTL_SECONDS)
+    else:
+        cached = _memory_get(key)
+    metrics.record_cache("query", cached is not None)
+    if cached is not None:
+        return cached
+
+    results = _as_dicts(
+        await db.query_chunks(
+            user_id, knowledge_set_id, embedding, top_k, embedding_model
+        )
+    )
+    if QUERY_CACHE_BACKEND == "postgres":
+        await db.store_cached_query(key, user_id, knowledge_set_id, results)
+        _stores_since_purge += 1
+        if _stores_since_purge >= PURGE_EVERY_STORES:
+            _stores_since_purge = 0
+            await db.purge_expired_queries(QUERY_CACHE_TTL_SECONDS)
+    else:
+        _memory_put(key, results)
+    return results
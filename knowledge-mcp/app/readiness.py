@@ -0,0 +1,126 @@
+"""
+Startup and readiness tracking for knowledge-mcp.
+
+Nothing slow happens at import time. ``startup()`` runs as a background task
+once the server is listening: it initializes the database, validates the
+embedding provider and optionally warms up the pool, converters, tokenizer
+and chunkers. The ``/ready`` route reports ready only after all of that has
+succeeded.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict
+
+import app.vector_db as db
+import app.embeddings as embeddings
+import app.text_processing as text_proc
+from app.config import (
+    SKIP_OPENAI_VALIDATION,
+    WARMUP_ON_STARTUP,
+    WARMUP_POOL_CONNECTIONS,
+)
+
+MAX_RETRY_DELAY = 30.0
+
+
+@dataclass
+class ComponentStatus:
+    ok: bool = False
+    detail: str = "pending"
+
+
+components: Dict[str, ComponentStatus] = {
+    "database": ComponentStatus(),
+    "embedding_provider": ComponentStatus(),
+    "warmup": ComponentStatus(),
+}
+_started_at = time.monotonic()
+
+
+def is_ready() -> bool:
+    return all(c.ok for c in components.values())
+
+
+def report() -> dict:
+    return {
+        "ready": is_ready(),
+        "uptime_seconds": round(time.monotonic() - _started_at, 3),
+        "components": {name: asdict(c) for name, c in components.items()},
+    }
+
+
+async def _retry(name: str, action, fatal=()):
+    """Run ``action`` until it succeeds, recording progress on the component."""
+    status = components[name]
+    delay = 0.5
+    while True:
+        try:
+            await action()
+            status.ok, status.detail = True, "ok"
+            return
+        except fatal as e:
+            status.ok, status.detail = False, f"failed: {e}"
+            print(f"✗ {name} check failed permanently: {e}")
+            return
+        except Exception as e:
+            status.ok, status.detail = False, f"retrying: {e}"
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+async def _init_database():
+    await _retry("database", db.init_db)
+
+
+async def _validate_embedding_provider():
+    if SKIP_OPENAI_VALIDATION:
+        status = components["embedding_provider"]
+        status.ok, status.detail = True, "validation skipped"
+        return
+    await _retry(
+        "embedding_provider",
+        embeddings.validate_openai_api_key,
+        fatal=(embeddings.EmbeddingProviderAuthError,),
+    )
+    if components["embedding_provider"].ok:
+        print("✓ OpenAI API key validated successfully")
+
+
+async def _warm_up():
+    status = components["warmup"]
+    if not WARMUP_ON_STARTUP:
+        status.ok, status.detail = True, "disabled"
+        return
+
+    # The pool needs the schema in place, so wait for the database first
+    while not components["database"].ok:
+        await asyncio.sleep(0.1)
+
+    started = time.monotonic()
+    try:
+        await asyncio.gather(
+            db.warm_pool(WARMUP_POOL_CONNECTIONS),
+            asyncio.to_thread(text_proc.get_markitdown),
+            asyncio.to_thread(
+                text_proc.chunk_text_with_tokens, "Warm up. The chunker."
+            ),
+        )
+    except Exception as e:
+        # Warm-up is an optimization; a failure here must not block readiness
+        print(f"Warning: warm-up failed ({e})")
+    status.ok = True
+    status.detail = f"ok ({time.monotonic() - started:.2f}s)"
+
+
+async def startup():
+    """Bring all components up concurrently; failures are reported, not raised."""
+    await asyncio.gather(
+        _init_database(),
+        _validate_embedding_provider(),
+        _warm_up(),
+        return_exceptions=True,
+    )
+    if is_ready():
+        print(f"✓ Ready after {time.monotonic() - _started_at:.2f}s")
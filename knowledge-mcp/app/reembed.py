@@ -0,0 +1,167 @@
+"""
+Zero-downtime re-embedding of knowledge sets with a new embedding model.
+
+Every knowledge set records the model its live vectors come from
+(``knowledge_sets.embedding_model``), and queries embed the question with
+that model and only match chunks from it. Changing EMBEDDING_MODEL only
+affects sets created afterwards; existing sets move over with this job:
+
+1. Read the set's chunk text in batches of REEMBED_BATCH_CHUNKS and embed
+   it with the new model at bulk priority, so the shared rate limiter keeps
+   serving interactive queries first.
+2. Write the vectors to the ``chunk_reembeddings`` shadow table. Queries keep
+   using the old vectors the whole time, and an interrupted run resumes
+   where it stopped.
+3. In one transaction, swap the shadow vectors into ``chunks`` and switch
+   the set's model.
+4. Re-embed any chunks written with the old model by ingests that raced the
+   switch.
+
+The new model must produce EMBEDDING_DIMENSION-sized vectors (set
+EMBEDDING_REQUEST_DIMENSIONS for models that can shorten theirs).
+
+Usage:
+    python -m app.reembed --user USER --knowledge-set KS [--model MODEL]
+    python -m app.reembed --all [--model MODEL]
+"""
+
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+import app.embeddings as embeddings
+import app.metrics as metrics
+import app.vector_db as db
+from app.config import EMBEDDING_MODEL, EMBEDDING_DIMENSION, REEMBED_BATCH_CHUNKS
+from app.text_processing import count_tokens
+
+# Knowledge sets fetched per page with --all
+SET_PAGE_SIZE = 1000
+
+
+async def _embed_pending(user_id: str, knowledge_set_id: str, model: str) -> int:
+    """Shadow-embed every chunk not yet on ``model``; returns how many."""
+    done = 0
+    after = None
+    while True:
+        rows = await db.chunks_to_reembed(
+            user_id, knowledge_set_id, model, after, REEMBED_BATCH_CHUNKS
+        )
+        if not rows:
+            return done
+        texts = [row.chunk_metadata["text"] for row in rows]
+        tokens = [
+            row.chunk_metadata.get("extra", {}).get("token_count") or count_tokens(text)
+            for row, text in zip(rows, texts)
+        ]
+        vectors = await embeddings.generate_embeddings_batch(texts, tokens, model=model)
+        if vectors and len(vectors[0]) != EMBEDDING_DIMENSION:
+            raise ValueError(
+                f"Model '{model}' returned {len(vectors[0])}-dimensional vectors, "
+                f"the chunks table stores {EMBEDDING_DIMENSION}"
+            )
+        await db.store_reembeddings(
+            user_id,
+            knowledge_set_id,
+            model,
+            [(row.file_id, row.chunk_id, v) for row, v in zip(rows, vectors)],
+        )
+        metrics.REEMBEDDED_CHUNKS.inc(len(rows))
+        done += len(rows)
+        after = (rows[-1].file_id, rows[-1].chunk_id)
+
+
+async def reembed_knowledge_set(
+    user_id: str, knowledge_set_id: str, model: str = EMBEDDING_MODEL
+) -> Dict[str, Any]:
+    """Move one knowledge set to ``model``; a no-op if it already uses it."""
+    current = await db.get_embedding_model(user_id, knowledge_set_id)
+    if current is None:
+        raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
+    result = {
+        "knowledge_set_id": knowledge_set_id,
+        "from_model": current,
+        "to_model": model,
+        "chunks_embedded": 0,
+        "chunks_switched": 0,
+    }
+    if current == model:
+        return result
+
+    # Shadow vectors left by an interrupted run for another model are useless
+    await db.clear_reembeddings(user_id, knowledge_set_id, keep_model=model)
+    result["chunks_embedded"] = await _embed_pending(user_id, knowledge_set_id, model)
+    result["chunks_switched"] = await db.switch_embedding_model(
+        user_id, knowledge_set_id, model
+    )
+
+    # Ingests that committed old-model vectors while the switch was waiting
+    stragglers = await _embed_pending(user_id, knowledge_set_id, model)
+    if stragglers:
+        result["chunks_embedded"] += stragglers
+        result["chunks_switched"] += await db.switch_embedding_model(
+            user_id, knowledge_set_id, model
+        )
+    return result
+
+
+async def reembed_all(model: str = EMBEDDING_MODEL) -> List[Dict[str, Any]]:
+    """Move every knowledge set not on ``model`` to it, one set at a time."""
+    results = []
+    after: Optional[tuple] = None
+    while True:
+        page = await db.list_all_knowledge_sets(after, SET_PAGE_SIZE)
+        for row in page:
+            if row.embedding_model == model:
+                continue
+            try:
+                result = await reembed_knowledge_set(
+                    row.user_id, row.knowledge_set_id, model
+                )
+            except db.TenantMoving as e:
+                # Rerun once the move between shards is done
+                result = {"knowledge_set_id": row.knowledge_set_id, "skipped": str(e)}
+            results.append({"user_id": row.user_id, **result})
+        if len(page) < SET_PAGE_SIZE:
+            return results
+        after = (page[-1].user_id, page[-1].knowledge_set_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-embed knowledge sets with a new embedding model"
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--all", action="store_true", help="Every knowledge set")
+    target.add_argument("--user", help="Owner user ID")
+    parser.add_argument("--knowledge-set", help="Knowledge set ID (with --user)")
+    parser.add_argument(
+        "--model",
+        default=EMBEDDING_MODEL,
+        help="Target embedding model (defaults to EMBEDDING_MODEL)",
+    )
+    args = parser.parse_args()
+    if args.user and not args.knowledge_set:
+        parser.error("--user requires --knowledge-set")
+
+    async def run():
+        try:
+            await db.init_db()
+            if args.all:
+                return await reembed_all(args.model)
+            return await reembed_knowledge_set(
+                args.user, args.knowledge_set, args.model
+            )
+        finally:
+            await db.dispose()
+
+    try:
+        result = asyncio.run(run())
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Tenant placement across database shards.
+
+With DATABASE_SHARDS configured, each user's knowledge sets, files and
+chunks live on one shard, picked by a consistent hash ring over the shard
+names unless the ``tenant_placements`` directory (on the first shard) pins
+the user elsewhere. Every server reloads the directory every
+SHARD_PLACEMENT_REFRESH_SECONDS.
+
+Moving a user:
+
+1. The directory marks the user as moving; servers refuse their writes
+   (reads still go to the source) once they have reloaded it.
+2. The user's rows are copied to the target in one transaction.
+3. The directory points the user at the target.
+4. Once every server has reloaded, the rows are deleted from the source.
+
+If the copy fails, the partial copy is removed and the user stays on the
+source. A move interrupted at any other point can simply be run again.
+
+Adding a shard: run ``pin`` with the new shard list before deploying it,
+so every user the new ring would reassign stays where their data is, then
+deploy the new DATABASE_SHARDS and run ``rebalance`` to move them over.
+
+Usage:
+    python -m app.shards status
+    python -m app.shards move --user USER --to SHARD
+    python -m app.shards pin --shards "s0=postgresql+asyncpg://...,s1=..."
+    python -m app.shards rebalance [--limit N]
+"""
+
+import argparse
+import asyncio
+import json
+from typing import Any, Dict, Optional
+
+import app.vector_db as db
+from app.config import SHARD_PLACEMENT_REFRESH_SECONDS, parse_database_shards
+
+# Rows per insert while copying a user
+COPY_BATCH_SIZE = 2000
+
+
+async def _wait_for_servers():
+    """Long enough for every server to have reloaded the directory."""
+    await asyncio.sleep(2 * SHARD_PLACEMENT_REFRESH_SECONDS)
+
+
+async def move_tenant(user_id: str, target_name: str) -> Dict[str, Any]:
+    """Move everything ``user_id`` owns to the shard named ``target_name``."""
+    target = db.shards.get(target_name)
+    if target is None:
+        raise ValueError(f"Unknown shard '{target_name}'")
+    source = db.shard_for(user_id)
+    result = {"user_id": user_id, "from": source.name, "to": target.name}
+    if source is target:
+        # Finish a move interrupted after the switch: clear the flag and
+        # anything left on other shards
+        await db.set_placement(user_id, target.name)
+        for shard in db.shards.values():
+            if shard is not target:
+                await db.delete_tenant(user_id, shard)
+        return {**result, "copied": {}}
+
+    await db.set_placement(user_id, source.name, moving_to=target.name)
+    await _wait_for_servers()
+    try:
+        copied = await db.copy_tenant(user_id, source, target, COPY_BATCH_SIZE)
+    except BaseException:
+        await db.delete_tenant(user_id, target)
+        await db.set_placement(user_id, source.name)
+        raise
+    await db.set_placement(user_id, target.name)
+    await db.load_placements()
+
+    # Servers that haven't reloaded yet still read from the source
+    await _wait_for_servers()
+    await db.delete_tenant(user_id, source)
+    return {**result, "copied": copied}
+
+
+async def pin(new_shards: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Pin every user that the ring over ``new_shards`` would place elsewhere
+    to the shard holding their data now.
+    """
+    new_ring = db.HashRing(new_shards)
+    current = db.placements()
+    pinned = 0
+    for shard in db.shards.values():
+        for user_id in await db.list_tenants(shard):
+            # Already pinned, or a leftover copy from an unfinished move
+            if user_id in current or db.shard_for(user_id) is not shard:
+                continue
+            if new_ring.shard(user_id) != shard.name:
+                await db.set_placement(user_id, shard.name)
+                pinned += 1
+    return {"pinned": pinned}
+
+
+async def rebalance(limit: Optional[int] = None) -> Dict[str, Any]:
+    """Move pinned users to their ring shard, at most ``limit`` of them."""
+    moves = []
+    for user_id, (shard, moving_to) in sorted(db.placements().items()):
+        if limit is not None and len(moves) >= limit:
+            break
+        home = db.ring.shard(user_id)
+        if moving_to is None and shard == home:
+            continue
+        # An unfinished move is restarted from wherever the user is placed
+        moves.append(await move_tenant(user_id, home))
+    return {"moved": moves}
+
+
+async def status() -> Dict[str, Any]:
+    current = db.placements()
+    report = {}
+    for shard in db.shards.values():
+        tenants = [
+            user_id
+            for user_id in await db.list_tenants(shard)
+            if db.shard_for(user_id) is shard
+        ]
+        report[shard.name] = {
+            "users": len(tenants),
+            "pinned": sum(1 for user_id in tenants if user_id in current),
+        }
+    report["moving"] = sorted(
+        user_id for user_id, (_, moving_to) in current.items() if moving_to
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage tenant placement on shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("status", help="Users per shard and moves in progress")
+
+    move = commands.add_parser("move", help="Move one user to another shard")
+    move.add_argument("--user", required=True, help="User ID")
+    move.add_argument("--to", required=True, help="Target shard name")
+
+    pin_parser = commands.add_parser(
+        "pin", help="Keep users in place before deploying a new shard list"
+    )
+    pin_parser.add_argument(
+        "--shards", required=True, help="The new DATABASE_SHARDS value"
+    )
+
+    rebalance_parser = commands.add_parser(
+        "rebalance", help="Move pinned users to their ring shard"
+    )
+    rebalance_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await db.init_db()
+            await db.load_placements()
+            if args.command == "move":
+                return await move_tenant(args.user, args.to)
+            if args.command == "pin":
+                return await pin(parse_database_shards(args.shards))
+            if args.command == "rebalance":
+                return await rebalance(args.limit)
+            return await status()
+        finally:
+            await db.dispose()
+
+    try:
+        result = asyncio.run(run())
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
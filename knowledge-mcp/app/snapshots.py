@@ -0,0 +1,384 @@
+"""
+Compact snapshots of knowledge sets for migration and backup.
+
+A snapshot is a zip archive with:
+
+- ``manifest.json``: format version, embedding model/dimension, counts
+- ``files.jsonl``: one file record per line
+- ``chunks.jsonl``: file_id, chunk_id and chunk metadata (including the chunk
+  text) per line, in the same order as the vectors
+- ``embeddings.npy``: every chunk vector as one float16 ``(chunks, dimension)``
+  array
+
+Export streams rows from a consistent (REPEATABLE READ) read, so memory use
+does not grow with the set. Import streams files and chunks back in batched
+COPYs in a single transaction instead of re-extracting and re-embedding
+anything; a set it created is deleted again if the import fails.
+
+Usage:
+    python -m app.snapshots export --user USER --knowledge-set KS --output ks.zip
+    python -m app.snapshots import --user USER --input ks.zip [--knowledge-set NEW]
+"""
+
+import argparse
+import asyncio
+import json
+import zipfile
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+import app.vector_db as db
+from app.config import EMBEDDING_MODEL, EMBEDDING_DIMENSION
+
+FORMAT_VERSION = 1
+BATCH_SIZE = 5000
+
+
+def _json_line(value: Any) -> bytes:
+    return (json.dumps(value, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+async def export_knowledge_set(
+    user_id: str, knowledge_set_id: str, path: str
+) -> Dict[str, Any]:
+    """Write a snapshot of the knowledge set to ``path``; returns the manifest."""
+    async with db.shard_for(user_id).engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            found = await conn.execute(
+                select(db.KnowledgeSet.embedding_model).where(
+                    (db.KnowledgeSet.user_id == user_id)
+                    & (db.KnowledgeSet.knowledge_set_id == knowledge_set_id)
+                )
+            )
+            knowledge_set = found.first()
+            if knowledge_set is None:
+                raise ValueError(
+                    f"Knowledge set '{knowledge_set_id}' not found for user"
+                )
+            embedding_model = knowledge_set.embedding_model or EMBEDDING_MODEL
+
+            # Only the live vectors; skips any an ingest raced a re-embed with
+            in_set = (
+                (db.ChunkEntry.user_id == user_id)
+                & (db.ChunkEntry.knowledge_set_id == knowledge_set_id)
+                & db.model_matches(embedding_model)
+            )
+            chunk_count = (
+                await conn.execute(select(func.count()).where(in_set))
+            ).scalar_one()
+
+            with zipfile.ZipFile(
+                path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+            ) as archive:
+                file_count = 0
+                with archive.open("files.jsonl", "w", force_zip64=True) as out:
+                    files = await conn.stream(
+                        select(
+                            db.FileRecord.file_id,
+                            db.FileRecord.file_metadata,
+                            db.FileRecord.created_at,
+                        )
+                        .where(
+                            (db.FileRecord.user_id == user_id)
+                            & (db.FileRecord.knowledge_set_id == knowledge_set_id)
+                        )
+                        .order_by(db.FileRecord.file_id)
+                        .execution_options(yield_per=BATCH_SIZE)
+                    )
+                    async for row in files:
+                        out.write(
+                            _json_line(
+                                {
+                                    "file_id": row.file_id,
+                                    "metadata": row.file_metadata,
+                                    "created_at": row.created_at.isoformat(),
+                                }
+                            )
+                        )
+                        file_count += 1
+
+                order = (db.ChunkEntry.file_id, db.ChunkEntry.chunk_id)
+                with archive.open("chunks.jsonl", "w", force_zip64=True) as out:
+                    chunks = await conn.stream(
+                        select(
+                            db.ChunkEntry.file_id,
+                            db.ChunkEntry.chunk_id,
+                            db.ChunkEntry.chunk_metadata,
+                        )
+                        .where(in_set)
+                        .order_by(*order)
+                        .execution_options(yield_per=BATCH_SIZE)
+                    )
+                    async for row in chunks:
+                        out.write(
+                            _json_line(
+                                {
+                                    "file_id": row.file_id,
+                                    "chunk_id": row.chunk_id,
+                                    "metadata": row.chunk_metadata,
+                                }
+                            )
+                        )
+
+                # Vectors don't deflate usefully; store them raw
+                header = {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype("<f2")),
+                    "fortran_order": False,
+                    "shape": (chunk_count, EMBEDDING_DIMENSION),
+                }
+                member = zipfile.ZipInfo(
+                    "embeddings.npy", date_time=datetime.now().timetuple()[:6]
+                )
+                member.compress_type = zipfile.ZIP_STORED
+                with archive.open(member, "w", force_zip64=True) as out:
+                    np.lib.format.write_array_header_2_0(out, header)
+                    vectors = await conn.stream(
+                        select(db.ChunkEntry.embedding)
+                        .where(in_set)
+                        .order_by(*order)
+                        .execution_options(yield_per=BATCH_SIZE)
+                    )
+                    async for batch in vectors.partitions():
+                        block = np.asarray([row[0] for row in batch], dtype="<f2")
+                        out.write(block.tobytes())
+
+                manifest = {
+                    "format_version": FORMAT_VERSION,
+                    "knowledge_set_id": knowledge_set_id,
+                    "embedding_model": embedding_model,
+                    "embedding_dimension": EMBEDDING_DIMENSION,
+                    "files": file_count,
+                    "chunks": chunk_count,
+                    "exported_at": datetime.now(timezone.utc).isoformat(),
+                }
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+
+    return manifest
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with zipfile.ZipFile(path) as archive:
+        return json.loads(archive.read("manifest.json"))
+
+
+def _json_lines(stream) -> Iterator[Dict[str, Any]]:
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _vector_batches(stream, batch_size: int) -> Iterator[np.ndarray]:
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(stream)
+    rows, dimension = shape
+    row_bytes = dimension * dtype.itemsize
+    remaining = rows
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        block = stream.read(count * row_bytes)
+        if len(block) != count * row_bytes:
+            raise ValueError("Snapshot embeddings are truncated")
+        yield np.frombuffer(block, dtype=dtype).reshape(count, dimension)
+        remaining -= count
+
+
+async def _load_snapshot(
+    user_id: str, knowledge_set_id: str, embedding_model: str, path: str
+) -> Tuple[int, int]:
+    """COPY the snapshot's files and chunks into the set; returns their counts."""
+    import asyncpg
+    from pgvector.asyncpg import register_vector
+
+    conn = await asyncpg.connect(
+        db.shard_for(user_id).url.replace("postgresql+asyncpg", "postgresql")
+    )
+    try:
+        await register_vector(conn)
+        async with conn.transaction():
+            existing = await conn.fetchval(
+                "SELECT count(*) FROM files WHERE user_id = $1 AND knowledge_set_id = $2",
+                user_id,
+                knowledge_set_id,
+            )
+            if existing:
+                raise ValueError(
+                    f"Knowledge set '{knowledge_set_id}' already has {existing} files; "
+                    "import into an empty or new knowledge set"
+                )
+
+            with zipfile.ZipFile(path) as archive:
+                files = 0
+                with archive.open("files.jsonl") as stream:
+                    records = _json_lines(stream)
+                    while batch := [
+                        (
+                            user_id,
+                            knowledge_set_id,
+                            record["file_id"],
+                            json.dumps(record["metadata"]),
+                            datetime.fromisoformat(record["created_at"]),
+                        )
+                        for record in islice(records, BATCH_SIZE)
+                    ]:
+                        await conn.copy_records_to_table(
+                            "files",
+                            records=batch,
+                            columns=[
+                                "user_id",
+                                "knowledge_set_id",
+                                "file_id",
+                                "file_metadata",
+                                "created_at",
+                            ],
+                        )
+                        files += len(batch)
+
+                loaded = 0
+                with (
+                    archive.open("chunks.jsonl") as chunk_stream,
+                    archive.open("embeddings.npy") as vector_stream,
+                ):
+                    chunk_lines = _json_lines(chunk_stream)
+                    for vectors in _vector_batches(vector_stream, BATCH_SIZE):
+                        batch = []
+                        for vector in vectors:
+                            chunk = next(chunk_lines)
+                            batch.append(
+                                (
+                                    user_id,
+                                    knowledge_set_id,
+                                    chunk["file_id"],
+                                    chunk["chunk_id"],
+                                    vector.astype(np.float32),
+                                    json.dumps(chunk["metadata"]),
+                                    embedding_model,
+                                )
+                            )
+                        await conn.copy_records_to_table(
+                            "chunks",
+                            records=batch,
+                            columns=[
+                                "user_id",
+                                "knowledge_set_id",
+                                "file_id",
+                                "chunk_id",
+                                "embedding",
+                                "chunk_metadata",
+                                "embedding_model",
+                            ],
+                        )
+                        loaded += len(batch)
+                    if next(chunk_lines, None) is not None:
+                        raise ValueError("Snapshot has more chunks than vectors")
+
+            await conn.execute(
+                f"UPDATE knowledge_sets SET generation = nextval('{db.GENERATION_SEQUENCE}'), "
+                "embedding_model = $3 WHERE user_id = $1 AND knowledge_set_id = $2",
+                user_id,
+                knowledge_set_id,
+                embedding_model,
+            )
+        # Fresh statistics for the set's own partition, not the whole table
+        relation = await conn.fetchval(
+            "SELECT tableoid::regclass::text FROM chunks "
+            "WHERE user_id = $1 AND knowledge_set_id = $2 LIMIT 1",
+            user_id,
+            knowledge_set_id,
+        )
+        if relation:
+            await conn.execute(f"ANALYZE {relation}")
+    finally:
+        await conn.close()
+    return files, loaded
+
+
+async def import_knowledge_set(
+    user_id: str,
+    path: str,
+    knowledge_set_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Load a snapshot into an empty (or new) knowledge set for ``user_id``.
+    Defaults to the knowledge set ID recorded in the snapshot. The set takes
+    the snapshot's embedding model; ``python -m app.reembed`` moves it to
+    another one.
+    """
+    manifest = read_manifest(path)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot format version {manifest.get('format_version')}"
+        )
+    if manifest["embedding_dimension"] != EMBEDDING_DIMENSION:
+        raise ValueError(
+            f"Snapshot vectors have dimension {manifest['embedding_dimension']}, "
+            f"this server uses {EMBEDDING_DIMENSION}"
+        )
+    embedding_model = manifest["embedding_model"]
+    knowledge_set_id = knowledge_set_id or manifest["knowledge_set_id"]
+
+    await db.init_db()
+    created = await db.create_knowledge_set(user_id, knowledge_set_id, embedding_model)
+    try:
+        files, chunks = await _load_snapshot(
+            user_id, knowledge_set_id, embedding_model, path
+        )
+    except Exception:
+        # Don't leave behind the empty set a failed import created
+        if created:
+            await db.delete_knowledge_set(user_id, knowledge_set_id)
+        raise
+
+    return {
+        "knowledge_set_id": knowledge_set_id,
+        "files": files,
+        "chunks": chunks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import knowledge sets")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write a knowledge set snapshot")
+    export.add_argument("--user", required=True, help="Owner user ID")
+    export.add_argument("--knowledge-set", required=True)
+    export.add_argument("--output", required=True, help="Snapshot path (.zip)")
+
+    load = commands.add_parser("import", help="Load a snapshot into a knowledge set")
+    load.add_argument("--user", required=True, help="Owner user ID")
+    load.add_argument("--input", required=True, help="Snapshot path (.zip)")
+    load.add_argument(
+        "--knowledge-set",
+        default=None,
+        help="Target knowledge set ID (defaults to the one in the snapshot)",
+    )
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.command == "export":
+                await db.init_db()
+                return await export_knowledge_set(
+                    args.user, args.knowledge_set, args.output
+                )
+            return await import_knowledge_set(args.user, args.input, args.knowledge_set)
+        finally:
+            await db.dispose()
+
+    try:
+        result = asyncio.run(run())
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
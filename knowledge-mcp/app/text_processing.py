@@ -1,19 +1,198 @@
-from typing import List, Tuple, Dict, Any
+import os
+import tempfile
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple, Dict, Any
+from bisect import bisect_right
+from functools import lru_cache
 from io import BytesIO
+
+import numpy as np
 from markitdown import MarkItDown, StreamInfo, DocumentConverterResult
+from markitdown import __version__ as MARKITDOWN_VERSION
+
+from app.config import (
+    CHUNK_STRATEGY,
+    CHUNK_SIZE_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSION,
+    EMBEDDING_MAX_INPUT_TOKENS,
+    UPLOAD_DIR,
+)
+import app.pdf_extraction as pdf_extraction
+
+
+class TextChunk(NamedTuple):
+    text: str
+    offset: int
+    tokens: int
+
+
+@lru_cache(maxsize=1)
+def get_markitdown() -> MarkItDown:
+    """Process-wide MarkItDown instance; building the converter registry is not free."""
+    return MarkItDown(enable_plugins=False)
 
 
 def extract_text_from_content(
     content: bytes, file_extension: str
 ) -> DocumentConverterResult:
     """Extract text from file content based on content type use Markitdown."""
-    md = MarkItDown(enable_plugins=False)
+    md = get_markitdown()
 
     return md.convert(
         BytesIO(content), stream_info=StreamInfo(extension=file_extension)
     )
 
 
+def extract_text_from_file(path: str, file_extension: str) -> DocumentConverterResult:
+    """Extract text from a file on disk without loading it into memory first."""
+    md = get_markitdown()
+
+    with open(path, "rb") as f:
+        return md.convert(f, stream_info=StreamInfo(extension=file_extension))
+
+
+async def extract_segments_from_content(
+    content: bytes, file_extension: str
+) -> AsyncIterator[str]:
+    """
+    Extracted markdown in order, as one or more segments that join to the
+    whole document. Large PDFs are converted page-parallel and stream out as
+    their leading pages finish; everything else is a single segment.
+    """
+    if file_extension.lower() == "pdf" and pdf_extraction.should_parallelize(
+        pdf_extraction.count_pages(BytesIO(content))
+    ):
+        # Workers open the PDF themselves; hand them a file, not N copies
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".pdf") as f:
+            f.write(content)
+            f.flush()
+            async for segment in extract_segments_from_file(f.name, file_extension):
+                yield segment
+        return
+
+    yield extract_text_from_content(content, file_extension).markdown
+
+
+async def extract_segments_from_file(
+    path: str, file_extension: str
+) -> AsyncIterator[str]:
+    """extract_segments_from_content for a file on disk."""
+    if file_extension.lower() == "pdf":
+        with open(path, "rb") as f:
+            pages = pdf_extraction.count_pages(f)
+        if pdf_extraction.should_parallelize(pages):
+            async for segment in pdf_extraction.extract_pdf_segments(path, pages):
+                yield segment
+            return
+
+    yield extract_text_from_file(path, file_extension).markdown
+
+
+def pipeline_key(file_extension: str, embedding_model: str = EMBEDDING_MODEL) -> str:
+    """
+    Identifies everything that turns an upload's bytes into stored text and
+    vectors: converter version, file type, chunking settings, tokenizer and
+    embedding model. Cached extractions are only reused under the same key.
+    """
+    encoder = get_token_encoder()
+    return "|".join(
+        [
+            f"markitdown={MARKITDOWN_VERSION}",
+            f"ext={file_extension.lower()}",
+            f"chunks={CHUNK_STRATEGY}:{CHUNK_SIZE_TOKENS}:{CHUNK_OVERLAP_TOKENS}",
+            f"tokenizer={encoder.name if encoder is not None else 'none'}",
+            f"embedding={embedding_model}:{EMBEDDING_DIMENSION}",
+        ]
+    )
+
+
+@lru_cache(maxsize=1)
+def get_token_encoder():
+    """
+    Process-wide tiktoken encoding for the embedding model, or None if tiktoken
+    (or its encoding file) is unavailable.
+    """
+    try:
+        import tiktoken
+        from tiktoken.model import encoding_name_for_model
+    except ImportError:
+        print("Warning: tiktoken not available, token counts will be estimated")
+        return None
+
+    try:
+        try:
+            name = encoding_name_for_model(EMBEDDING_MODEL)
+        except KeyError:
+            name = "cl100k_base"
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(
+            f"Warning: could not load tiktoken encoding ({e}), token counts will be estimated"
+        )
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of ``text`` for the embedding model (estimated without tiktoken)."""
+    encoder = get_token_encoder()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode_ordinary(text))
+
+
+def chunk_text_with_tokens(
+    text: str,
+    strategy: str = CHUNK_STRATEGY,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+) -> List[TextChunk]:
+    """
+    Chunk text for embedding, with the token count of every chunk.
+
+    The "token" strategy cuts on the document's own tiktoken encoding, so
+    counts come for free. Other strategies are counted once per chunk, and any
+    chunk over EMBEDDING_MAX_INPUT_TOKENS is split so it can always be embedded.
+    Sizes default to CHUNK_SIZE_TOKENS / CHUNK_OVERLAP_TOKENS for the token
+    strategy and to chunk_text's character defaults otherwise.
+    """
+    if not text:
+        return []
+
+    encoder = get_token_encoder()
+    if strategy == "token":
+        if encoder is not None:
+            return _chunk_by_tokens(
+                text,
+                encoder,
+                min(chunk_size or CHUNK_SIZE_TOKENS, EMBEDDING_MAX_INPUT_TOKENS),
+                CHUNK_OVERLAP_TOKENS if chunk_overlap is None else chunk_overlap,
+            )
+        print(
+            "Warning: token chunking needs tiktoken, falling back to sentence chunking"
+        )
+        strategy, chunk_size, chunk_overlap = "sentence", None, None
+
+    sizes = {}
+    if chunk_size is not None:
+        sizes["chunk_size"] = chunk_size
+    if chunk_overlap is not None:
+        sizes["chunk_overlap"] = chunk_overlap
+
+    chunks = []
+    for chunk, offset in chunk_text(text, strategy, **sizes):
+        tokens = count_tokens(chunk)
+        if tokens > EMBEDDING_MAX_INPUT_TOKENS and encoder is not None:
+            for piece in _chunk_by_tokens(
+                chunk, encoder, EMBEDDING_MAX_INPUT_TOKENS, 0
+            ):
+                chunks.append(piece._replace(offset=offset + piece.offset))
+        else:
+            chunks.append(TextChunk(chunk, offset, tokens))
+    return chunks
+
+
 def chunk_text(
     text: str,
     strategy: str = "sentence",
@@ -37,6 +216,14 @@ def chunk_text(
     if not text:
         return []
 
+    if strategy == "token":
+        encoder = get_token_encoder()
+        if encoder is not None:
+            return [
+                (chunk.text, chunk.offset)
+                for chunk in _chunk_by_tokens(text, encoder, chunk_size, chunk_overlap)
+            ]
+
     # Try to use Chonkie for intelligent chunking
     try:
         return _chunk_with_chonkie(text, strategy, chunk_size, chunk_overlap, **kwargs)
@@ -49,51 +236,68 @@ def chunk_text(
         return _chunk_basic_improved(text, chunk_size, chunk_overlap)
 
 
-def _chunk_with_chonkie(
-    text: str, strategy: str, chunk_size: int, chunk_overlap: int, **kwargs
-) -> List[Tuple[str, int]]:
-    """Use Chonkie library for intelligent chunking."""
-
+@lru_cache(maxsize=16)
+def _get_chonkie_chunker(
+    strategy: str, chunk_size: int, chunk_overlap: int, similarity_threshold: float
+):
+    """Build (and cache) a Chonkie chunker; constructing one loads a tokenizer."""
     if strategy == "sentence":
         from chonkie import SentenceChunker
 
-        chunker = SentenceChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return SentenceChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     elif strategy == "semantic":
         from chonkie import SemanticChunker
 
         # Semantic chunker uses embeddings to determine chunk boundaries
-        chunker = SemanticChunker(
+        return SemanticChunker(
             chunk_size=chunk_size,
-            similarity_threshold=kwargs.get("similarity_threshold", 0.5),
+            similarity_threshold=similarity_threshold,
         )
     elif strategy == "recursive":
         from chonkie import RecursiveChunker
 
-        chunker = RecursiveChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return RecursiveChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     elif strategy == "token":
         from chonkie import TokenChunker
 
-        chunker = TokenChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return TokenChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
     else:
         # Default to sentence chunker
         from chonkie import SentenceChunker
 
-        chunker = SentenceChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return SentenceChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _chunk_with_chonkie(
+    text: str, strategy: str, chunk_size: int, chunk_overlap: int, **kwargs
+) -> List[Tuple[str, int]]:
+    """Use Chonkie library for intelligent chunking."""
+
+    chunker = _get_chonkie_chunker(
+        strategy,
+        chunk_size,
+        chunk_overlap,
+        kwargs.get("similarity_threshold", 0.5),
+    )
 
     # Get chunks from Chonkie
     chunks = chunker(text)
 
-    # Convert to our format with start offsets
+    # Chonkie reports each chunk's start index; only search if it doesn't line up
     result = []
     current_offset = 0
 
     for chunk in chunks:
         chunk_text = chunk.text
-        # Find the actual start position in the original text
-        start_pos = text.find(chunk_text, current_offset)
-        if start_pos == -1:
-            # If exact match not found, use current offset
-            start_pos = current_offset
+        start_pos = getattr(chunk, "start_index", None)
+        if (
+            start_pos is None
+            or text[start_pos : start_pos + len(chunk_text)] != chunk_text
+        ):
+            start_pos = text.find(chunk_text, current_offset)
+            if start_pos == -1:
+                # If exact match not found, use current offset
+                start_pos = current_offset
 
         result.append((chunk_text, start_pos))
         current_offset = start_pos + len(chunk_text)
@@ -101,6 +305,73 @@ def _chunk_with_chonkie(
     return result
 
 
+def _chunk_by_tokens(
+    text: str, encoder, chunk_size: int, chunk_overlap: int
+) -> List[TextChunk]:
+    """
+    Cut ``text`` into windows of at most ``chunk_size`` tokens of its encoding.
+
+    The text is encoded once. Within the last 20% of a window the cut moves
+    back to the latest token that follows a sentence end or newline. Token
+    counts are taken from the document's encoding; a chunk re-encoded on its
+    own can differ by a token at its edges.
+    """
+    tokens = encoder.encode_ordinary(text)
+    count = len(tokens)
+    if count == 0:
+        return []
+
+    # Byte offset where each token starts, plus the end of the text
+    byte_starts = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(
+        np.fromiter(
+            (len(b) for b in encoder.decode_tokens_bytes(tokens)),
+            dtype=np.int64,
+            count=count,
+        ),
+        out=byte_starts[1:],
+    )
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+    # Token k is a good place to cut if the byte before it ends a sentence or line
+    previous = data[byte_starts[1:-1] - 1]
+    is_break = np.isin(previous, np.frombuffer(b".!?\n", dtype=np.uint8))
+    breaks = (np.flatnonzero(is_break) + 1).tolist()
+
+    # Map byte offsets to str offsets (continuation bytes share their lead's char)
+    if len(data) == len(text):
+        char_starts = byte_starts.tolist()
+    else:
+        char_of_byte = np.empty(len(data) + 1, dtype=np.int64)
+        np.cumsum((data & 0xC0) != 0x80, out=char_of_byte[1:])
+        char_of_byte[1:] -= 1
+        char_of_byte[0] = 0
+        char_of_byte[-1] = len(text)
+        char_starts = char_of_byte[byte_starts].tolist()
+
+    chunk_size = max(1, chunk_size)
+    chunks = []
+    start = 0
+    while start < count:
+        end = min(start + chunk_size, count)
+        if end < count:
+            i = bisect_right(breaks, end) - 1
+            if i >= 0 and breaks[i] > start + int(chunk_size * 0.8):
+                end = breaks[i]
+
+        lo, hi = char_starts[start], char_starts[end]
+        raw = text[lo:hi]
+        chunk = raw.strip()
+        if chunk:
+            chunks.append(TextChunk(chunk, lo + raw.find(chunk[0]), end - start))
+
+        if end >= count:
+            break
+        start = max(start + 1, end - chunk_overlap)
+
+    return chunks
+
+
 def _chunk_basic_improved(
     text: str, chunk_size: int, chunk_overlap: int
 ) -> List[Tuple[str, int]]:
@@ -159,10 +430,11 @@ def _chunk_basic_improved(
         # Calculate next start with overlap
         overlap_start = max(start + 1, end - chunk_overlap)
 
-        # Try to start overlap at a word boundary
+        # Try to start overlap at a word boundary. The search stops at the
+        # window end, so long runs without spaces stay linear.
         if overlap_start < end:
-            word_start = text.find(" ", overlap_start)
-            if word_start != -1 and word_start < end:
+            word_start = text.find(" ", overlap_start, end)
+            if word_start != -1:
                 overlap_start = word_start + 1
 
         start = overlap_start
@@ -181,10 +453,11 @@ def get_chunking_info() -> Dict[str, Any]:
             "sentence": "Respects sentence boundaries for natural breaks",
             "semantic": "Uses embeddings to group semantically similar content (requires Chonkie)",
             "recursive": "Tries multiple separators hierarchically (requires Chonkie)",
-            "token": "Token-aware chunking with proper tokenizer support (requires Chonkie)",
+            "token": "Token-exact chunking with the embedding model's tiktoken encoding",
             "basic": "Simple character-based chunking with improved boundary detection",
         },
         "chonkie_available": False,
+        "tiktoken_available": get_token_encoder() is not None,
     }
 
     try:
@@ -0,0 +1,241 @@
+"""
+Chunked upload sessions for large files.
+
+Clients open a session with ``begin_upload``, send the file as a sequence of
+base64-encoded parts and finish with ``commit_upload``. Parts are appended to
+a staging file on disk, so the full file never has to sit in memory as a
+single request body.
+
+A session's state lives in a JSON manifest beside its staging file rather
+than in the process, so a restarted server, or any replica sharing
+UPLOAD_DIR, can carry on with it. A lock on the staging file keeps parts in
+order across processes. Sessions expire after UPLOAD_SESSION_TTL_SECONDS
+without a part arriving.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional, Tuple
+from uuid import UUID, uuid4
+
+from app.config import UPLOAD_DIR, MAX_UPLOAD_SIZE, UPLOAD_SESSION_TTL_SECONDS
+
+_MANIFEST_SUFFIX = ".json"
+_DATA_SUFFIX = ".part"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    user_id: str
+    knowledge_set_id: str
+    filename: str
+    # Wall-clock times, so they mean the same in every process
+    created_at: float = field(default_factory=time.time)
+    last_activity: float = field(default_factory=time.time)
+    next_part_number: int = 1
+    bytes_received: int = 0
+
+    @property
+    def path(self) -> str:
+        return _data_path(self.upload_id)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self.last_activity > UPLOAD_SESSION_TTL_SECONDS
+
+
+# Running SHA-256 of uploads whose parts arrived at this process, by upload ID,
+# with the number of bytes hashed so far
+_hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+
+
+def _checked_id(upload_id: str) -> str:
+    """Upload IDs become file names, so anything but a UUID is unknown."""
+    try:
+        if str(UUID(upload_id)) == upload_id:
+            return upload_id
+    except ValueError:
+        pass
+    raise ValueError(f"Upload session '{upload_id}' not found")
+
+
+def _manifest_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"upload_{upload_id}{_MANIFEST_SUFFIX}")
+
+
+def _data_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"upload_{upload_id}{_DATA_SUFFIX}")
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _read_manifest(upload_id: str) -> Optional[UploadSession]:
+    try:
+        with open(_manifest_path(upload_id)) as f:
+            return UploadSession(**json.load(f))
+    except (FileNotFoundError, ValueError, TypeError):
+        return None
+
+
+def _write_manifest(session: UploadSession):
+    path = _manifest_path(session.upload_id)
+    with open(path + ".tmp", "w") as f:
+        json.dump(asdict(session), f)
+    os.replace(path + ".tmp", path)
+
+
+def _remove_session(upload_id: str):
+    _remove_file(_manifest_path(upload_id))
+    _remove_file(_data_path(upload_id))
+    _hashers.pop(upload_id, None)
+
+
+def purge_expired_sessions() -> int:
+    """Drop expired sessions and their staging files. Returns how many were removed."""
+    try:
+        names = os.listdir(UPLOAD_DIR)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for name in names:
+        if not (name.startswith("upload_") and name.endswith(_MANIFEST_SUFFIX)):
+            continue
+        upload_id = name[len("upload_") : -len(_MANIFEST_SUFFIX)]
+        session = _read_manifest(upload_id)
+        if session is None or session.expired:
+            _remove_session(upload_id)
+            removed += 1
+    # Uploads committed or aborted through another process
+    for upload_id in list(_hashers):
+        if not os.path.exists(_manifest_path(upload_id)):
+            _hashers.pop(upload_id, None)
+    return removed
+
+
+def begin_upload(user_id: str, knowledge_set_id: str, filename: str) -> UploadSession:
+    purge_expired_sessions()
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    session = UploadSession(
+        upload_id=str(uuid4()),
+        user_id=user_id,
+        knowledge_set_id=knowledge_set_id,
+        filename=filename,
+    )
+    open(session.path, "xb").close()
+    _write_manifest(session)
+    _hashers[session.upload_id] = (0, hashlib.sha256())
+    return session
+
+
+def get_session(user_id: str, upload_id: str) -> UploadSession:
+    session = _read_manifest(_checked_id(upload_id))
+    # Sessions of other users are reported as missing, not forbidden
+    if session is None or session.user_id != user_id:
+        raise ValueError(f"Upload session '{upload_id}' not found")
+    if session.expired:
+        abort_upload(user_id, upload_id)
+        raise ValueError(f"Upload session '{upload_id}' has expired")
+    return session
+
+
+def _append_part(
+    user_id: str, upload_id: str, part_number: int, data: bytes
+) -> UploadSession:
+    get_session(user_id, upload_id)
+    with open(_data_path(upload_id), "ab") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # Re-read under the lock: another process may have taken a part meanwhile
+        session = get_session(user_id, upload_id)
+        if part_number != session.next_part_number:
+            raise ValueError(
+                f"Expected part {session.next_part_number} for upload '{upload_id}', got part {part_number}"
+            )
+        if session.bytes_received + len(data) > MAX_UPLOAD_SIZE:
+            abort_upload(user_id, upload_id)
+            raise ValueError(
+                f"Upload exceeds the maximum size of {MAX_UPLOAD_SIZE} bytes and was aborted"
+            )
+
+        f.write(data)
+        f.flush()
+        hashed, hasher = _hashers.get(upload_id, (-1, None))
+        if hashed == session.bytes_received:
+            hasher.update(data)
+            _hashers[upload_id] = (hashed + len(data), hasher)
+        else:
+            _hashers.pop(upload_id, None)
+        session.bytes_received += len(data)
+        session.next_part_number += 1
+        session.last_activity = time.time()
+        _write_manifest(session)
+    return session
+
+
+async def append_part(
+    user_id: str, upload_id: str, part_number: int, data: bytes
+) -> UploadSession:
+    """Append a part to the session. Parts must arrive in order, starting at 1."""
+    return await asyncio.to_thread(_append_part, user_id, upload_id, part_number, data)
+
+
+def finish_upload(user_id: str, upload_id: str) -> UploadSession:
+    """Detach a session for processing. The caller owns (and must remove) its staging file."""
+    get_session(user_id, upload_id)
+    with open(_data_path(upload_id), "ab") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ValueError(f"Upload '{upload_id}' still has a part in flight")
+        session = get_session(user_id, upload_id)
+        if session.bytes_received == 0:
+            raise ValueError(f"Upload '{upload_id}' has no data")
+        _remove_file(_manifest_path(upload_id))
+    return session
+
+
+def _hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+async def content_hash(session: UploadSession) -> str:
+    """
+    SHA-256 of a finished upload: the running hash if every part arrived at
+    this process, otherwise read back from the staging file.
+    """
+    hashed, hasher = _hashers.pop(session.upload_id, (-1, None))
+    if hashed == session.bytes_received:
+        return hasher.hexdigest()
+    return await asyncio.to_thread(_hash_file, session.path)
+
+
+def abort_upload(user_id: str, upload_id: str) -> bool:
+    try:
+        session = _read_manifest(_checked_id(upload_id))
+    except ValueError:
+        return False
+    if session is None or session.user_id != user_id:
+        return False
+    _remove_session(upload_id)
+    return True
+
+
+def discard(session: UploadSession):
+    _remove_file(session.path)
+    _hashers.pop(session.upload_id, None)
@@ -1,21 +1,117 @@
+import asyncio
+import base64
+import bisect
+import hashlib
+import json
 import os
+import time
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, String, JSON, TIMESTAMP, text, select, delete
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    LargeBinary,
+    String,
+    JSON,
+    TIMESTAMP,
+    Row,
+    and_,
+    cast,
+    text,
+    select,
+    delete,
+    func,
+    insert,
+    update,
+    literal,
+    literal_column,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from pgvector.sqlalchemy import Vector
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 # Import configuration from centralized config
-from app.config import DATABASE_URL, EMBEDDING_DIMENSION
+from app.config import (
+    DATABASE_SHARDS,
+    SHARD_VIRTUAL_NODES,
+    SHARD_PLACEMENT_REFRESH_SECONDS,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSION,
+)
+import app.metrics as metrics
+import app.partitions as partitions
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+
+# Database setup: one engine and pool per shard
+class Shard:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.engine = create_async_engine(url, echo=False, poolclass=TimedQueuePool)
+        self.sessionmaker = sessionmaker(
+            bind=self.engine, class_=AsyncSession, expire_on_commit=False
+        )
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """
+    Consistent hash ring of shard names with SHARD_VIRTUAL_NODES points per
+    shard: adding or removing a shard only remaps the users whose points it
+    takes over or gives up (about 1/N of them).
+    """
+
+    def __init__(self, names: Iterable[str]):
+        points = sorted(
+            (_ring_hash(f"{name}#{i}"), name)
+            for name in names
+            for i in range(SHARD_VIRTUAL_NODES)
+        )
+        self._keys = [key for key, _ in points]
+        self._names = [name for _, name in points]
+
+    def shard(self, user_id: str) -> str:
+        i = bisect.bisect(self._keys, _ring_hash(user_id)) % len(self._keys)
+        return self._names[i]
 
-# Database setup
-engine = create_async_engine(DATABASE_URL, echo=False)
-AsyncSessionLocal = sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False
+
+shards: Dict[str, Shard] = {
+    name: Shard(name, url) for name, url in DATABASE_SHARDS.items()
+}
+ring = HashRing(shards)
+# The first shard also holds the tenant placement directory
+directory = next(iter(shards.values()))
+metrics.DB_POOL_CHECKED_OUT.set_function(
+    lambda: sum(shard.engine.pool.checkedout() for shard in shards.values())
 )
 Base = declarative_base()
+# Tables that only exist on the directory shard
+DirectoryBase = declarative_base()
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 100
+
+GENERATION_SEQUENCE = "knowledge_set_generation_seq"
 
 
 # models
@@ -26,6 +122,15 @@ class KnowledgeSet(Base):
     created_at = Column(
         TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
     )
+    # Changes whenever the set's contents do; drawn from a global sequence so
+    # a deleted and recreated set never reuses an old value
+    generation = Column(
+        BigInteger,
+        server_default=text(f"nextval('{GENERATION_SEQUENCE}')"),
+        nullable=False,
+    )
+    # Model that produced the set's live vectors; queries embed with it
+    embedding_model = Column(String, nullable=True)
 
 
 class FileRecord(Base):
@@ -41,24 +146,261 @@ class FileRecord(Base):
 
 class ChunkEntry(Base):
     __tablename__ = "chunks"
+    __table_args__ = partitions.table_args()
     user_id = Column(String, primary_key=True)
     knowledge_set_id = Column(String, primary_key=True)
     file_id = Column(String, primary_key=True)
     chunk_id = Column(String, primary_key=True)
     embedding = Column(Vector(EMBEDDING_DIMENSION), nullable=False)
+    # NULL for rows written before models were tracked: the set's model
+    embedding_model = Column(String, nullable=True)
     chunk_metadata = Column(JSON, nullable=False)
     created_at = Column(
         TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
     )
 
 
+class ChunkReembedding(Base):
+    """Shadow vectors from a re-embed in progress, swapped in at the switch."""
+
+    __tablename__ = "chunk_reembeddings"
+    user_id = Column(String, primary_key=True)
+    knowledge_set_id = Column(String, primary_key=True)
+    file_id = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True)
+    embedding_model = Column(String, nullable=False)
+    embedding = Column(Vector(EMBEDDING_DIMENSION), nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+
+class QueryCacheEntry(Base):
+    __tablename__ = "query_cache"
+    cache_key = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    knowledge_set_id = Column(String, nullable=False)
+    results = Column(JSON, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+
+class ExtractionCacheEntry(Base):
+    """
+    Where the extracted text and embedded chunks of some uploaded bytes
+    already live, so another upload of the same bytes can copy them.
+    """
+
+    __tablename__ = "extraction_cache"
+    scope = Column(String, primary_key=True)
+    content_hash = Column(String, primary_key=True)
+    pipeline = Column(String, primary_key=True)
+    source_user_id = Column(String, nullable=False)
+    source_knowledge_set_id = Column(String, nullable=False)
+    source_file_id = Column(String, nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+
+class FileSignature(Base):
+    """MinHash signature of a file's extracted text, for near-duplicate lookup."""
+
+    __tablename__ = "file_signatures"
+    user_id = Column(String, primary_key=True)
+    knowledge_set_id = Column(String, primary_key=True)
+    file_id = Column(String, primary_key=True)
+    scheme = Column(String, nullable=False)
+    signature = Column(LargeBinary, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+
+class FileSignatureBand(Base):
+    """LSH bucket of one band of a file's signature."""
+
+    __tablename__ = "file_signature_bands"
+    user_id = Column(String, primary_key=True)
+    knowledge_set_id = Column(String, primary_key=True)
+    file_id = Column(String, primary_key=True)
+    band = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger, nullable=False)
+
+
+class TenantPlacement(DirectoryBase):
+    """
+    Users that don't live on their ring shard: pinned before a shard was
+    added, or moved by hand. ``moving_to`` is set while a move copies them.
+    """
+
+    __tablename__ = "tenant_placements"
+    user_id = Column(String, primary_key=True)
+    shard = Column(String, nullable=False)
+    moving_to = Column(String, nullable=True)
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), nullable=False
+    )
+
+
+# shard routing
+class TenantMoving(ValueError):
+    """The user's data is being copied to another shard; writes must wait."""
+
+    def __init__(self, user_id: str):
+        super().__init__(
+            "This user's data is being moved to another database shard; try again shortly"
+        )
+        self.user_id = user_id
+
+
+# user_id -> (shard, moving_to), reloaded from the directory
+_placements: Dict[str, Tuple[str, Optional[str]]] = {}
+_placement_task: Optional[asyncio.Task] = None
+
+
+def placements() -> Dict[str, Tuple[str, Optional[str]]]:
+    return dict(_placements)
+
+
+def shard_for(user_id: str) -> Shard:
+    """The shard holding ``user_id``'s data."""
+    placement = _placements.get(user_id)
+    name = placement[0] if placement else ring.shard(user_id)
+    shard = shards.get(name)
+    if shard is None:
+        raise ValueError(f"User is placed on shard '{name}', which is not configured")
+    return shard
+
+
+def ensure_writable(user_id: str):
+    placement = _placements.get(user_id)
+    if placement and placement[1] is not None:
+        raise TenantMoving(user_id)
+
+
+def _session(user_id: str, write: bool = False) -> AsyncSession:
+    """Session on the user's shard; writes are refused while the user moves."""
+    if write:
+        ensure_writable(user_id)
+    return shard_for(user_id).sessionmaker()
+
+
+async def load_placements():
+    global _placements
+    async with directory.sessionmaker() as session:
+        result = await session.execute(
+            select(
+                TenantPlacement.user_id,
+                TenantPlacement.shard,
+                TenantPlacement.moving_to,
+            )
+        )
+        _placements = {row.user_id: (row.shard, row.moving_to) for row in result}
+
+
+async def _reload_placements_periodically():
+    while True:
+        await asyncio.sleep(SHARD_PLACEMENT_REFRESH_SECONDS)
+        try:
+            await load_placements()
+        except Exception as e:
+            print(f"Warning: could not reload tenant placements: {e}")
+
+
+async def dispose():
+    """Close every shard's pool (CLIs call this before exiting)."""
+    await partitions.wait_for_partition_drops()
+    for shard in shards.values():
+        await shard.engine.dispose()
+
+
 # init database
 async def init_db():
-    async with engine.begin() as conn:
+    global _placement_task
+    for shard in shards.values():
+        await _init_shard(shard)
+    async with directory.engine.begin() as conn:
+        await conn.run_sync(DirectoryBase.metadata.create_all)
+    if len(shards) > 1:
+        await load_placements()
+        if _placement_task is None:
+            _placement_task = asyncio.create_task(_reload_placements_periodically())
+
+
+async def _init_shard(shard: Shard):
+    async with shard.engine.begin() as conn:
         # ensure pgvector extension is enabled
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
+        await conn.execute(
+            text(f"CREATE SEQUENCE IF NOT EXISTS {GENERATION_SEQUENCE};")
+        )
         # create tables and index
         await conn.run_sync(Base.metadata.create_all)
+        # Tables created before generations were tracked
+        await conn.execute(
+            text(
+                "ALTER TABLE knowledge_sets ADD COLUMN IF NOT EXISTS generation BIGINT "
+                f"NOT NULL DEFAULT nextval('{GENERATION_SEQUENCE}');"
+            )
+        )
+        # Tables created before embedding models were tracked. Existing sets
+        # are pinned to the model configured when they are first seen.
+        await conn.execute(
+            text(
+                "ALTER TABLE knowledge_sets ADD COLUMN IF NOT EXISTS embedding_model VARCHAR;"
+            )
+        )
+        await conn.execute(
+            text(
+                "UPDATE knowledge_sets SET embedding_model = :model "
+                "WHERE embedding_model IS NULL;"
+            ),
+            {"model": EMBEDDING_MODEL},
+        )
+        await conn.execute(
+            text("ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding_model VARCHAR;")
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_query_cache_set "
+                "ON query_cache (user_id, knowledge_set_id);"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_extraction_cache_source "
+                "ON extraction_cache (source_user_id, source_knowledge_set_id, source_file_id);"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_file_signature_bands_bucket "
+                "ON file_signature_bands (user_id, knowledge_set_id, band, bucket);"
+            )
+        )
+        await partitions.ensure_layout(conn)
+        # Keyset pagination indexes for the listing tools
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_knowledge_sets_created "
+                "ON knowledge_sets (user_id, created_at, knowledge_set_id);"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_files_created "
+                "ON files (user_id, knowledge_set_id, created_at, file_id);"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_files_filename "
+                "ON files (user_id, knowledge_set_id, (file_metadata->>'filename'), file_id);"
+            )
+        )
         await conn.execute(
             text(
                 "CREATE INDEX IF NOT EXISTS idx_chunks_embedding "
@@ -67,6 +409,141 @@ async def init_db():
         )
 
 
+async def ping() -> bool:
+    """Cheap round trip to every shard, used by the readiness probe."""
+
+    async def _ping(shard: Shard):
+        async with shard.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*[_ping(shard) for shard in shards.values()])
+    return True
+
+
+async def warm_pool(connections: int):
+    """Open ``connections`` pooled connections per shard up front so first requests don't pay for it."""
+
+    async def _open(shard: Shard):
+        async with shard.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            # Hold the connection briefly so the pool has to open distinct ones
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(
+        *[_open(shard) for shard in shards.values() for _ in range(connections)]
+    )
+
+
+async def _vacuum_target(conn, user_id: str, knowledge_set_id: str) -> Optional[str]:
+    """Partition to vacuum after row-level deletes; None when not partitioned."""
+    if partitions.active_mode() == "none":
+        return None
+    return await partitions.chunk_relation(conn, user_id, knowledge_set_id)
+
+
+# keyset pagination helpers
+def encode_cursor(sort_value, row_id: str) -> str:
+    """Opaque cursor pointing just after (sort_value, row_id)."""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: Optional[str], timestamp: bool) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if timestamp:
+            sort_value = datetime.fromisoformat(sort_value)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+    return sort_value, row_id
+
+
+def _keyset(q, sort_key, id_column, after: Optional[tuple], descending: bool):
+    """Order by (sort_key, id_column) and resume strictly after ``after``."""
+    if after is not None:
+        position = tuple_(sort_key, id_column)
+        bound = tuple_(literal(after[0], sort_key.type), literal(after[1]))
+        q = q.where(position < bound if descending else position > bound)
+    if descending:
+        return q.order_by(sort_key.desc(), id_column.desc())
+    return q.order_by(sort_key.asc(), id_column.asc())
+
+
+# cache invalidation
+async def bump_generation(
+    session, user_id: str, knowledge_set_id: str
+) -> Optional[str]:
+    """
+    Mark the set's contents as changed, invalidating cached query results.
+    ``session`` may be an AsyncSession or AsyncConnection inside the write's
+    transaction. Returns the set's embedding model as of this update, which
+    row-locks the set until the transaction ends.
+    """
+    result = await session.execute(
+        text(
+            f"UPDATE knowledge_sets SET generation = nextval('{GENERATION_SEQUENCE}') "
+            "WHERE user_id = :user_id AND knowledge_set_id = :knowledge_set_id "
+            "RETURNING embedding_model"
+        ),
+        {"user_id": user_id, "knowledge_set_id": knowledge_set_id},
+    )
+    await _clear_query_cache(session, user_id, knowledge_set_id)
+    return result.scalar_one_or_none()
+
+
+async def _clear_query_cache(session, user_id: str, knowledge_set_id: str):
+    await session.execute(
+        delete(QueryCacheEntry).where(
+            (QueryCacheEntry.user_id == user_id)
+            & (QueryCacheEntry.knowledge_set_id == knowledge_set_id)
+        )
+    )
+
+
+async def _forget_extraction_source(
+    session, user_id: str, knowledge_set_id: str, file_id: Optional[str] = None
+):
+    """Drop extraction cache entries that point at chunks about to be deleted."""
+    condition = (ExtractionCacheEntry.source_user_id == user_id) & (
+        ExtractionCacheEntry.source_knowledge_set_id == knowledge_set_id
+    )
+    if file_id is not None:
+        condition &= ExtractionCacheEntry.source_file_id == file_id
+    await session.execute(delete(ExtractionCacheEntry).where(condition))
+
+
+async def _forget_signatures(
+    session, user_id: str, knowledge_set_id: str, file_id: Optional[str] = None
+):
+    """Drop near-duplicate signatures of files about to be deleted or superseded."""
+    for table in (FileSignatureBand, FileSignature):
+        condition = (table.user_id == user_id) & (
+            table.knowledge_set_id == knowledge_set_id
+        )
+        if file_id is not None:
+            condition &= table.file_id == file_id
+        await session.execute(delete(table).where(condition))
+
+
+class EmbeddingModelChanged(ValueError):
+    """The knowledge set switched embedding models while vectors were being made."""
+
+    def __init__(self, knowledge_set_id: str, model: str):
+        super().__init__(
+            f"Knowledge set '{knowledge_set_id}' now uses embedding model '{model}'"
+        )
+        self.model = model
+
+
+def model_matches(model: str):
+    """Chunks whose vectors come from ``model`` (NULL: written before tracking)."""
+    return ChunkEntry.embedding_model.is_(None) | (ChunkEntry.embedding_model == model)
+
+
 # validation helpers
 async def validate_knowledge_set_exists(
     session: AsyncSession, user_id: str, knowledge_set_id: str
@@ -96,45 +573,150 @@ async def validate_file_exists(
 
 
 # knowledge set CRUD
-async def create_knowledge_set(user_id: str, knowledge_set_id: str):
-    async with AsyncSessionLocal() as session:
+async def create_knowledge_set(
+    user_id: str, knowledge_set_id: str, embedding_model: str = EMBEDDING_MODEL
+) -> bool:
+    """Create the knowledge set if it doesn't exist; returns whether it was created."""
+    async with _session(user_id, write=True) as session:
         stmt = pg_insert(KnowledgeSet).values(
-            user_id=user_id, knowledge_set_id=knowledge_set_id
+            user_id=user_id,
+            knowledge_set_id=knowledge_set_id,
+            embedding_model=embedding_model,
         )
         stmt = stmt.on_conflict_do_nothing()
-        await session.execute(stmt)
+        result = await session.execute(stmt)
+        await partitions.create_knowledge_set_partition(
+            await session.connection(), knowledge_set_id
+        )
         await session.commit()
+        return result.rowcount > 0
 
 
-async def list_knowledge_sets(user_id: str):
-    async with AsyncSessionLocal() as session:
-        res = await session.execute(
-            select(KnowledgeSet).where(KnowledgeSet.user_id == user_id)
-        )
-        return res.scalars().all()
+async def stream_knowledge_sets(
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+) -> AsyncIterator[Row]:
+    """
+    Yield up to ``limit`` knowledge sets ordered by (created_at, knowledge_set_id),
+    starting after ``cursor``. Rows are streamed from a server-side cursor.
+    """
+    q = select(KnowledgeSet.knowledge_set_id, KnowledgeSet.created_at).where(
+        KnowledgeSet.user_id == user_id
+    )
+    q = _keyset(
+        q,
+        KnowledgeSet.created_at,
+        KnowledgeSet.knowledge_set_id,
+        _decode_cursor(cursor, timestamp=True),
+        descending,
+    ).limit(limit)
 
+    async with _session(user_id) as session:
+        result = await session.stream(q.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for row in result:
+            yield row
 
-async def delete_knowledge_set(user_id: str, knowledge_set_id: str):
-    async with AsyncSessionLocal() as session:
-        await session.execute(
-            delete(ChunkEntry).where(
-                (ChunkEntry.user_id == user_id)
-                & (ChunkEntry.knowledge_set_id == knowledge_set_id)
-            )
-        )
-        await session.execute(
-            delete(FileRecord).where(
-                (FileRecord.user_id == user_id)
-                & (FileRecord.knowledge_set_id == knowledge_set_id)
-            )
+
+async def list_all_knowledge_sets(
+    after: Optional[Tuple[str, str]], limit: int
+) -> List[Row]:
+    """
+    Up to ``limit`` knowledge sets of every user (user_id, knowledge_set_id,
+    embedding_model), ordered by (user_id, knowledge_set_id) after ``after``.
+    """
+    q = select(
+        KnowledgeSet.user_id,
+        KnowledgeSet.knowledge_set_id,
+        KnowledgeSet.embedding_model,
+    )
+    if after is not None:
+        q = q.where(
+            tuple_(KnowledgeSet.user_id, KnowledgeSet.knowledge_set_id)
+            > tuple_(literal(after[0]), literal(after[1]))
         )
-        await session.execute(
-            delete(KnowledgeSet).where(
+    q = q.order_by(KnowledgeSet.user_id, KnowledgeSet.knowledge_set_id).limit(limit)
+
+    async def _page(shard: Shard) -> List[Row]:
+        async with shard.sessionmaker() as session:
+            return (await session.execute(q)).all()
+
+    # Merge the shards' pages; a set mid-move is on two shards, keep it once
+    merged = {}
+    for page in await asyncio.gather(*[_page(shard) for shard in shards.values()]):
+        for row in page:
+            merged.setdefault((row.user_id, row.knowledge_set_id), row)
+    return [merged[key] for key in sorted(merged)[:limit]]
+
+
+async def get_embedding_model(user_id: str, knowledge_set_id: str) -> Optional[str]:
+    """Embedding model of a knowledge set's live vectors, or None if it doesn't exist."""
+    async with _session(user_id) as session:
+        result = await session.execute(
+            select(KnowledgeSet.embedding_model).where(
                 (KnowledgeSet.user_id == user_id)
                 & (KnowledgeSet.knowledge_set_id == knowledge_set_id)
             )
         )
+        return result.scalar_one_or_none()
+
+
+async def delete_knowledge_set(user_id: str, knowledge_set_id: str):
+    async with _session(user_id, write=True) as session:
+        relation, partition = await _delete_knowledge_set_rows(
+            session, user_id, knowledge_set_id
+        )
         await session.commit()
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
+    partitions.schedule_partition_drop(shard_for(user_id).engine, partition)
+
+
+async def _delete_knowledge_set_rows(
+    session, user_id: str, knowledge_set_id: str
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Delete a knowledge set and its data. Returns the partition to vacuum, and
+    the knowledge set whose emptied partition to drop once committed.
+    """
+    conn = await session.connection()
+    # A dedicated partition can only be dropped by the set's owner
+    owned = await validate_knowledge_set_exists(session, user_id, knowledge_set_id)
+    await session.execute(
+        delete(FileRecord).where(
+            (FileRecord.user_id == user_id)
+            & (FileRecord.knowledge_set_id == knowledge_set_id)
+        )
+    )
+    await session.execute(
+        delete(KnowledgeSet).where(
+            (KnowledgeSet.user_id == user_id)
+            & (KnowledgeSet.knowledge_set_id == knowledge_set_id)
+        )
+    )
+    await session.execute(
+        delete(ChunkReembedding).where(
+            (ChunkReembedding.user_id == user_id)
+            & (ChunkReembedding.knowledge_set_id == knowledge_set_id)
+        )
+    )
+    await _clear_query_cache(session, user_id, knowledge_set_id)
+    await _forget_extraction_source(session, user_id, knowledge_set_id)
+    await _forget_signatures(session, user_id, knowledge_set_id)
+
+    # Chunks last: truncating the set's own partition locks only that partition
+    if owned and await partitions.truncate_knowledge_set_partition(
+        conn, knowledge_set_id
+    ):
+        return None, knowledge_set_id
+    relation = await _vacuum_target(conn, user_id, knowledge_set_id)
+    await session.execute(
+        delete(ChunkEntry).where(
+            (ChunkEntry.user_id == user_id)
+            & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+        )
+    )
+    return relation, None
 
 
 # file CRUD
@@ -142,7 +724,7 @@ async def find_file_by_content_hash(
     user_id: str, knowledge_set_id: str, content_hash: str
 ) -> Optional[tuple]:
     """Find a file by its content hash. Returns (file_id, file_metadata) if found."""
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -162,7 +744,7 @@ async def find_file_by_filename(
     user_id: str, knowledge_set_id: str, filename: str
 ) -> Optional[tuple]:
     """Find a file by its filename. Returns (file_id, file_metadata) if found."""
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -182,7 +764,7 @@ async def update_file_metadata(
     user_id: str, knowledge_set_id: str, file_id: str, metadata: dict
 ):
     """Update file metadata for an existing file."""
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id, write=True) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -206,49 +788,68 @@ async def update_file_metadata(
         await session.commit()
 
 
+async def _supersede_version(
+    session: AsyncSession, user_id: str, knowledge_set_id: str, file_id: str
+) -> bool:
+    """
+    Mark a file as no longer the latest version and delete its chunks, in the
+    caller's transaction. Returns False if the file doesn't exist.
+    """
+    result = await session.execute(
+        select(FileRecord.file_metadata).where(
+            (FileRecord.user_id == user_id)
+            & (FileRecord.knowledge_set_id == knowledge_set_id)
+            & (FileRecord.file_id == file_id)
+        )
+    )
+    row = result.first()
+    if not row:
+        return False
+
+    await session.execute(
+        update(FileRecord)
+        .where(
+            (FileRecord.user_id == user_id)
+            & (FileRecord.knowledge_set_id == knowledge_set_id)
+            & (FileRecord.file_id == file_id)
+        )
+        .values(file_metadata={**row.file_metadata, "is_latest_version": False})
+    )
+    await session.execute(
+        delete(ChunkEntry).where(
+            (ChunkEntry.user_id == user_id)
+            & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+            & (ChunkEntry.file_id == file_id)
+        )
+    )
+    await _forget_extraction_source(session, user_id, knowledge_set_id, file_id)
+    await _forget_signatures(session, user_id, knowledge_set_id, file_id)
+    return True
+
+
 async def mark_previous_version_as_old(
     user_id: str, knowledge_set_id: str, previous_file_id: str
 ):
     """Mark a previous version as no longer the latest and delete its chunks."""
-    async with AsyncSessionLocal() as session:
-        # Get the current file metadata
-        result = await session.execute(
-            select(FileRecord.file_metadata).where(
-                (FileRecord.user_id == user_id)
-                & (FileRecord.knowledge_set_id == knowledge_set_id)
-                & (FileRecord.file_id == previous_file_id)
-            )
+    async with _session(user_id, write=True) as session:
+        relation = await _vacuum_target(
+            await session.connection(), user_id, knowledge_set_id
         )
-        row = result.first()
-        if not row:
+        if not await _supersede_version(
+            session, user_id, knowledge_set_id, previous_file_id
+        ):
             return False
-
-        # Update the metadata to mark as not latest
-        current_metadata = row.file_metadata
-        current_metadata["is_latest_version"] = False
-
-        # Update the file record
-        await update_file_metadata(
-            user_id, knowledge_set_id, previous_file_id, current_metadata
-        )
-
-        # Delete chunks for this old version
-        await session.execute(
-            delete(ChunkEntry).where(
-                (ChunkEntry.user_id == user_id)
-                & (ChunkEntry.knowledge_set_id == knowledge_set_id)
-                & (ChunkEntry.file_id == previous_file_id)
-            )
-        )
+        await bump_generation(session, user_id, knowledge_set_id)
         await session.commit()
-        return True
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
+    return True
 
 
 async def get_latest_version_info(
     user_id: str, knowledge_set_id: str, filename: str
 ) -> Optional[tuple]:
     """Get the latest version info for a filename. Returns (file_id, metadata, version)."""
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -271,9 +872,18 @@ async def get_latest_version_info(
 
 
 async def create_file(
-    user_id: str, knowledge_set_id: str, file_id: str, metadata: dict
+    user_id: str,
+    knowledge_set_id: str,
+    file_id: str,
+    metadata: dict,
+    supersedes: Optional[str] = None,
 ):
-    async with AsyncSessionLocal() as session:
+    """
+    Create a file record. ``supersedes`` names a previous version to mark as
+    old and delete the chunks of in the same transaction.
+    """
+    relation = None
+    async with _session(user_id, write=True) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -289,28 +899,82 @@ async def create_file(
             .on_conflict_do_nothing()
         )
         await session.execute(stmt)
+        if supersedes is not None:
+            relation = await _vacuum_target(
+                await session.connection(), user_id, knowledge_set_id
+            )
+            await _supersede_version(session, user_id, knowledge_set_id, supersedes)
+        await bump_generation(session, user_id, knowledge_set_id)
         await session.commit()
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
+
 
+def file_sort_key(sort_by: str):
+    if sort_by == "filename":
+        # Inline the key so the planner can use idx_files_filename
+        return FileRecord.file_metadata.op("->>", return_type=String)(
+            literal_column("'filename'")
+        )
+    return FileRecord.created_at
+
+
+async def stream_files(
+    user_id: str,
+    knowledge_set_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort_by: str = "created_at",
+    descending: bool = False,
+    fields: Optional[List[str]] = None,
+) -> AsyncIterator[Row]:
+    """
+    Yield up to ``limit`` files ordered by (sort key, file_id), starting after
+    ``cursor``. Each row has file_id, file_metadata, created_at and sort_value.
+    With ``fields``, only those metadata keys are read from the database.
+    Rows are streamed from a server-side cursor.
+    """
+    sort_key = file_sort_key(sort_by)
+    if fields:
+        metadata = func.json_build_object(
+            *[
+                part
+                for field in fields
+                for part in (literal(field), FileRecord.file_metadata.op("->")(field))
+            ],
+            type_=JSON,
+        )
+    else:
+        metadata = FileRecord.file_metadata
+
+    q = select(
+        FileRecord.file_id,
+        metadata.label("file_metadata"),
+        FileRecord.created_at,
+        sort_key.label("sort_value"),
+    ).where(
+        (FileRecord.user_id == user_id)
+        & (FileRecord.knowledge_set_id == knowledge_set_id)
+    )
+    q = _keyset(
+        q,
+        sort_key,
+        FileRecord.file_id,
+        _decode_cursor(cursor, timestamp=sort_by == "created_at"),
+        descending,
+    ).limit(limit)
 
-async def list_files(user_id: str, knowledge_set_id: str):
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id) as session:
         # Validate knowledge set exists
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
 
-        res = await session.execute(
-            select(
-                FileRecord.file_id, FileRecord.file_metadata, FileRecord.created_at
-            ).where(
-                (FileRecord.user_id == user_id)
-                & (FileRecord.knowledge_set_id == knowledge_set_id)
-            )
-        )
-        return res.all()
+        result = await session.stream(q.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for row in result:
+            yield row
 
 
 async def delete_file(user_id: str, knowledge_set_id: str, file_id: str):
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id, write=True) as session:
         # First check if the knowledge set exists for this user
         if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
             raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
@@ -327,6 +991,9 @@ async def delete_file(user_id: str, knowledge_set_id: str, file_id: str):
             return False  # File doesn't exist
 
         # Delete chunks first
+        relation = await _vacuum_target(
+            await session.connection(), user_id, knowledge_set_id
+        )
         chunks_deleted = await session.execute(
             delete(ChunkEntry).where(
                 (ChunkEntry.user_id == user_id)
@@ -344,8 +1011,12 @@ async def delete_file(user_id: str, knowledge_set_id: str, file_id: str):
             )
         )
 
+        await _forget_extraction_source(session, user_id, knowledge_set_id, file_id)
+        await _forget_signatures(session, user_id, knowledge_set_id, file_id)
+        await bump_generation(session, user_id, knowledge_set_id)
         await session.commit()
-        return file_deleted.rowcount > 0
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
+    return file_deleted.rowcount > 0
 
 
 # chunk CRUD
@@ -353,7 +1024,7 @@ async def count_chunks_for_file(
     user_id: str, knowledge_set_id: str, file_id: str
 ) -> int:
     """Count the number of chunks for a specific file."""
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id) as session:
         result = await session.execute(
             select(ChunkEntry).where(
                 (ChunkEntry.user_id == user_id)
@@ -365,9 +1036,21 @@ async def count_chunks_for_file(
 
 
 async def upsert_chunks(
-    user_id: str, knowledge_set_id: str, file_id: str, chunks: list
+    user_id: str,
+    knowledge_set_id: str,
+    file_id: str,
+    chunks: list,
+    embedding_model: str,
+    supersedes: Optional[str] = None,
 ):
-    async with AsyncSessionLocal() as session:
+    """
+    Store chunks embedded with ``embedding_model``. Raises
+    EmbeddingModelChanged, writing nothing, if the set has switched to another
+    model since. ``supersedes`` names a previous version to mark as old and
+    delete the chunks of in the same transaction.
+    """
+    relation = None
+    async with _session(user_id, write=True) as session:
         stmt = pg_insert(ChunkEntry)
         vals = []
         for chunk in chunks:
@@ -378,6 +1061,7 @@ async def upsert_chunks(
                     "file_id": file_id,
                     "chunk_id": chunk.chunk_id,
                     "embedding": chunk.embedding,
+                    "embedding_model": embedding_model,
                     "chunk_metadata": chunk.metadata.dict(),
                 }
             )
@@ -391,17 +1075,27 @@ async def upsert_chunks(
             ],
             set_={
                 "embedding": stmt.excluded.embedding,
+                "embedding_model": stmt.excluded.embedding_model,
                 "chunk_metadata": stmt.excluded.chunk_metadata,
             },
         )
         await session.execute(stmt)
+        if supersedes is not None:
+            relation = await _vacuum_target(
+                await session.connection(), user_id, knowledge_set_id
+            )
+            await _supersede_version(session, user_id, knowledge_set_id, supersedes)
+        current = await bump_generation(session, user_id, knowledge_set_id)
+        if current is not None and current != embedding_model:
+            raise EmbeddingModelChanged(knowledge_set_id, current)
         await session.commit()
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
 
 
 async def delete_chunk(
     user_id: str, knowledge_set_id: str, file_id: str, chunk_id: str
 ):
-    async with AsyncSessionLocal() as session:
+    async with _session(user_id, write=True) as session:
         res = await session.execute(
             delete(ChunkEntry).where(
                 (ChunkEntry.user_id == user_id)
@@ -415,9 +1109,14 @@ async def delete_chunk(
 
 
 async def query_chunks(
-    user_id: str, knowledge_set_id: str, embedding: list, top_k: int
+    user_id: str,
+    knowledge_set_id: str,
+    embedding: list,
+    top_k: int,
+    embedding_model: str,
 ):
-    async with AsyncSessionLocal() as session:
+    """Top-k chunks by cosine similarity among vectors from ``embedding_model``."""
+    async with _session(user_id) as session:
         q = (
             select(
                 ChunkEntry.file_id,
@@ -428,9 +1127,708 @@ async def query_chunks(
             .where(
                 (ChunkEntry.user_id == user_id)
                 & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+                & model_matches(embedding_model)
             )
             .order_by(text("score DESC"))  # DESC because higher is now better
             .limit(top_k)
         )
         res = await session.execute(q)
         return res.all()
+
+
+# re-embedding
+def _same_chunk(user_id: str, knowledge_set_id: str):
+    return (
+        (ChunkReembedding.user_id == user_id)
+        & (ChunkReembedding.knowledge_set_id == knowledge_set_id)
+        & (ChunkReembedding.file_id == ChunkEntry.file_id)
+        & (ChunkReembedding.chunk_id == ChunkEntry.chunk_id)
+    )
+
+
+async def chunks_to_reembed(
+    user_id: str,
+    knowledge_set_id: str,
+    model: str,
+    after: Optional[Tuple[str, str]],
+    limit: int,
+) -> List[Row]:
+    """
+    Up to ``limit`` chunks (file_id, chunk_id, chunk_metadata) whose live
+    vector isn't from ``model`` and that have no shadow vector from it yet,
+    ordered by (file_id, chunk_id) after ``after``.
+    """
+    shadowed = (
+        select(literal(1))
+        .where(
+            _same_chunk(user_id, knowledge_set_id)
+            & (ChunkReembedding.embedding_model == model)
+        )
+        .exists()
+    )
+    q = select(
+        ChunkEntry.file_id, ChunkEntry.chunk_id, ChunkEntry.chunk_metadata
+    ).where(
+        (ChunkEntry.user_id == user_id)
+        & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+        & ChunkEntry.embedding_model.is_distinct_from(model)
+        & ~shadowed
+    )
+    if after is not None:
+        q = q.where(
+            tuple_(ChunkEntry.file_id, ChunkEntry.chunk_id)
+            > tuple_(literal(after[0]), literal(after[1]))
+        )
+    q = q.order_by(ChunkEntry.file_id, ChunkEntry.chunk_id).limit(limit)
+    async with _session(user_id) as session:
+        return (await session.execute(q)).all()
+
+
+async def store_reembeddings(
+    user_id: str, knowledge_set_id: str, model: str, vectors: List[tuple]
+):
+    """Save shadow vectors given as (file_id, chunk_id, embedding) tuples."""
+    async with _session(user_id, write=True) as session:
+        stmt = pg_insert(ChunkReembedding).values(
+            [
+                {
+                    "user_id": user_id,
+                    "knowledge_set_id": knowledge_set_id,
+                    "file_id": file_id,
+                    "chunk_id": chunk_id,
+                    "embedding_model": model,
+                    "embedding": embedding,
+                }
+                for file_id, chunk_id, embedding in vectors
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                ChunkReembedding.user_id,
+                ChunkReembedding.knowledge_set_id,
+                ChunkReembedding.file_id,
+                ChunkReembedding.chunk_id,
+            ],
+            set_={
+                "embedding_model": stmt.excluded.embedding_model,
+                "embedding": stmt.excluded.embedding,
+            },
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def clear_reembeddings(
+    user_id: str, knowledge_set_id: str, keep_model: Optional[str] = None
+):
+    """Drop the set's shadow vectors, except those from ``keep_model``."""
+    condition = (ChunkReembedding.user_id == user_id) & (
+        ChunkReembedding.knowledge_set_id == knowledge_set_id
+    )
+    if keep_model is not None:
+        condition &= ChunkReembedding.embedding_model != keep_model
+    async with _session(user_id, write=True) as session:
+        await session.execute(delete(ChunkReembedding).where(condition))
+        await session.commit()
+
+
+async def switch_embedding_model(
+    user_id: str, knowledge_set_id: str, model: str
+) -> int:
+    """
+    Atomically swap the set's shadow vectors from ``model`` into its chunks
+    and make ``model`` the set's query model. Returns the chunks swapped.
+    """
+    async with _session(user_id, write=True) as session:
+        # Chunks before the set row, in the same order as every other writer
+        swapped = await session.execute(
+            update(ChunkEntry)
+            .where(
+                (ChunkEntry.user_id == user_id)
+                & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+                & _same_chunk(user_id, knowledge_set_id)
+                & (ChunkReembedding.embedding_model == model)
+            )
+            .values(embedding=ChunkReembedding.embedding, embedding_model=model)
+        )
+        await session.execute(
+            update(KnowledgeSet)
+            .where(
+                (KnowledgeSet.user_id == user_id)
+                & (KnowledgeSet.knowledge_set_id == knowledge_set_id)
+            )
+            .values(embedding_model=model)
+        )
+        await bump_generation(session, user_id, knowledge_set_id)
+        await session.execute(
+            delete(ChunkReembedding).where(
+                (ChunkReembedding.user_id == user_id)
+                & (ChunkReembedding.knowledge_set_id == knowledge_set_id)
+            )
+        )
+        await session.commit()
+    return swapped.rowcount
+
+
+# version compaction
+def _superseded(user_id: str, knowledge_set_id: str):
+    return (
+        (FileRecord.user_id == user_id)
+        & (FileRecord.knowledge_set_id == knowledge_set_id)
+        & (FileRecord.file_metadata.op("->>")("is_latest_version") == "false")
+    )
+
+
+async def delete_expired_versions(
+    user_id: str,
+    knowledge_set_id: str,
+    keep_versions: int,
+    keep_days: int,
+    limit: int,
+) -> Tuple[int, int]:
+    """
+    Delete up to ``limit`` superseded versions that fall outside the retention
+    policy: beyond the ``keep_versions`` newest versions of their filename and
+    older than ``keep_days`` days (a zero setting doesn't constrain). Latest
+    versions are never deleted. Returns (files deleted, bytes reclaimed).
+    """
+    if not keep_versions and not keep_days:
+        return 0, 0
+
+    filename = FileRecord.file_metadata.op("->>", return_type=String)(
+        literal_column("'filename'")
+    )
+    version = cast(FileRecord.file_metadata.op("->>")("version"), Integer)
+    ranked = (
+        select(
+            FileRecord.file_id,
+            FileRecord.created_at,
+            FileRecord.file_metadata.op("->>")("is_latest_version").label("latest"),
+            func.pg_column_size(FileRecord.file_metadata).label("size"),
+            func.row_number()
+            .over(partition_by=filename, order_by=version.desc())
+            .label("rank"),
+        )
+        .where(
+            (FileRecord.user_id == user_id)
+            & (FileRecord.knowledge_set_id == knowledge_set_id)
+        )
+        .subquery()
+    )
+    conditions = [ranked.c.latest == "false"]
+    if keep_versions:
+        conditions.append(ranked.c.rank > keep_versions)
+    if keep_days:
+        conditions.append(
+            ranked.c.created_at < func.now() - func.make_interval(0, 0, 0, keep_days)
+        )
+
+    async with _session(user_id, write=True) as session:
+        expired = (
+            await session.execute(
+                select(ranked.c.file_id, ranked.c.size)
+                .where(and_(*conditions))
+                .limit(limit)
+            )
+        ).all()
+        if not expired:
+            return 0, 0
+        await session.execute(
+            delete(FileRecord).where(
+                (FileRecord.user_id == user_id)
+                & (FileRecord.knowledge_set_id == knowledge_set_id)
+                & FileRecord.file_id.in_([row.file_id for row in expired])
+            )
+        )
+        await session.commit()
+    return len(expired), sum(row.size for row in expired)
+
+
+async def drop_superseded_text(
+    user_id: str, knowledge_set_id: str, limit: int
+) -> Tuple[int, int]:
+    """
+    Null out the extracted text of up to ``limit`` superseded versions.
+    Returns (files rewritten, bytes reclaimed).
+    """
+    async with _session(user_id, write=True) as session:
+        targets = (
+            await session.execute(
+                select(
+                    FileRecord.file_id,
+                    func.pg_column_size(FileRecord.file_metadata).label("size"),
+                )
+                .where(
+                    _superseded(user_id, knowledge_set_id)
+                    & FileRecord.file_metadata.op("->>")("text").isnot(None)
+                )
+                .limit(limit)
+            )
+        ).all()
+        if not targets:
+            return 0, 0
+        rewritten = await session.execute(
+            FileRecord.__table__.update()
+            .where(
+                (FileRecord.user_id == user_id)
+                & (FileRecord.knowledge_set_id == knowledge_set_id)
+                & FileRecord.file_id.in_([row.file_id for row in targets])
+            )
+            .values(
+                file_metadata=cast(
+                    func.jsonb_set(
+                        cast(FileRecord.file_metadata, JSONB),
+                        literal_column("'{text}'"),
+                        literal_column("'null'::jsonb"),
+                    ),
+                    JSON,
+                )
+            )
+            .returning(func.pg_column_size(FileRecord.file_metadata))
+        )
+        after = sum(rewritten.scalars().all())
+        await session.commit()
+    return len(targets), sum(row.size for row in targets) - after
+
+
+# extraction cache
+async def find_cached_extraction(
+    user_id: str, scope: str, content_hash: str, pipeline: str
+) -> Optional[Row]:
+    """
+    Cache entry for these bytes under ``scope`` and ``pipeline`` on the
+    uploading user's shard, joined with the source file's metadata, or None
+    if there is none or the file is gone.
+    """
+    async with _session(user_id) as session:
+        result = await session.execute(
+            select(
+                ExtractionCacheEntry.source_user_id,
+                ExtractionCacheEntry.source_knowledge_set_id,
+                ExtractionCacheEntry.source_file_id,
+                ExtractionCacheEntry.chunk_count,
+                FileRecord.file_metadata,
+            )
+            .join(
+                FileRecord,
+                (FileRecord.user_id == ExtractionCacheEntry.source_user_id)
+                & (
+                    FileRecord.knowledge_set_id
+                    == ExtractionCacheEntry.source_knowledge_set_id
+                )
+                & (FileRecord.file_id == ExtractionCacheEntry.source_file_id),
+            )
+            .where(
+                (ExtractionCacheEntry.scope == scope)
+                & (ExtractionCacheEntry.content_hash == content_hash)
+                & (ExtractionCacheEntry.pipeline == pipeline)
+            )
+        )
+        return result.first()
+
+
+async def record_extraction(
+    scope: str,
+    content_hash: str,
+    pipeline: str,
+    user_id: str,
+    knowledge_set_id: str,
+    file_id: str,
+    chunk_count: int,
+):
+    """Point the cache entry for these bytes at a freshly ingested file."""
+    async with _session(user_id, write=True) as session:
+        stmt = pg_insert(ExtractionCacheEntry).values(
+            scope=scope,
+            content_hash=content_hash,
+            pipeline=pipeline,
+            source_user_id=user_id,
+            source_knowledge_set_id=knowledge_set_id,
+            source_file_id=file_id,
+            chunk_count=chunk_count,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                ExtractionCacheEntry.scope,
+                ExtractionCacheEntry.content_hash,
+                ExtractionCacheEntry.pipeline,
+            ],
+            set_={
+                "source_user_id": stmt.excluded.source_user_id,
+                "source_knowledge_set_id": stmt.excluded.source_knowledge_set_id,
+                "source_file_id": stmt.excluded.source_file_id,
+                "chunk_count": stmt.excluded.chunk_count,
+                "created_at": func.now(),
+            },
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def create_file_from_cache(
+    user_id: str,
+    knowledge_set_id: str,
+    file_id: str,
+    metadata: dict,
+    source: Row,
+    embedding_model: str,
+    supersedes: Optional[str] = None,
+) -> bool:
+    """
+    Create a file and copy the cached source file's chunks, embedded with
+    ``embedding_model``, to it in one transaction, superseding the previous
+    version ``supersedes`` if given. Returns False, writing nothing, if the
+    source no longer has the chunks the cache entry recorded or the set no
+    longer uses that model.
+    """
+    source_chunks = (
+        (ChunkEntry.user_id == source.source_user_id)
+        & (ChunkEntry.knowledge_set_id == source.source_knowledge_set_id)
+        & (ChunkEntry.file_id == source.source_file_id)
+    )
+    # Chunk IDs are "<file_id>_chunk_<i>"; keep the suffix, swap the file ID
+    chunk_suffix = func.substr(ChunkEntry.chunk_id, len(source.source_file_id) + 1)
+    copy = insert(ChunkEntry).from_select(
+        [
+            ChunkEntry.user_id,
+            ChunkEntry.knowledge_set_id,
+            ChunkEntry.file_id,
+            ChunkEntry.chunk_id,
+            ChunkEntry.embedding,
+            ChunkEntry.embedding_model,
+            ChunkEntry.chunk_metadata,
+        ],
+        select(
+            literal(user_id),
+            literal(knowledge_set_id),
+            literal(file_id),
+            func.concat(literal(file_id), chunk_suffix),
+            ChunkEntry.embedding,
+            func.coalesce(ChunkEntry.embedding_model, literal(embedding_model)),
+            ChunkEntry.chunk_metadata,
+        ).where(source_chunks),
+    )
+
+    relation = None
+    async with _session(user_id, write=True) as session:
+        # Validate knowledge set exists
+        if not await validate_knowledge_set_exists(session, user_id, knowledge_set_id):
+            raise ValueError(f"Knowledge set '{knowledge_set_id}' not found for user")
+        await session.execute(
+            pg_insert(FileRecord)
+            .values(
+                user_id=user_id,
+                knowledge_set_id=knowledge_set_id,
+                file_id=file_id,
+                file_metadata=metadata,
+            )
+            .on_conflict_do_nothing()
+        )
+        copied = await session.execute(copy)
+        if supersedes is not None:
+            relation = await _vacuum_target(
+                await session.connection(), user_id, knowledge_set_id
+            )
+            await _supersede_version(session, user_id, knowledge_set_id, supersedes)
+        current = await bump_generation(session, user_id, knowledge_set_id)
+        if copied.rowcount != source.chunk_count or current != embedding_model:
+            await session.rollback()
+            return False
+        await session.commit()
+    partitions.schedule_vacuum(shard_for(user_id).engine, relation)
+    return True
+
+
+# near-duplicate signatures
+async def store_file_signature(
+    user_id: str,
+    knowledge_set_id: str,
+    file_id: str,
+    scheme: str,
+    signature: bytes,
+    buckets: List[int],
+):
+    """Record a file's signature and its LSH bucket per band."""
+    async with _session(user_id, write=True) as session:
+        await session.execute(
+            pg_insert(FileSignature)
+            .values(
+                user_id=user_id,
+                knowledge_set_id=knowledge_set_id,
+                file_id=file_id,
+                scheme=scheme,
+                signature=signature,
+            )
+            .on_conflict_do_nothing()
+        )
+        await session.execute(
+            pg_insert(FileSignatureBand)
+            .values(
+                [
+                    {
+                        "user_id": user_id,
+                        "knowledge_set_id": knowledge_set_id,
+                        "file_id": file_id,
+                        "band": band,
+                        "bucket": bucket,
+                    }
+                    for band, bucket in enumerate(buckets)
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+        await session.commit()
+
+
+async def find_near_duplicate_candidates(
+    user_id: str, knowledge_set_id: str, scheme: str, buckets: List[int], limit: int
+) -> List[Row]:
+    """
+    Latest-version files whose signature shares at least one LSH bucket with
+    ``buckets``, most shared bands first: (file_id, filename, version,
+    signature, shared).
+    """
+    async with _session(user_id) as session:
+        shared = (
+            select(FileSignatureBand.file_id, func.count().label("shared"))
+            .where(
+                (FileSignatureBand.user_id == user_id)
+                & (FileSignatureBand.knowledge_set_id == knowledge_set_id)
+                & tuple_(FileSignatureBand.band, FileSignatureBand.bucket).in_(
+                    list(enumerate(buckets))
+                )
+            )
+            .group_by(FileSignatureBand.file_id)
+            .subquery()
+        )
+        q = (
+            select(
+                FileSignature.file_id,
+                FileRecord.file_metadata.op("->>")("filename").label("filename"),
+                FileRecord.file_metadata.op("->>")("version").label("version"),
+                FileSignature.signature,
+                shared.c.shared,
+            )
+            .join(shared, FileSignature.file_id == shared.c.file_id)
+            .join(
+                FileRecord,
+                (FileRecord.user_id == FileSignature.user_id)
+                & (FileRecord.knowledge_set_id == FileSignature.knowledge_set_id)
+                & (FileRecord.file_id == FileSignature.file_id),
+            )
+            .where(
+                (FileSignature.user_id == user_id)
+                & (FileSignature.knowledge_set_id == knowledge_set_id)
+                & (FileSignature.scheme == scheme)
+                & (FileRecord.file_metadata.op("->>")("is_latest_version") == "true")
+            )
+            .order_by(shared.c.shared.desc())
+            .limit(limit)
+        )
+        return (await session.execute(q)).all()
+
+
+async def get_chunk_vectors(
+    user_id: str, knowledge_set_id: str, file_id: str, embedding_model: str
+) -> Dict[str, List[float]]:
+    """Chunk text -> vector for a file's chunks embedded with ``embedding_model``."""
+    async with _session(user_id) as session:
+        result = await session.execute(
+            select(
+                ChunkEntry.chunk_metadata.op("->>")("text").label("text"),
+                ChunkEntry.embedding,
+            ).where(
+                (ChunkEntry.user_id == user_id)
+                & (ChunkEntry.knowledge_set_id == knowledge_set_id)
+                & (ChunkEntry.file_id == file_id)
+                & model_matches(embedding_model)
+            )
+        )
+        return {row.text: row.embedding.tolist() for row in result}
+
+
+# query cache
+async def get_generation(user_id: str, knowledge_set_id: str) -> Optional[int]:
+    """Current generation of a knowledge set, or None if it doesn't exist."""
+    async with _session(user_id) as session:
+        result = await session.execute(
+            select(KnowledgeSet.generation).where(
+                (KnowledgeSet.user_id == user_id)
+                & (KnowledgeSet.knowledge_set_id == knowledge_set_id)
+            )
+        )
+        return result.scalar_one_or_none()
+
+
+async def get_cached_query(
+    user_id: str, cache_key: str, ttl_seconds: int
+) -> Optional[list]:
+    async with _session(user_id) as session:
+        result = await session.execute(
+            select(QueryCacheEntry.results).where(
+                (QueryCacheEntry.cache_key == cache_key)
+                & (
+                    QueryCacheEntry.created_at
+                    > func.now() - func.make_interval(0, 0, 0, 0, 0, 0, ttl_seconds)
+                )
+            )
+        )
+        return result.scalar_one_or_none()
+
+
+async def store_cached_query(
+    cache_key: str, user_id: str, knowledge_set_id: str, results: list
+):
+    async with _session(user_id) as session:
+        stmt = pg_insert(QueryCacheEntry).values(
+            cache_key=cache_key,
+            user_id=user_id,
+            knowledge_set_id=knowledge_set_id,
+            results=results,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[QueryCacheEntry.cache_key],
+            set_={"results": stmt.excluded.results, "created_at": func.now()},
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def purge_expired_queries(ttl_seconds: int) -> int:
+    purged = 0
+    for shard in shards.values():
+        async with shard.sessionmaker() as session:
+            result = await session.execute(
+                delete(QueryCacheEntry).where(
+                    QueryCacheEntry.created_at
+                    <= func.now() - func.make_interval(0, 0, 0, 0, 0, 0, ttl_seconds)
+                )
+            )
+            await session.commit()
+            purged += result.rowcount
+    return purged
+
+
+# tenant placement and moves
+# Everything a user owns, parents first, with the column naming the owner
+TENANT_TABLES = [
+    (KnowledgeSet, KnowledgeSet.user_id),
+    (FileRecord, FileRecord.user_id),
+    (ChunkEntry, ChunkEntry.user_id),
+    (ChunkReembedding, ChunkReembedding.user_id),
+    (FileSignature, FileSignature.user_id),
+    (FileSignatureBand, FileSignatureBand.user_id),
+    (ExtractionCacheEntry, ExtractionCacheEntry.source_user_id),
+]
+
+
+async def list_tenants(shard: Shard) -> List[str]:
+    """Users with at least one knowledge set stored on ``shard``."""
+    async with shard.sessionmaker() as session:
+        result = await session.execute(
+            select(KnowledgeSet.user_id).distinct().order_by(KnowledgeSet.user_id)
+        )
+        return list(result.scalars())
+
+
+async def set_placement(user_id: str, shard: str, moving_to: Optional[str] = None):
+    """Pin ``user_id`` to ``shard``, or clear the pin if the ring agrees with it."""
+    async with directory.sessionmaker() as session:
+        if shard == ring.shard(user_id) and moving_to is None:
+            await session.execute(
+                delete(TenantPlacement).where(TenantPlacement.user_id == user_id)
+            )
+        else:
+            stmt = pg_insert(TenantPlacement).values(
+                user_id=user_id, shard=shard, moving_to=moving_to
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TenantPlacement.user_id],
+                set_={
+                    "shard": stmt.excluded.shard,
+                    "moving_to": stmt.excluded.moving_to,
+                    "updated_at": func.now(),
+                },
+            )
+            await session.execute(stmt)
+        await session.commit()
+
+
+async def copy_tenant(
+    user_id: str, source: Shard, target: Shard, batch_size: int
+) -> Dict[str, int]:
+    """
+    Copy every row ``user_id`` owns from ``source`` to ``target`` in one
+    target transaction, reading one consistent snapshot of the source. Rows
+    already on the target are kept, so an interrupted copy can be rerun.
+    Returns rows copied per table.
+    """
+    copied = {}
+    async with source.engine.connect() as src:
+        src = await src.execution_options(isolation_level="REPEATABLE READ")
+        async with src.begin(), target.engine.begin() as dst:
+            knowledge_sets = await src.execute(
+                select(KnowledgeSet.knowledge_set_id).where(
+                    KnowledgeSet.user_id == user_id
+                )
+            )
+            for knowledge_set_id in knowledge_sets.scalars():
+                await partitions.create_knowledge_set_partition(dst, knowledge_set_id)
+
+            for model, owner in TENANT_TABLES:
+                table = model.__table__
+                rows = await src.stream(
+                    select(table)
+                    .where(owner == user_id)
+                    .execution_options(yield_per=batch_size)
+                )
+                count = 0
+                async for batch in rows.partitions():
+                    await dst.execute(
+                        pg_insert(table).on_conflict_do_nothing(),
+                        [dict(row._mapping) for row in batch],
+                    )
+                    count += len(batch)
+                copied[table.name] = count
+
+            # The target's sequence may be behind the source's: move it past
+            # every copied generation before giving the sets fresh ones
+            await dst.execute(
+                text(
+                    f"SELECT setval('{GENERATION_SEQUENCE}', GREATEST("
+                    f"(SELECT last_value FROM {GENERATION_SEQUENCE}), "
+                    "(SELECT COALESCE(max(generation), 1) FROM knowledge_sets "
+                    "WHERE user_id = :user_id)))"
+                ),
+                {"user_id": user_id},
+            )
+            await dst.execute(
+                update(KnowledgeSet)
+                .where(KnowledgeSet.user_id == user_id)
+                .values(generation=func.nextval(GENERATION_SEQUENCE))
+            )
+    return copied
+
+
+async def delete_tenant(user_id: str, shard: Shard):
+    """Delete everything ``user_id`` owns on ``shard`` (after a move away)."""
+    relations = set()
+    dropped_partitions = []
+    async with shard.sessionmaker() as session:
+        knowledge_sets = await session.execute(
+            select(KnowledgeSet.knowledge_set_id).where(KnowledgeSet.user_id == user_id)
+        )
+        for knowledge_set_id in list(knowledge_sets.scalars()):
+            relation, partition = await _delete_knowledge_set_rows(
+                session, user_id, knowledge_set_id
+            )
+            relations.add(relation)
+            dropped_partitions.append(partition)
+        await session.execute(
+            delete(QueryCacheEntry).where(QueryCacheEntry.user_id == user_id)
+        )
+        await session.commit()
+    for relation in relations:
+        partitions.schedule_vacuum(shard.engine, relation)
+    for partition in dropped_partitions:
+        partitions.schedule_partition_drop(shard.engine, partition)
@@ -0,0 +1,163 @@
+"""
+Equivalence check and timing for the basic chunker.
+
+``reference_chunk`` is the original implementation, kept here as the oracle.
+For many random texts and chunk settings the current chunker must produce
+the same chunks at the same offsets. Then both are timed on multi-megabyte
+documents, and on a long run without spaces, where the original scanned to
+the next space anywhere in the text for every window.
+
+Usage:
+    uv run python -m benchmarks.chunking --cases 2000 --sizes 1000000,5000000
+"""
+
+import argparse
+import random
+import sys
+import time
+from typing import List, Tuple
+
+from app.text_processing import _chunk_basic_improved
+from benchmarks.corpus import generate_document
+
+_ALPHABET = "abc de.f!g?h\n\n  xyz.\n?\n!\t é中"
+
+
+def reference_chunk(
+    text: str, chunk_size: int, chunk_overlap: int
+) -> List[Tuple[str, int]]:
+    """The original _chunk_basic_improved, verbatim."""
+    chunks = []
+    start = 0
+
+    while start < len(text):
+        end = start + chunk_size
+
+        if end < len(text):
+            boundary_search_start = start + int(chunk_size * 0.8)
+
+            sentence_patterns = [". ", "! ", "? ", ".\n", "!\n", "?\n"]
+            best_boundary = -1
+
+            for pattern in sentence_patterns:
+                boundary = text.find(pattern, boundary_search_start, end)
+                if boundary > best_boundary:
+                    best_boundary = boundary + len(pattern)
+
+            if best_boundary > boundary_search_start:
+                end = best_boundary
+            else:
+                para_break = text.find("\n\n", boundary_search_start, end)
+                if para_break > boundary_search_start:
+                    end = para_break + 2
+                else:
+                    line_break = text.rfind("\n", boundary_search_start, end)
+                    if line_break > boundary_search_start:
+                        end = line_break + 1
+                    else:
+                        word_boundary = text.rfind(" ", boundary_search_start, end)
+                        if word_boundary > boundary_search_start:
+                            end = word_boundary + 1
+
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append((chunk, start))
+
+        if end >= len(text):
+            break
+
+        overlap_start = max(start + 1, end - chunk_overlap)
+
+        if overlap_start < end:
+            word_start = text.find(" ", overlap_start)
+            if word_start != -1 and word_start < end:
+                overlap_start = word_start + 1
+
+        start = overlap_start
+
+        if start >= len(text):
+            break
+
+    return chunks
+
+
+def check_case(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Return a list of problems (empty if the chunkers agree)."""
+    expected = reference_chunk(text, chunk_size, chunk_overlap)
+    actual = _chunk_basic_improved(text, chunk_size, chunk_overlap)
+    problems = []
+    if [c for c, _ in actual] != [c for c, _ in expected]:
+        problems.append("chunk texts differ")
+    elif [o for _, o in actual] != [o for _, o in expected]:
+        problems.append("chunk offsets differ")
+    return problems
+
+
+def run_equivalence(cases: int, seed: int) -> int:
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        length = rng.randint(0, 3000)
+        text = "".join(rng.choices(_ALPHABET, k=length))
+        chunk_size = rng.randint(1, 400)
+        chunk_overlap = rng.randint(0, chunk_size + 50)
+        problems = check_case(text, chunk_size, chunk_overlap)
+        if problems:
+            failures += 1
+            print(
+                f"case {case}: size={chunk_size} overlap={chunk_overlap} "
+                f"len={length}: {', '.join(problems)}"
+            )
+    return failures
+
+
+def _time(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def run_timing(sizes: List[int], chunk_size: int, chunk_overlap: int, seed: int):
+    for size in sizes:
+        text = generate_document(size, seed=seed)
+        old = _time(reference_chunk, text, chunk_size, chunk_overlap)
+        new = _time(_chunk_basic_improved, text, chunk_size, chunk_overlap)
+        problems = check_case(text, chunk_size, chunk_overlap)
+        print(
+            f"{size / 1e6:6.1f} MB: reference {old * 1000:8.1f} ms, "
+            f"current {new * 1000:8.1f} ms "
+            f"({old / new if new else float('inf'):.1f}x)"
+            + (f"  MISMATCH: {', '.join(problems)}" if problems else "")
+        )
+
+    # Embedded base64 and the like: no space until the very end
+    text = "A" * max(sizes, default=0) + " end"
+    old = _time(reference_chunk, text, chunk_size, chunk_overlap)
+    new = _time(_chunk_basic_improved, text, chunk_size, chunk_overlap)
+    print(
+        f"{len(text) / 1e6:6.1f} MB without spaces: reference {old * 1000:8.1f} ms, "
+        f"current {new * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Basic chunker equivalence and timing")
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(x) for x in s.split(",") if x],
+        default=[1_000_000, 5_000_000],
+    )
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = run_equivalence(args.cases, args.seed)
+    print(f"{args.cases - failures}/{args.cases} random cases match the reference")
+    run_timing(args.sizes, args.chunk_size, args.chunk_overlap, args.seed)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Synthetic corpora for benchmarking ingest and query.
+
+Documents are built from a fixed vocabulary with a seeded RNG, so the same
+arguments always produce byte-identical files. Text is arranged into sentences
+and paragraphs so that the chunkers see realistic boundaries.
+"""
+
+import random
+from typing import Iterator, List, Tuple
+
+_VOCABULARY = (
+    "system data policy network storage request response client server "
+    "index vector query latency throughput document section table value "
+    "config parameter version release user account access token limit "
+    "cluster node replica shard backup restore metric alert incident review "
+    "process thread memory cache buffer queue batch stream record field"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_VOCABULARY, k=rng.randint(6, 20))
+    words[0] = words[0].capitalize()
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), str(rng.randint(1, 100_000)))
+    return " ".join(words) + rng.choice([".", ".", ".", "?", "!"])
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+
+
+def generate_document(size_bytes: int, seed: int = 0) -> str:
+    """Generate a markdown document of roughly ``size_bytes`` characters."""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    section = 1
+    while total < size_bytes:
+        if rng.random() < 0.15:
+            block = f"## Section {section}"
+            section += 1
+        else:
+            block = _paragraph(rng)
+        parts.append(block)
+        total += len(block) + 2
+    return "\n\n".join(parts)[:size_bytes]
+
+
+def generate_corpus(
+    num_files: int, file_size_bytes: int, seed: int = 0
+) -> Iterator[Tuple[str, bytes]]:
+    """Yield ``(filename, content)`` pairs for a synthetic corpus."""
+    for i in range(num_files):
+        text = generate_document(file_size_bytes, seed=seed * 1_000_003 + i)
+        yield f"bench_{seed}_{i:06d}.md", text.encode("utf-8")
+
+
+def generate_queries(num_queries: int, seed: int = 0) -> List[str]:
+    """Generate short natural-language style queries."""
+    rng = random.Random(seed ^ 0x5EED)
+    return [
+        " ".join(rng.choices(_VOCABULARY, k=rng.randint(3, 8)))
+        for _ in range(num_queries)
+    ]
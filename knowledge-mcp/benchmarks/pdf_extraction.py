@@ -0,0 +1,140 @@
+"""
+Equivalence check and timing for page-parallel PDF extraction.
+
+Builds a synthetic multi-page PDF, converts it once with MarkItDown (the
+single-pass path) and once with ``extract_segments_from_file`` (page shards
+on the worker pool), and checks that the joined segments are the same
+markdown. Then times both.
+
+Usage:
+    uv run python -m benchmarks.pdf_extraction --pages 1000 --workers 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from benchmarks.corpus import generate_document
+
+LINES_PER_PAGE = 60
+CHARS_PER_LINE = 90
+
+
+def _pdf_string(line: str) -> str:
+    escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal PDF with one Helvetica text block per page."""
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree exists
+    page_tree = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 760 Td"]
+        for line in lines:
+            ops.append(f"{_pdf_string(line)} Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content = add(
+            b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        )
+        kids.append(
+            add(
+                (
+                    f"<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>"
+                ).encode()
+            )
+        )
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {page_tree} 0 R >>".encode()
+    objects[page_tree - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] "
+        f"/Count {len(kids)} >>"
+    ).encode()
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, catalog, xref)
+        )
+
+
+def make_pages(count: int, seed: int) -> List[List[str]]:
+    text = generate_document(count * LINES_PER_PAGE * CHARS_PER_LINE, seed=seed)
+    lines = []
+    for paragraph in text.split("\n"):
+        while len(paragraph) > CHARS_PER_LINE:
+            cut = paragraph.rfind(" ", 0, CHARS_PER_LINE) + 1 or CHARS_PER_LINE
+            lines.append(paragraph[:cut].rstrip())
+            paragraph = paragraph[cut:]
+        lines.append(paragraph)
+    return [lines[i * LINES_PER_PAGE : (i + 1) * LINES_PER_PAGE] for i in range(count)]
+
+
+async def extract_parallel(path: str) -> List[str]:
+    from app.text_processing import extract_segments_from_file
+
+    return [segment async for segment in extract_segments_from_file(path, "pdf")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Page-parallel PDF extraction check")
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--pages-per-shard", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Read by app.config on import
+    os.environ["PDF_EXTRACTION_WORKERS"] = str(args.workers)
+    os.environ["PDF_PAGES_PER_SHARD"] = str(args.pages_per_shard)
+    os.environ["PDF_PARALLEL_MIN_PAGES"] = "1"
+    from app.text_processing import extract_text_from_file
+    import app.pdf_extraction as pdf_extraction
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        write_pdf(path, make_pages(args.pages, args.seed))
+
+        started = time.perf_counter()
+        expected = extract_text_from_file(path, "pdf").markdown
+        single = time.perf_counter() - started
+
+        # Start the workers outside the timed run
+        pdf_extraction.get_pool().submit(int).result()
+        started = time.perf_counter()
+        segments = asyncio.run(extract_parallel(path))
+        parallel = time.perf_counter() - started
+
+    same = "".join(segments) == expected
+    print(
+        f"{args.pages} pages, {len(expected)} chars: single pass {single:.2f} s, "
+        f"{args.workers} workers {parallel:.2f} s ({single / parallel:.1f}x), "
+        f"{len(segments)} segments, {'identical' if same else 'MISMATCH'}"
+    )
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()